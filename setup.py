@@ -5,6 +5,7 @@ install_requires = [
         'pandas',
         'matplotlib',
         'svgpath2mpl',
+        'scipy',
         'ipython',
 ]
 
@@ -16,13 +17,14 @@ setup(
     packages=find_packages(),
     include_package_data=True,  # ← IMPORTANT
     package_data={
-        'subcortex_visualization': ['data/*/*.svg', 'data/*/vectors/*', 'data/*/*.csv', 'atlases/*/*/*.nii.gz', 'atlases/*/*/*.csv'],
+        'subcortex_visualization': ['data/*/*.svg', 'data/*/vectors/*', 'data/*/*.csv', 'data/*/*.npz', 'atlases/*/*/*.nii.gz', 'atlases/*/*/*.csv', 'atlases/*/*/*.npz'],
     },
     install_requires=[
         'numpy',
         'pandas',
         'matplotlib',
         'svgpath2mpl',
+        'scipy',
         'ipython',
     ],
 )
@@ -0,0 +1,815 @@
+# Necessary imports
+import numpy as np
+
+# Ordered mapping for least-recently-used eviction
+from collections import OrderedDict
+
+# Lock so that threads sharing the cache see a consistent state
+import threading
+
+# On-disk cache
+import os
+import hashlib
+import tempfile
+import zipfile
+import json
+
+# Sparse parcel-averaging matrices
+from scipy import sparse
+
+# Memory-mapped .npz reading, shared with plotting
+from .utils import _load_npz
+
+# Shared-memory store
+import sys
+import pickle
+from multiprocessing import shared_memory
+
+# Entries attached from a shared-memory store (see ``create_shared_atlas_store``). They are
+# looked up after the process's own cache, never evicted, and not counted against its limit.
+_SHARED_STORE = {
+    'shm': None,
+    'owner': False,
+    'entries': {},
+    'nbytes': 0,
+}
+
+# Process-level cache of decoded atlases, parcel layouts and derived matrices.
+# Keys are tuples whose first element names the kind of entry, e.g.
+# ('atlas', atlas_space, atlas) or ('layout', atlas_space, atlas, <grid>, ...).
+_ATLAS_CACHE = OrderedDict()
+_ATLAS_CACHE_LOCK = threading.RLock()
+_ATLAS_CACHE_STATE = {
+    'max_bytes': 1024**3,
+    'nbytes': 0,
+    'hits': 0,
+    'misses': 0,
+    'evictions': 0,
+}
+
+def _entry_nbytes(value):
+    """
+    Estimate the memory held by a cache entry.
+
+    Parameters
+    ----------
+    value : object
+        A NumPy array, scipy sparse matrix, or a (possibly nested) dict, list or tuple of them.
+        Anything else counts as zero bytes.
+
+    Returns
+    -------
+    int
+        Approximate number of bytes.
+    """
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if sparse.issparse(value):
+        return sum(getattr(value, attr).nbytes for attr in ('data', 'indices', 'indptr') if hasattr(value, attr))
+    if isinstance(value, dict):
+        return sum(_entry_nbytes(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(_entry_nbytes(v) for v in value)
+    return 0
+
+def _cache_get(key):
+    """
+    Return the cached value for ``key`` (marking it as recently used), or None if absent.
+    """
+    with _ATLAS_CACHE_LOCK:
+        if key in _ATLAS_CACHE:
+            _ATLAS_CACHE.move_to_end(key)
+            _ATLAS_CACHE_STATE['hits'] += 1
+            return _ATLAS_CACHE[key][0]
+        if key in _SHARED_STORE['entries']:
+            _ATLAS_CACHE_STATE['hits'] += 1
+            return _SHARED_STORE['entries'][key]
+        _ATLAS_CACHE_STATE['misses'] += 1
+        return None
+
+def _cache_put(key, value):
+    """
+    Store ``value`` under ``key``, evicting least-recently-used entries to stay within the size limit.
+
+    Values larger than the limit on their own are not stored.
+
+    Returns
+    -------
+    object
+        ``value``, so calls can be chained.
+    """
+    nbytes = _entry_nbytes(value)
+    with _ATLAS_CACHE_LOCK:
+        if key in _ATLAS_CACHE:
+            _ATLAS_CACHE_STATE['nbytes'] -= _ATLAS_CACHE.pop(key)[1]
+
+        if nbytes > _ATLAS_CACHE_STATE['max_bytes']:
+            return value
+
+        _ATLAS_CACHE[key] = (value, nbytes)
+        _ATLAS_CACHE_STATE['nbytes'] += nbytes
+        _evict()
+    return value
+
+def _evict():
+    """Drop least-recently-used entries until the cache fits within its size limit."""
+    with _ATLAS_CACHE_LOCK:
+        while _ATLAS_CACHE and _ATLAS_CACHE_STATE['nbytes'] > _ATLAS_CACHE_STATE['max_bytes']:
+            _, (_, nbytes) = _ATLAS_CACHE.popitem(last=False)
+            _ATLAS_CACHE_STATE['nbytes'] -= nbytes
+            _ATLAS_CACHE_STATE['evictions'] += 1
+
+def clear_atlas_cache():
+    """
+    Remove every decoded atlas, lookup table and parcel layout held in memory by this process.
+
+    Returns
+    -------
+    None
+    """
+    with _ATLAS_CACHE_LOCK:
+        _ATLAS_CACHE.clear()
+        _ATLAS_CACHE_STATE.update(nbytes=0, hits=0, misses=0, evictions=0)
+
+def set_atlas_cache_limit(max_bytes):
+    """
+    Set the maximum memory used by the in-process atlas cache.
+
+    Parameters
+    ----------
+    max_bytes : int
+        Size limit in bytes. Least-recently-used entries are evicted immediately if the
+        cache is above the new limit. Use 0 to disable caching.
+
+    Returns
+    -------
+    None
+    """
+    if max_bytes < 0:
+        raise ValueError(f"max_bytes must be non-negative; got {max_bytes}.")
+    with _ATLAS_CACHE_LOCK:
+        _ATLAS_CACHE_STATE['max_bytes'] = int(max_bytes)
+        _evict()
+
+def atlas_cache_stats():
+    """
+    Report the state of the in-process atlas cache.
+
+    Returns
+    -------
+    dict
+        With keys 'entries' (number of cached items), 'nbytes' (approximate memory held),
+        'max_bytes' (size limit), 'hits', 'misses', 'evictions', 'keys' (the cached
+        keys, least recently used first), and 'shared_entries' and 'shared_nbytes' for
+        entries attached from a shared-memory store.
+    """
+    with _ATLAS_CACHE_LOCK:
+        return {
+            'entries': len(_ATLAS_CACHE),
+            'nbytes': _ATLAS_CACHE_STATE['nbytes'],
+            'max_bytes': _ATLAS_CACHE_STATE['max_bytes'],
+            'hits': _ATLAS_CACHE_STATE['hits'],
+            'misses': _ATLAS_CACHE_STATE['misses'],
+            'evictions': _ATLAS_CACHE_STATE['evictions'],
+            'keys': list(_ATLAS_CACHE.keys()),
+            'shared_entries': len(_SHARED_STORE['entries']),
+            'shared_nbytes': _SHARED_STORE['nbytes'],
+        }
+
+# Opt-in cache of decoded input images, so that repeated calls on the same file (e.g. with
+# different atlases or statistics) decode it once. Keys are (path, size, mtime, dtype), so a
+# file that is rewritten is decoded again.
+_INPUT_CACHE = OrderedDict()
+_INPUT_CACHE_STATE = {
+    'enabled': os.environ.get('SUBCORTEX_VISUALIZATION_INPUT_CACHE', '0') == '1',
+    'max_bytes': 1024**3,
+    'nbytes': 0,
+    'hits': 0,
+    'misses': 0,
+}
+
+def _input_cache_get(key):
+    """Return the cached input image for ``key`` (marking it as recently used), or None if absent."""
+    with _ATLAS_CACHE_LOCK:
+        if key in _INPUT_CACHE:
+            _INPUT_CACHE.move_to_end(key)
+            _INPUT_CACHE_STATE['hits'] += 1
+            return _INPUT_CACHE[key][0]
+        _INPUT_CACHE_STATE['misses'] += 1
+        return None
+
+def _input_cache_put(key, value, nbytes):
+    """Store an input image of ``nbytes`` decoded bytes, evicting least-recently-used inputs to stay within the limit."""
+    with _ATLAS_CACHE_LOCK:
+        if key in _INPUT_CACHE:
+            _INPUT_CACHE_STATE['nbytes'] -= _INPUT_CACHE.pop(key)[1]
+        if nbytes > _INPUT_CACHE_STATE['max_bytes']:
+            return value
+        _INPUT_CACHE[key] = (value, nbytes)
+        _INPUT_CACHE_STATE['nbytes'] += nbytes
+        _input_cache_evict()
+    return value
+
+def _input_cache_evict():
+    """Drop least-recently-used inputs until the input cache fits within its size limit."""
+    with _ATLAS_CACHE_LOCK:
+        while _INPUT_CACHE and _INPUT_CACHE_STATE['nbytes'] > _INPUT_CACHE_STATE['max_bytes']:
+            _, (_, nbytes) = _INPUT_CACHE.popitem(last=False)
+            _INPUT_CACHE_STATE['nbytes'] -= nbytes
+
+def set_input_cache(enabled=None, max_bytes=None):
+    """
+    Configure the in-process cache of decoded input images.
+
+    When enabled, input images given as file paths are decoded in full once and kept in
+    memory, keyed by path, file size, modification time and requested ``dtype``, so repeated
+    ``parcel_segstats`` calls on the same file (e.g. with different atlases or statistics)
+    skip reading and decompressing it. Images larger than ``max_bytes`` are read as usual.
+
+    Parameters
+    ----------
+    enabled : bool, optional
+        Turn the input cache on or off. It is off by default unless the environment
+        variable ``SUBCORTEX_VISUALIZATION_INPUT_CACHE`` is set to '1'.
+
+    max_bytes : int, optional
+        Size limit of the decoded inputs held in bytes (default 1 GiB). Least-recently-used
+        inputs are dropped when it is exceeded.
+
+    Returns
+    -------
+    None
+    """
+    with _ATLAS_CACHE_LOCK:
+        if max_bytes is not None:
+            if max_bytes < 0:
+                raise ValueError(f"max_bytes must be non-negative; got {max_bytes}.")
+            _INPUT_CACHE_STATE['max_bytes'] = int(max_bytes)
+            _input_cache_evict()
+        if enabled is not None:
+            _INPUT_CACHE_STATE['enabled'] = bool(enabled)
+            if not enabled:
+                clear_input_cache()
+
+def clear_input_cache():
+    """
+    Drop every decoded input image held by the input cache.
+
+    Returns
+    -------
+    None
+    """
+    with _ATLAS_CACHE_LOCK:
+        _INPUT_CACHE.clear()
+        _INPUT_CACHE_STATE.update(nbytes=0, hits=0, misses=0)
+
+def input_cache_stats():
+    """
+    Report the state of the in-process input cache.
+
+    Returns
+    -------
+    dict
+        With keys 'enabled', 'entries', 'nbytes', 'max_bytes', 'hits' and 'misses'.
+    """
+    with _ATLAS_CACHE_LOCK:
+        return {
+            'enabled': _INPUT_CACHE_STATE['enabled'],
+            'entries': len(_INPUT_CACHE),
+            'nbytes': _INPUT_CACHE_STATE['nbytes'],
+            'max_bytes': _INPUT_CACHE_STATE['max_bytes'],
+            'hits': _INPUT_CACHE_STATE['hits'],
+            'misses': _INPUT_CACHE_STATE['misses'],
+        }
+
+# Persistent cache of resampled atlases, shared between processes through the file system.
+# It is opt-in: nothing is written unless it is enabled with set_disk_cache(enabled=True) or
+# $SUBCORTEX_VISUALIZATION_DISK_CACHE=1. The directory defaults to
+# $SUBCORTEX_VISUALIZATION_CACHE_DIR, else $XDG_CACHE_HOME/subcortex_visualization
+# (~/.cache/subcortex_visualization if XDG_CACHE_HOME is unset).
+_DISK_CACHE_FORMAT_VERSION = 1
+_DISK_CACHE_STATE = {
+    'enabled': os.environ.get('SUBCORTEX_VISUALIZATION_DISK_CACHE', '0') == '1',
+    'cache_dir': os.environ.get('SUBCORTEX_VISUALIZATION_CACHE_DIR',
+                                os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache')),
+                                             'subcortex_visualization')),
+    'max_bytes': 2 * 1024**3,
+}
+
+def _disk_cache_path(key):
+    """
+    Return the file path used to store ``key`` in the disk cache.
+
+    The file name keeps the readable leading parts of the key (e.g. kind, space and atlas)
+    and ends with a hash of the full key.
+    """
+    key_hash = hashlib.sha1(repr((_DISK_CACHE_FORMAT_VERSION,) + tuple(key)).encode()).hexdigest()[:20]
+    readable = '_'.join(str(k) for k in key[:3] if isinstance(k, str))
+    return os.path.join(_DISK_CACHE_STATE['cache_dir'], f"{readable}_{key_hash}.npz")
+
+def _disk_cache_load(key):
+    """
+    Load the arrays stored under ``key`` in the disk cache.
+
+    Returns
+    -------
+    dict of numpy.ndarray or None
+        The stored arrays, or None if the disk cache is disabled, the entry is missing, or it cannot be read.
+    """
+    if not _DISK_CACHE_STATE['enabled']:
+        return None
+
+    cache_path = _disk_cache_path(key)
+    try:
+        arrays = _load_npz(cache_path)
+    except (OSError, ValueError, EOFError, zipfile.BadZipFile):
+        # Missing, or truncated by a concurrent writer that has since been replaced
+        return None
+
+    # Mark as recently used for size-based pruning
+    try:
+        os.utime(cache_path)
+    except OSError:
+        pass
+    return arrays
+
+def _disk_cache_store(key, arrays):
+    """
+    Store a dict of arrays under ``key`` in the disk cache, then prune the cache to its size limit.
+
+    Files are written under a temporary name and renamed into place, so concurrent processes
+    never read a partial entry. Failures to write (e.g. a read-only file system) are ignored.
+    """
+    if not _DISK_CACHE_STATE['enabled']:
+        return
+
+    cache_dir = _DISK_CACHE_STATE['cache_dir']
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, **arrays)
+            os.replace(tmp_path, _disk_cache_path(key))
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    except OSError as e:
+        print(f"Could not write to the disk cache at {cache_dir}: {e}")
+        return
+
+    _prune_disk_cache()
+
+def _disk_cache_entries():
+    """Return (path, size, mtime) for every entry in the disk cache directory, oldest first."""
+    cache_dir = _DISK_CACHE_STATE['cache_dir']
+    entries = []
+    try:
+        with os.scandir(cache_dir) as it:
+            for entry in it:
+                if entry.name.endswith('.npz'):
+                    try:
+                        st = entry.stat()
+                    except OSError:
+                        continue
+                    entries.append((entry.path, st.st_size, st.st_mtime))
+    except OSError:
+        return []
+    return sorted(entries, key=lambda e: e[2])
+
+def _prune_disk_cache():
+    """Delete least-recently-used disk cache entries until the directory fits within its size limit."""
+    entries = _disk_cache_entries()
+    total = sum(size for _, size, _ in entries)
+    for path, size, _ in entries:
+        if total <= _DISK_CACHE_STATE['max_bytes']:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            # Already removed by another process
+            pass
+        total -= size
+
+def set_disk_cache(cache_dir=None, max_bytes=None, enabled=None):
+    """
+    Configure the persistent on-disk cache of resampled atlases.
+
+    The disk cache is off by default, so nothing is written to disk unless it is turned on
+    here or by setting the environment variable ``SUBCORTEX_VISUALIZATION_DISK_CACHE`` to '1'.
+
+    Parameters
+    ----------
+    cache_dir : str, optional
+        Directory for cached files. Processes that share a directory share the cache.
+        Defaults to ``$SUBCORTEX_VISUALIZATION_CACHE_DIR``, else
+        ``$XDG_CACHE_HOME/subcortex_visualization`` (``~/.cache/subcortex_visualization``
+        if ``XDG_CACHE_HOME`` is unset).
+
+    max_bytes : int, optional
+        Size limit of the cache directory in bytes (default 2 GiB). Least-recently-used
+        entries are deleted when it is exceeded.
+
+    enabled : bool, optional
+        Turn the disk cache on or off. It is off by default unless the environment
+        variable ``SUBCORTEX_VISUALIZATION_DISK_CACHE`` is set to '1'.
+
+    Returns
+    -------
+    None
+    """
+    if cache_dir is not None:
+        _DISK_CACHE_STATE['cache_dir'] = os.path.abspath(os.path.expanduser(str(cache_dir)))
+    if max_bytes is not None:
+        if max_bytes < 0:
+            raise ValueError(f"max_bytes must be non-negative; got {max_bytes}.")
+        _DISK_CACHE_STATE['max_bytes'] = int(max_bytes)
+        _prune_disk_cache()
+    if enabled is not None:
+        _DISK_CACHE_STATE['enabled'] = bool(enabled)
+
+def clear_disk_cache():
+    """
+    Delete every entry in the on-disk cache directory.
+
+    Returns
+    -------
+    None
+    """
+    for path, _, _ in _disk_cache_entries():
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def disk_cache_stats():
+    """
+    Report the state of the on-disk cache.
+
+    Returns
+    -------
+    dict
+        With keys 'enabled', 'cache_dir', 'entries', 'nbytes' and 'max_bytes'.
+    """
+    entries = _disk_cache_entries()
+    return {
+        'enabled': _DISK_CACHE_STATE['enabled'],
+        'cache_dir': _DISK_CACHE_STATE['cache_dir'],
+        'entries': len(entries),
+        'nbytes': sum(size for _, size, _ in entries),
+        'max_bytes': _DISK_CACHE_STATE['max_bytes'],
+    }
+
+# Uncompressed, memory-mappable copies ("sidecars") of decoded atlas volumes. Each sidecar is a
+# raw .npy file with a .json manifest recording the digest of the packaged files it was decoded
+# from, so it is never used once those change. Processes mapping the same sidecar share its
+# pages through the OS page cache. Creating sidecars on first use is opt-in; existing valid
+# sidecars are always used.
+_SIDECAR_STATE = {
+    'enabled': os.environ.get('SUBCORTEX_VISUALIZATION_SIDECARS', '0') == '1',
+    'sidecar_dir': None,
+}
+
+def _sidecar_dir():
+    """Directory of the sidecars; the 'sidecars' folder of the disk cache directory unless set."""
+    if _SIDECAR_STATE['sidecar_dir'] is not None:
+        return _SIDECAR_STATE['sidecar_dir']
+    return os.path.join(_DISK_CACHE_STATE['cache_dir'], 'sidecars')
+
+def _source_digest(paths):
+    """
+    Return a digest of the contents of packaged source files (in any order).
+
+    Parameters
+    ----------
+    paths : list of pathlib.Path or importlib.resources.abc.Traversable
+        The files a sidecar is decoded from.
+
+    Returns
+    -------
+    str
+        Hex digest over the files' names and bytes.
+    """
+    digests = sorted((p.name, hashlib.sha1(p.read_bytes()).hexdigest()) for p in paths)
+    return hashlib.sha1(repr(digests).encode()).hexdigest()
+
+def _sidecar_paths(key):
+    """Return the (array, manifest) file paths used to store ``key`` as a sidecar."""
+    key_hash = hashlib.sha1(repr(tuple(key)).encode()).hexdigest()[:20]
+    readable = '_'.join(str(k) for k in key[:4] if isinstance(k, str))
+    base = os.path.join(_sidecar_dir(), f"{readable}_{key_hash}")
+    return base + '.npy', base + '.json'
+
+def _sidecar_load(key, digest, verify=False):
+    """
+    Memory-map the sidecar array stored under ``key``.
+
+    Parameters
+    ----------
+    key : tuple
+        Sidecar key, e.g. ('atlas', atlas_space, atlas).
+
+    digest : str
+        Digest of the packaged source files (see ``_source_digest``); the sidecar must have been
+        written from files with the same digest.
+
+    verify : bool, default=False
+        Also check the checksum of the sidecar's data, which reads the whole file. Otherwise only
+        the file size, shape and dtype are checked against the manifest.
+
+    Returns
+    -------
+    numpy.memmap or None
+        Read-only mapped array, or None if missing, stale or corrupt.
+    """
+    array_path, manifest_path = _sidecar_paths(key)
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        if manifest['digest'] != digest or os.path.getsize(array_path) != manifest['nbytes']:
+            return None
+        array = np.load(array_path, mmap_mode='r', allow_pickle=False)
+    except (OSError, ValueError, KeyError):
+        return None
+
+    if list(array.shape) != manifest['shape'] or array.dtype.str != manifest['dtype']:
+        return None
+    if verify and hashlib.sha1(np.ascontiguousarray(array)).hexdigest() != manifest['sha1']:
+        return None
+    return array
+
+def _sidecar_store(key, array, digest):
+    """
+    Write ``array`` as an uncompressed sidecar under ``key`` and return it memory-mapped.
+
+    The array is written before its manifest, each under a temporary name renamed into place,
+    so concurrent readers never accept a partial file. If the sidecar cannot be written
+    (e.g. a read-only file system), ``array`` itself is returned.
+    """
+    array_path, manifest_path = _sidecar_paths(key)
+    array = np.ascontiguousarray(array)
+    manifest = {
+        'key': [str(k) for k in key],
+        'digest': digest,
+        'shape': list(array.shape),
+        'dtype': array.dtype.str,
+        'sha1': hashlib.sha1(array).hexdigest(),
+    }
+    try:
+        os.makedirs(os.path.dirname(array_path), exist_ok=True)
+        for path, write in ((array_path, lambda f: np.save(f, array, allow_pickle=False)),
+                            (manifest_path, lambda f: f.write(json.dumps(manifest).encode()))):
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    write(f)
+                    if path == array_path:
+                        manifest['nbytes'] = f.tell()
+                os.replace(tmp_path, path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+    except OSError as e:
+        print(f"Could not write atlas sidecar to {os.path.dirname(array_path)}: {e}")
+        return array
+
+    mapped = _sidecar_load(key, digest)
+    return array if mapped is None else mapped
+
+def set_atlas_sidecars(enabled=None, sidecar_dir=None):
+    """
+    Configure uncompressed, memory-mapped copies ("sidecars") of the packaged atlases.
+
+    When enabled, the first load of an atlas (or of one of its pre-resampled grids) also writes
+    its decoded labels as a raw ``.npy`` file. Later loads, in this or any other process,
+    memory-map that file instead of decompressing the NIfTI, and processes share its pages.
+    Each sidecar records a digest of the packaged files it came from and is ignored (and
+    re-written) once they change. Valid sidecars are used even when creation is disabled.
+
+    Parameters
+    ----------
+    enabled : bool, optional
+        Turn creation of sidecars on first use on or off. It is off by default unless the
+        environment variable ``SUBCORTEX_VISUALIZATION_SIDECARS`` is set to '1'.
+
+    sidecar_dir : str, optional
+        Directory of the sidecars. Defaults to the 'sidecars' folder of the disk cache
+        directory (see ``set_disk_cache``). Sidecars are not subject to the disk cache size limit.
+
+    Returns
+    -------
+    None
+    """
+    if enabled is not None:
+        _SIDECAR_STATE['enabled'] = bool(enabled)
+    if sidecar_dir is not None:
+        _SIDECAR_STATE['sidecar_dir'] = os.path.abspath(os.path.expanduser(str(sidecar_dir)))
+
+def clear_atlas_sidecars():
+    """
+    Delete every atlas sidecar.
+
+    Arrays already memory-mapped by running processes stay readable until released.
+
+    Returns
+    -------
+    None
+    """
+    try:
+        with os.scandir(_sidecar_dir()) as it:
+            sidecar_files = [entry.path for entry in it if entry.name.endswith(('.npy', '.json'))]
+    except OSError:
+        return
+    for path in sidecar_files:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+# Shared-memory store layout: a 16-byte header holding the offset and length of a pickled
+# manifest, then every array's data (64-byte aligned), then the manifest. The manifest maps
+# cache keys to their values, with arrays replaced by ('__shared_array__', offset, shape, dtype)
+# references and sparse matrices by ('__shared_sparse__', format, shape, data, indices, indptr).
+_SHARED_HEADER_BYTES = 16
+_SHARED_ALIGN = 64
+
+def _pack_shared(value, arrays, offset):
+    """
+    Replace the arrays in a cache value by references to their place in the store.
+
+    Parameters
+    ----------
+    value : object
+        Cache value; arrays and sparse matrices may be nested in dicts, lists and tuples.
+
+    arrays : list
+        Collects (offset, array) pairs to copy into the store.
+
+    offset : list of int
+        One-element list holding the next free offset, advanced as arrays are added.
+
+    Returns
+    -------
+    object
+        The value with every array replaced by a reference.
+    """
+    if isinstance(value, np.ndarray):
+        if value.dtype.hasobject:
+            return value
+        array = np.ascontiguousarray(value)
+        start = offset[0]
+        arrays.append((start, array))
+        offset[0] = start + -(-array.nbytes // _SHARED_ALIGN) * _SHARED_ALIGN
+        return ('__shared_array__', start, array.shape, array.dtype.str)
+    if sparse.issparse(value) and value.format in ('csr', 'csc'):
+        return ('__shared_sparse__', value.format, value.shape,
+                _pack_shared(value.data, arrays, offset), _pack_shared(value.indices, arrays, offset),
+                _pack_shared(value.indptr, arrays, offset))
+    if isinstance(value, dict):
+        return {k: _pack_shared(v, arrays, offset) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_pack_shared(v, arrays, offset) for v in value]
+    if isinstance(value, tuple):
+        return tuple(_pack_shared(v, arrays, offset) for v in value)
+    return value
+
+def _unpack_shared(value, buf):
+    """Rebuild a packed cache value as read-only, zero-copy views of the store buffer ``buf``."""
+    if isinstance(value, tuple) and value and isinstance(value[0], str):
+        if value[0] == '__shared_array__':
+            _, start, shape, dtype = value
+            array = np.ndarray(shape, dtype=np.dtype(dtype), buffer=buf, offset=start)
+            array.flags.writeable = False
+            return array
+        if value[0] == '__shared_sparse__':
+            _, fmt, shape, data, indices, indptr = value
+            matrix_class = sparse.csr_matrix if fmt == 'csr' else sparse.csc_matrix
+            return matrix_class((_unpack_shared(data, buf), _unpack_shared(indices, buf), _unpack_shared(indptr, buf)),
+                                shape=shape, copy=False)
+    if isinstance(value, dict):
+        return {k: _unpack_shared(v, buf) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_unpack_shared(v, buf) for v in value]
+    if isinstance(value, tuple):
+        return tuple(_unpack_shared(v, buf) for v in value)
+    return value
+
+def _open_shared_memory(name):
+    """Attach to an existing shared memory block without letting this process unlink it on exit."""
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+
+    # Before Python 3.13 every attaching process registers the block with its resource tracker
+    # (on POSIX), which unlinks it when the process exits; withdraw this process's registration
+    shm = shared_memory.SharedMemory(name=name)
+    if os.name == 'posix':
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    return shm
+
+def _attach_shared(shm, owner):
+    """Read the manifest of a store and make its entries visible to ``_cache_get``."""
+    manifest_offset, manifest_len = np.frombuffer(shm.buf[:_SHARED_HEADER_BYTES], dtype='<u8')
+    manifest = pickle.loads(bytes(shm.buf[int(manifest_offset):int(manifest_offset + manifest_len)]))
+    entries = {key: _unpack_shared(value, shm.buf) for key, value in manifest}
+    with _ATLAS_CACHE_LOCK:
+        _SHARED_STORE.update(shm=shm, owner=owner, entries=entries, nbytes=int(manifest_offset))
+    return len(entries)
+
+def create_shared_atlas_store(name=None):
+    """
+    Publish the current in-process atlas cache as a shared-memory store.
+
+    Call this in a parent process after warming the cache (e.g. by running ``parcel_segstats``
+    once on an input of each grid it will serve). Decoded atlases, parcel layouts, sparse
+    indicator matrices and their metadata are copied once into a single
+    ``multiprocessing.shared_memory`` block, which worker processes attach to with
+    ``attach_shared_atlas_store`` and read without copying, however many there are.
+    The parent also switches to the shared copies, so its private cache is cleared.
+
+    Parameters
+    ----------
+    name : str, optional
+        Name of the shared memory block. A unique name is generated by default.
+
+    Returns
+    -------
+    str
+        Name of the store, to pass to ``attach_shared_atlas_store`` in workers.
+    """
+    close_shared_atlas_store()
+    with _ATLAS_CACHE_LOCK:
+        items = [(key, value) for key, (value, _) in _ATLAS_CACHE.items()]
+
+    arrays, offset = [], [_SHARED_HEADER_BYTES]
+    manifest = pickle.dumps([(key, _pack_shared(value, arrays, offset)) for key, value in items],
+                            protocol=pickle.HIGHEST_PROTOCOL)
+    manifest_offset = offset[0]
+
+    shm = shared_memory.SharedMemory(name=name, create=True, size=manifest_offset + len(manifest))
+    shm.buf[:_SHARED_HEADER_BYTES] = np.array([manifest_offset, len(manifest)], dtype='<u8').tobytes()
+    for start, array in arrays:
+        np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf, offset=start)[...] = array
+    shm.buf[manifest_offset:manifest_offset + len(manifest)] = manifest
+    del arrays
+
+    clear_atlas_cache()
+    _attach_shared(shm, owner=True)
+    return shm.name
+
+def attach_shared_atlas_store(name):
+    """
+    Attach this process to a shared-memory atlas store created by ``create_shared_atlas_store``.
+
+    Its entries are served as read-only, zero-copy arrays to every later extraction call,
+    after anything in this process's own cache. Attaching replaces any store already attached.
+
+    Parameters
+    ----------
+    name : str
+        Name of the store.
+
+    Returns
+    -------
+    int
+        Number of attached cache entries.
+    """
+    close_shared_atlas_store()
+    return _attach_shared(_open_shared_memory(name), owner=False)
+
+def close_shared_atlas_store(unlink=None):
+    """
+    Detach this process from its shared-memory atlas store.
+
+    Parameters
+    ----------
+    unlink : bool, optional
+        Also remove the block, so no new process can attach. Defaults to True in the
+        process that created the store and False elsewhere. Processes still attached keep
+        their mapping until they detach.
+
+    Returns
+    -------
+    None
+    """
+    with _ATLAS_CACHE_LOCK:
+        shm, owner = _SHARED_STORE['shm'], _SHARED_STORE['owner']
+        _SHARED_STORE.update(shm=None, owner=False, entries={}, nbytes=0)
+    if shm is None:
+        return
+
+    if owner if unlink is None else unlink:
+        if os.name == 'posix' and sys.version_info < (3, 13):
+            # Attached processes withdraw the block from the resource tracker, which they may share
+            # with this one (see _open_shared_memory); register it again for unlink() to withdraw
+            from multiprocessing import resource_tracker
+            resource_tracker.register(shm._name, 'shared_memory')
+        try:
+            shm.unlink()
+        except FileNotFoundError:
+            pass
+    try:
+        shm.close()
+    except BufferError:
+        # Arrays from the store are still referenced; the mapping is released with them
+        pass
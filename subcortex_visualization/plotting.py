@@ -10,13 +10,43 @@ from svgpath2mpl import parse_path
 import matplotlib
 import matplotlib.pyplot as plt
 import matplotlib.colors as mcolors
-from matplotlib.patches import PathPatch, Patch
+from matplotlib.patches import Patch, PathPatch
+from matplotlib.collections import PathCollection
 
 # Files 
 from importlib.resources import files
 
 import re
 
+# Geometry cache
+from collections import OrderedDict
+import threading
+import os
+import hashlib
+import zipfile
+import warnings
+from matplotlib.path import Path as MplPath
+from .utils import _load_npz
+
+# In-process cache of parsed region geometry, keyed by (atlas, region, hemisphere, face), with
+# hemisphere 'B' for midline regions drawn in both hemispheres. Each entry holds the region's
+# matplotlib Paths, the canvas size of its SVG file and the extent of its vertices.
+_GEOMETRY_CACHE = OrderedDict()
+_GEOMETRY_CACHE_LOCK = threading.RLock()
+_GEOMETRY_CACHE_STATE = {
+    'max_entries': 4096,
+    'hits': 0,
+    'misses': 0,
+}
+
+# Geometry of composite SVG files (the SUIT flatmap and Brainstem Navigator panels), keyed by
+# (atlas, SVG file path), with an index from path title to the positions of its paths.
+_COMPOSITE_GEOMETRY = {}
+
+# Precompiled geometry bundles (see build_geometry_bundles), loaded once per atlas and process;
+# None marks an atlas whose bundle is missing or out of date with its SVG files.
+_GEOMETRY_BUNDLES = {}
+
 def _parse_svg_dimension(value, fallback=500):
     """
     Parse an SVG dimension attribute that may include units (e.g., '500mm', '500px').
@@ -39,6 +69,415 @@ def _parse_svg_dimension(value, fallback=500):
     match = re.match(r'([\d.]+)', str(value))
     return float(match.group(1)) if match else fallback
 
+def _parse_svg_file(svg_filename):
+    """
+    Parse the paths of an SVG file into matplotlib geometry.
+
+    Parameters
+    ----------
+    svg_filename : str
+        Path to the SVG file.
+
+    Returns
+    -------
+    dict or None
+        'paths' (list of matplotlib.path.Path, in document order), 'titles' (the text of each
+        path's <title> child, or None), 'canvas' (width, height) and 'extents' (array of
+        xmin, ymin, xmax, ymax per path, NaN for paths without vertices); None if the file
+        cannot be read.
+    """
+    try:
+        tree = ET.parse(svg_filename)
+    except Exception as e:
+        print(f"  Skipping {svg_filename}: {e}")
+        return None
+
+    root = tree.getroot()
+    ns = 'http://www.w3.org/2000/svg'
+
+    mpl_paths, titles = [], []
+    for path_el in root.findall(f'.//{{{ns}}}path'):
+        d = path_el.get('d', '')
+        if not d:
+            continue
+        title = next((child.text for child in path_el if child.tag.endswith('title')), None)
+        try:
+            mpl_paths.append(parse_path(d))
+            titles.append(title)
+        except Exception as e:
+            print(f"  Could not parse path (title={title}) in {svg_filename}: {e}")
+
+    extents = np.full((len(mpl_paths), 4), np.nan)
+    for i, mpl_path in enumerate(mpl_paths):
+        if len(mpl_path.vertices) > 0:
+            extents[i, :2] = mpl_path.vertices.min(axis=0)
+            extents[i, 2:] = mpl_path.vertices.max(axis=0)
+
+    return {
+        'paths': mpl_paths,
+        'titles': titles,
+        'canvas': (_parse_svg_dimension(root.get('width')), _parse_svg_dimension(root.get('height'))),
+        'extents': extents,
+    }
+
+def _union_extent(extents):
+    """
+    Return the union (xmin, ymin, xmax, ymax) of per-path extents, or None if all are empty.
+    """
+    extents = np.asarray(extents).reshape(-1, 4)
+    extents = extents[~np.isnan(extents).any(axis=1)]
+    if len(extents) == 0:
+        return None
+    return (extents[:, 0].min(), extents[:, 1].min(), extents[:, 2].max(), extents[:, 3].max())
+
+def _atlas_svg_files(atlas):
+    """
+    List the SVG files of a packaged atlas: composites in data/<atlas> and per-region files in
+    data/<atlas>/vectors, sorted by name within each directory.
+    """
+    atlas_dir = files("subcortex_visualization").joinpath('data').joinpath(atlas)
+    svg_files = []
+    for this_dir in (atlas_dir, atlas_dir.joinpath('vectors')):
+        if this_dir.is_dir():
+            svg_files.extend(sorted((f for f in this_dir.iterdir() if f.name.endswith('.svg')), key=lambda f: f.name))
+    return svg_files
+
+def _geometry_fingerprint(svg_files):
+    """
+    Fingerprint a set of SVG files by their names and contents, to tell whether a geometry
+    bundle is still in step with its sources, even after an edit that keeps a file's size.
+    """
+    digest = hashlib.sha1()
+    for svg_file in svg_files:
+        digest.update(f"{svg_file.name}:{hashlib.sha1(svg_file.read_bytes()).hexdigest()};".encode())
+    return digest.hexdigest()
+
+def _load_geometry_bundle(atlas):
+    """
+    Return the memory-mapped geometry bundle of a packaged atlas, or None if there is no
+    bundle or it no longer matches the atlas's SVG files.
+    """
+    if atlas in _GEOMETRY_BUNDLES:
+        return _GEOMETRY_BUNDLES[atlas]
+
+    bundle = None
+    atlas_dir = files("subcortex_visualization").joinpath('data').joinpath(atlas)
+    bundle_path = atlas_dir.joinpath(f"{atlas}_geometry.npz")
+    if atlas_dir.is_dir() and bundle_path.is_file():
+        try:
+            stored = _load_npz(str(bundle_path))
+            if str(stored['fingerprint']) == _geometry_fingerprint(_atlas_svg_files(atlas)):
+                bundle = stored
+                bundle['file_index'] = {str(name): i for i, name in enumerate(stored['file_names'])}
+            else:
+                warnings.warn(f"Geometry bundle for {atlas} is out of date with its SVG files; parsing the SVGs instead. Run build_geometry_bundles() to refresh it.", stacklevel=2)
+        except (OSError, KeyError, ValueError, zipfile.BadZipFile) as e:
+            warnings.warn(f"Could not load geometry bundle {bundle_path}: {e}; parsing the SVGs instead.", stacklevel=2)
+
+    with _GEOMETRY_CACHE_LOCK:
+        _GEOMETRY_BUNDLES[atlas] = bundle
+    return bundle
+
+def _file_geometry(atlas, svg_filename):
+    """
+    Return the geometry of one SVG file, from the atlas's geometry bundle when it holds the file
+    and by parsing the SVG otherwise.
+
+    Parameters
+    ----------
+    atlas : str or None
+        Atlas name, used to find the geometry bundle.
+
+    svg_filename : str
+        Path to the SVG file.
+
+    Returns
+    -------
+    dict or None
+        See ``_parse_svg_file``.
+    """
+    bundle = _load_geometry_bundle(atlas) if atlas is not None else None
+    stem = os.path.basename(str(svg_filename))[:-len('.svg')]
+    if bundle is None or stem not in bundle['file_index'] or not os.path.isfile(svg_filename):
+        return _parse_svg_file(svg_filename)
+
+    i = bundle['file_index'][stem]
+    p0, p1 = int(bundle['file_offsets'][i]), int(bundle['file_offsets'][i + 1])
+    path_offsets = bundle['path_offsets'][p0:p1 + 1]
+    vertices, codes = bundle['vertices'], bundle['codes']
+    return {
+        'paths': [MplPath(vertices[a:b], codes[a:b]) for a, b in zip(path_offsets[:-1], path_offsets[1:])],
+        'titles': [str(title) or None for title in bundle['path_titles'][p0:p1]],
+        'canvas': tuple(float(x) for x in bundle['file_canvas'][i]),
+        'extents': bundle['path_extents'][p0:p1],
+    }
+
+def build_geometry_bundles(atlas=None):
+    """
+    Compile the vector graphics of one or more atlases into binary geometry bundles.
+
+    Each bundle (data/<atlas>/<atlas>_geometry.npz) holds every path of the atlas's SVG files
+    as concatenated vertices and codes with offsets, along with path titles, canvas sizes and
+    per-path extents. ``plot_subcortical_data`` draws from the bundle, memory-mapped, rather
+    than parsing the SVGs; the SVGs remain the source of truth, and a bundle whose SVGs have
+    changed since it was built is ignored until it is rebuilt.
+
+    Parameters
+    ----------
+    atlas : str or list of str, optional
+        Atlas name(s). Defaults to every atlas in the package's data directory.
+
+    Returns
+    -------
+    list of str
+        Paths of the bundles written.
+    """
+    data_dir = files("subcortex_visualization").joinpath('data')
+    if atlas is None:
+        atlases = sorted(d.name for d in data_dir.iterdir() if d.is_dir())
+    else:
+        atlases = [atlas] if isinstance(atlas, str) else list(atlas)
+
+    written = []
+    for this_atlas in atlases:
+        svg_files = _atlas_svg_files(this_atlas)
+        if not svg_files:
+            print(f"No SVG files found for {this_atlas}; skipping.")
+            continue
+
+        file_names, file_canvas, file_offsets = [], [], [0]
+        path_titles, path_extents, path_offsets = [], [], [0]
+        vertices, codes = [], []
+        for svg_file in svg_files:
+            geometry = _parse_svg_file(str(svg_file))
+            if geometry is None:
+                continue
+            file_names.append(svg_file.name[:-len('.svg')])
+            file_canvas.append(geometry['canvas'])
+            for mpl_path, title in zip(geometry['paths'], geometry['titles']):
+                path_codes = mpl_path.codes
+                if path_codes is None:
+                    path_codes = np.full(len(mpl_path.vertices), MplPath.LINETO, dtype=np.uint8)
+                    path_codes[:1] = MplPath.MOVETO
+                vertices.append(mpl_path.vertices)
+                codes.append(path_codes)
+                path_offsets.append(path_offsets[-1] + len(mpl_path.vertices))
+                path_titles.append(title or '')
+            path_extents.append(geometry['extents'])
+            file_offsets.append(len(path_titles))
+
+        bundle_path = data_dir.joinpath(this_atlas).joinpath(f"{this_atlas}_geometry.npz")
+        tmp_path = f"{bundle_path}.tmp.npz"
+        np.savez(tmp_path,
+                 fingerprint=np.array(_geometry_fingerprint(svg_files)),
+                 file_names=np.array(file_names),
+                 file_canvas=np.array(file_canvas, dtype=np.float64).reshape(-1, 2),
+                 file_offsets=np.array(file_offsets, dtype=np.int64),
+                 path_titles=np.array(path_titles, dtype=str),
+                 path_offsets=np.array(path_offsets, dtype=np.int64),
+                 path_extents=np.concatenate(path_extents).reshape(-1, 4) if path_extents else np.empty((0, 4)),
+                 vertices=np.concatenate(vertices).astype(np.float64).reshape(-1, 2) if vertices else np.empty((0, 2)),
+                 codes=np.concatenate(codes).astype(np.uint8) if codes else np.empty(0, dtype=np.uint8))
+        os.replace(tmp_path, bundle_path)
+        with _GEOMETRY_CACHE_LOCK:
+            _GEOMETRY_BUNDLES.pop(this_atlas, None)
+        print(f"Wrote {len(path_titles)} paths from {len(file_names)} SVG files to {bundle_path}")
+        written.append(str(bundle_path))
+
+    return written
+
+def _region_geometry(atlas, svg_dir, region, hemisphere, face):
+    """
+    Return the geometry of one region's SVG file, from the geometry cache when possible.
+
+    Parameters
+    ----------
+    atlas : str
+        Atlas name, used in the cache key and to find the atlas's geometry bundle.
+
+    svg_dir : str or pathlib.Path
+        Directory holding the per-region SVG files ({region}_{hemisphere}_{face}.svg, or
+        {region}_{face}.svg for midline regions with hemisphere 'BL'/'BR').
+
+    region, hemisphere, face : str
+        The region, its hemisphere code and the face (view) to draw.
+
+    Returns
+    -------
+    dict or None
+        'paths' (list of matplotlib.path.Path), 'canvas' (width, height) and 'extent'
+        (xmin, ymin, xmax, ymax of all vertices, or None if there are none); None if the
+        file cannot be read.
+    """
+    hemi_key = _normalise_hemi(hemisphere)
+    cache_key = (atlas, region, hemi_key, face)
+    with _GEOMETRY_CACHE_LOCK:
+        if cache_key in _GEOMETRY_CACHE:
+            _GEOMETRY_CACHE.move_to_end(cache_key)
+            _GEOMETRY_CACHE_STATE['hits'] += 1
+            return _GEOMETRY_CACHE[cache_key]
+        _GEOMETRY_CACHE_STATE['misses'] += 1
+
+    if hemi_key == 'B':
+        svg_filename = f"{svg_dir}/{region}_{face}.svg"
+    else:
+        svg_filename = f"{svg_dir}/{region}_{hemisphere}_{face}.svg"
+
+    file_geometry = _file_geometry(atlas, svg_filename)
+    if file_geometry is None:
+        # Not cached, so that a file added later is picked up
+        return None
+
+    geometry = {
+        'paths': file_geometry['paths'],
+        'canvas': file_geometry['canvas'],
+        'extent': _union_extent(file_geometry['extents']),
+    }
+    with _GEOMETRY_CACHE_LOCK:
+        _GEOMETRY_CACHE[cache_key] = geometry
+        while len(_GEOMETRY_CACHE) > _GEOMETRY_CACHE_STATE['max_entries']:
+            _GEOMETRY_CACHE.popitem(last=False)
+    return geometry
+
+def _composite_geometry(atlas, svg_filename):
+    """
+    Return the geometry of a composite SVG file, in which each path is titled
+    {region}_{face}_{hemisphere}, along with an index of its paths by title.
+
+    The geometry and index are built once per process and file.
+
+    Parameters
+    ----------
+    atlas : str
+        Atlas name, used in the cache key and to find the atlas's geometry bundle.
+
+    svg_filename : str
+        Path to the SVG file.
+
+    Returns
+    -------
+    dict or None
+        As for ``_parse_svg_file``, plus 'title_index' mapping each path title to the list of
+        positions (in document order) of the paths carrying it; None if the file cannot be read.
+    """
+    cache_key = (atlas, str(svg_filename))
+    with _GEOMETRY_CACHE_LOCK:
+        if cache_key in _COMPOSITE_GEOMETRY:
+            return _COMPOSITE_GEOMETRY[cache_key]
+
+    geometry = _file_geometry(atlas, str(svg_filename))
+    if geometry is None:
+        return None
+
+    title_index = {}
+    for path_idx, title in enumerate(geometry['titles']):
+        if title is not None:
+            title_index.setdefault(title, []).append(path_idx)
+    geometry = dict(geometry, title_index=title_index)
+
+    with _GEOMETRY_CACHE_LOCK:
+        _COMPOSITE_GEOMETRY[cache_key] = geometry
+    return geometry
+
+def warm_geometry_cache(atlas=None, hemisphere='both', views=None):
+    """
+    Load the vector graphics of one or more atlases into the geometry cache ahead of plotting.
+
+    ``plot_subcortical_data`` loads each region's geometry (from the atlas's geometry bundle,
+    or by parsing its SVG file) once per process and reuses it afterwards; warming the cache
+    moves that one-off cost out of the first plot (e.g. to application start-up).
+
+    Parameters
+    ----------
+    atlas : str or list of str, optional
+        Atlas name(s). Defaults to every packaged atlas.
+
+    hemisphere : {'L', 'R', 'both'}, default='both'
+        Hemisphere(s) whose regions to load. Atlases drawn from composite SVG files
+        (Brainstem_Navigator, SUIT_cerebellar_lobule) load all of their files.
+
+    views : list of str, optional
+        Faces to load, among 'medial', 'lateral', 'superior' and 'inferior'. Defaults to all.
+
+    Returns
+    -------
+    int
+        Number of regions in the geometry cache.
+    """
+    data_dir = files("subcortex_visualization").joinpath('data')
+    if atlas is None:
+        atlases = sorted(d.name for d in data_dir.iterdir() if d.is_dir())
+    else:
+        atlases = [atlas] if isinstance(atlas, str) else list(atlas)
+
+    for this_atlas in atlases:
+        svg_dir = data_dir.joinpath(this_atlas).joinpath('vectors')
+        if not svg_dir.is_dir():
+            for svg_file in _atlas_svg_files(this_atlas):
+                _composite_geometry(this_atlas, str(svg_file))
+            continue
+
+        atlas_ordering = pd.read_csv(data_dir.joinpath(f"{this_atlas}/{this_atlas}_{hemisphere}_ordering.csv"))
+        hemi_column = 'Hemisphere' if 'Hemisphere' in atlas_ordering.columns else 'hemisphere'
+        for region, hemi, face in atlas_ordering[['region', hemi_column, 'face']].drop_duplicates().itertuples(index=False):
+            if views is None or face in views:
+                _region_geometry(this_atlas, svg_dir, region, hemi, face)
+
+    return len(_GEOMETRY_CACHE)
+
+def set_geometry_cache_limit(max_entries):
+    """
+    Set the maximum number of parsed regions kept in the geometry cache.
+
+    Parameters
+    ----------
+    max_entries : int
+        Size limit in regions (region, hemisphere and face combinations). Least-recently-used
+        regions are dropped immediately if the cache is above the new limit. Use 0 to disable caching.
+
+    Returns
+    -------
+    None
+    """
+    if max_entries < 0:
+        raise ValueError(f"max_entries must be non-negative; got {max_entries}.")
+    with _GEOMETRY_CACHE_LOCK:
+        _GEOMETRY_CACHE_STATE['max_entries'] = int(max_entries)
+        while len(_GEOMETRY_CACHE) > _GEOMETRY_CACHE_STATE['max_entries']:
+            _GEOMETRY_CACHE.popitem(last=False)
+
+def clear_geometry_cache():
+    """
+    Remove every parsed region and composite SVG file from the geometry cache, and unload
+    geometry bundles so that they are re-read (and re-validated) on next use.
+
+    Returns
+    -------
+    None
+    """
+    with _GEOMETRY_CACHE_LOCK:
+        _GEOMETRY_CACHE.clear()
+        _COMPOSITE_GEOMETRY.clear()
+        _GEOMETRY_BUNDLES.clear()
+        _GEOMETRY_CACHE_STATE.update(hits=0, misses=0)
+
+def geometry_cache_stats():
+    """
+    Report the state of the geometry cache.
+
+    Returns
+    -------
+    dict
+        With keys 'entries', 'max_entries', 'hits' and 'misses'.
+    """
+    with _GEOMETRY_CACHE_LOCK:
+        return {
+            'entries': len(_GEOMETRY_CACHE),
+            'max_entries': _GEOMETRY_CACHE_STATE['max_entries'],
+            'hits': _GEOMETRY_CACHE_STATE['hits'],
+            'misses': _GEOMETRY_CACHE_STATE['misses'],
+        }
+
 def _normalise_hemi(h):
     """
     Normalize a hemisphere code by mapping 'BL' or 'BR' to 'B'.
@@ -61,23 +500,44 @@ def _normalise_hemi(h):
         return 'B'
     return h
 
-def _get_region_color(color_lookup, row, cmap, subcortex_data=None, value_column='value', norm=None,
-                      NA_fill="#cccccc", fill_by_significance=False,
-                      nonsig_fill_alpha=0.5, fill_alpha=1.0, is_cerebellum=False,
-                      line_thickness=1.5):
+# Default colours of the SUIT cerebellar lobules, keyed by (region, 'vermis' or 'LR')
+_SUIT_COLOR_LOOKUP = {
+    ('IV',      'LR'):     '#beff00',
+    ('V',       'LR'):     '#00ea43',
+    ('VI',      'LR'):     '#0068ff',
+    ('VI',      'vermis'): '#0054d4',
+    ('Crus_I',  'LR'):     '#df00ff',
+    ('Crus_II', 'LR'):     '#ff0000',
+    ('Crus_II', 'vermis'): '#df0000',
+    ('VIIb',    'LR'):     '#ff9300',
+    ('VIIb',    'vermis'): '#c86b00',
+    ('VIIIa',   'LR'):     '#00ff00',
+    ('VIIIa',   'vermis'): '#00d000',
+    ('VIIIb',   'LR'):     '#00ffff',
+    ('VIIIb',   'vermis'): '#00d0ce',
+    ('IX',      'LR'):     '#3900ff',
+    ('IX',      'vermis'): '#2e00d5',
+    ('X',       'LR'):     '#ff009d',
+    ('X',       'vermis'): '#df007c',
+}
+
+def _region_styles(atlas_ordering, color_lookup, cmap, subcortex_data=None, value_column='value', norm=None,
+                   NA_fill="#cccccc", fill_by_significance=False,
+                   nonsig_fill_alpha=0.5, fill_alpha=1.0, is_cerebellum=False,
+                   line_thickness=1.5):
     """
-    Determine the fill color and optional backing color for a single atlas region.
+    Determine the fill colour and outline thickness of every atlas region at once.
 
     Parameters
     ----------
+    atlas_ordering : pandas.DataFrame
+        Atlas ordering rows to style. Must contain at least 'region' and 'hemisphere';
+        also 'p_value' when ``fill_by_significance`` is True.
+
     color_lookup : dict
         Mapping of region name to color, used when ``subcortex_data`` is None and
         ``is_cerebellum`` is False.
 
-    row : pandas.Series
-        One row from the atlas ordering DataFrame. Must contain at least 'region'
-        and 'hemisphere'; also 'p_value' when ``fill_by_significance`` is True.
-
     cmap : matplotlib.colors.Colormap
         Colormap applied to continuous values when ``subcortex_data`` is provided.
 
@@ -108,82 +568,69 @@ def _get_region_color(color_lookup, row, cmap, subcortex_data=None, value_column
 
     is_cerebellum : bool, default=False
         If True and ``subcortex_data`` is None, colors are drawn from the
-        hard-coded SUIT cerebellar lobule lookup instead of ``color_lookup``.
+        SUIT cerebellar lobule lookup instead of ``color_lookup``.
 
     line_thickness : float or str, default=1.5
         Thickness of the outline for each region (in points), or a column name
-        in ``row`` whose value gives the region-specific thickness.
+        in ``atlas_ordering`` whose values give region-specific thickness.
 
     Returns
     -------
-    this_region_color : tuple
-        RGBA color for the region patch.
-
-    base_color : str or None
-        White backing color used when ``fill_by_significance`` is True;
-        None otherwise.
-
-    this_line_thickness : float
-        Thickness of the outline for the region, reduced if non-significant and
-        ``fill_by_significance`` is True; otherwise equal to the resolved
-        ``line_thickness`` value.
+    dict
+        'facecolors' : numpy.ndarray
+            (n_regions, 4) RGBA fill colours, in the row order of ``atlas_ordering``.
+        'linewidths' : numpy.ndarray
+            (n_regions,) outline thicknesses, reduced for non-significant regions when
+            ``fill_by_significance`` is True and ``line_thickness`` is a constant.
+        'base_color' : str or None
+            White backing color used when ``fill_by_significance`` is True; None otherwise.
     """
+    n_regions = len(atlas_ordering)
 
-    _SUIT_COLOR_LOOKUP = {
-        ('IV',      'LR'):     '#beff00',
-        ('V',       'LR'):     '#00ea43',
-        ('VI',      'LR'):     '#0068ff',
-        ('VI',      'vermis'): '#0054d4',
-        ('Crus_I',  'LR'):     '#df00ff',
-        ('Crus_II', 'LR'):     '#ff0000',
-        ('Crus_II', 'vermis'): '#df0000',
-        ('VIIb',    'LR'):     '#ff9300',
-        ('VIIb',    'vermis'): '#c86b00',
-        ('VIIIa',   'LR'):     '#00ff00',
-        ('VIIIa',   'vermis'): '#00d000',
-        ('VIIIb',   'LR'):     '#00ffff',
-        ('VIIIb',   'vermis'): '#00d0ce',
-        ('IX',      'LR'):     '#3900ff',
-        ('IX',      'vermis'): '#2e00d5',
-        ('X',       'LR'):     '#ff009d',
-        ('X',       'vermis'): '#df007c',
-    }
-        
     # Determine colour
     if subcortex_data is None:
         if is_cerebellum:
-            hemi_type = 'vermis' if row['hemisphere'] == 'V' else 'LR'
-            this_region_color = _SUIT_COLOR_LOOKUP.get((row['region'], hemi_type), NA_fill)
+            hemi_types = np.where(atlas_ordering['hemisphere'].to_numpy() == 'V', 'vermis', 'LR')
+            region_colors = [_SUIT_COLOR_LOOKUP.get((region, hemi_type), NA_fill)
+                             for region, hemi_type in zip(atlas_ordering['region'], hemi_types)]
         else:
-            this_region_color = color_lookup[row['region']]
-
+            region_colors = [color_lookup[region] for region in atlas_ordering['region']]
+        facecolors = mcolors.to_rgba_array(region_colors) if n_regions else np.empty((0, 4))
     else:
-        val = row[value_column]
-        this_region_color = cmap(norm(val)) if not pd.isnull(val) else NA_fill
+        values = atlas_ordering[value_column].to_numpy(dtype=float)
+        missing = np.isnan(values)
+        facecolors = np.array(cmap(norm(values)), dtype=float).reshape(n_regions, 4)
+        facecolors[missing] = mcolors.to_rgba(NA_fill)
 
     # If fill_by_significance is True, adjust alpha based on p-value
     if fill_by_significance:
-        this_region_pval = row['p_value'] if 'p_value' in row.index else np.nan
-        this_fill_alpha = nonsig_fill_alpha if pd.notnull(this_region_pval) and this_region_pval >= 0.05 else fill_alpha
+        p_values = atlas_ordering['p_value'].to_numpy(dtype=float) if 'p_value' in atlas_ordering.columns else np.full(n_regions, np.nan)
+        nonsig = ~np.isnan(p_values) & (p_values >= 0.05)
         base_color = 'white'
     else:
-        this_fill_alpha = fill_alpha
+        nonsig = np.zeros(n_regions, dtype=bool)
         base_color = None
 
-    # If line_thickness is a column name, get the value from the row; otherwise use the provided constant.
+    # Apply fill_alpha, or nonsig_fill_alpha to non-significant regions
+    alphas = facecolors[:, 3].copy() if fill_alpha is None else np.full(n_regions, fill_alpha, dtype=float)
+    alphas[nonsig] = nonsig_fill_alpha
+    facecolors = mcolors.to_rgba_array(facecolors, alpha=alphas)
+
+    # If line_thickness is a column name, take region values from it; otherwise use the provided constant,
+    # reduced for non-significant regions to visually de-emphasize them.
     if isinstance(line_thickness, str):
-        this_line_thickness = row[line_thickness] if line_thickness in row.index else 1.5
-    else:
-        # If fill_by_significance is True, reduce line thickness for non-significant regions to visually de-emphasize them; otherwise use the provided constant.
-        if fill_by_significance:
-            this_line_thickness = 0.25*line_thickness if pd.notnull(this_region_pval) and this_region_pval >= 0.05 else line_thickness
+        if line_thickness in atlas_ordering.columns:
+            linewidths = atlas_ordering[line_thickness].to_numpy(dtype=float)
         else:
-            this_line_thickness = line_thickness
-
-    # Adjust this_region_color to have the specified fill_alpha
-    this_region_color = mcolors.to_rgba(this_region_color, alpha=this_fill_alpha)
+            linewidths = np.full(n_regions, 1.5)
+    else:
+        linewidths = np.where(nonsig, 0.25*line_thickness, line_thickness).astype(float)
 
-    return this_region_color, base_color, this_line_thickness
+    return {
+        'facecolors': facecolors,
+        'linewidths': linewidths,
+        'base_color': base_color,
+    }
 
 def _add_legend(ax, fig, atlas_ordering, ncols=4, value_column='value', cmap_colors=None,
                fill_title=None, cmap='plasma', norm=None, multi_panel=False):
@@ -429,7 +876,90 @@ def _prep_data(atlas_ordering, value_column='value', subcortex_data=None, cmap=N
 
         return atlas_ordering, norm, vmin, vmax, midpoint
 
-def _plot_helper_cerebellum(atlas_ordering, paths, value_column='value', hemisphere='L', subcortex_data=None, 
+def _add_region_collection(ax, paths, path_rows, styles, line_color, zorders, backing=None, autolim=False):
+    """
+    Draw region paths onto an axes as one PathCollection per distinct z-order.
+
+    Each collection takes its paths' z-order and keeps their insertion order, so paths are drawn
+    in the order matplotlib would have drawn one PathPatch per path in, also relative to other
+    artists on the axes; per-path colours and line widths are kept, and joins and caps match
+    those of a PathPatch.
+
+    Parameters
+    ----------
+    ax : matplotlib.axes.Axes
+        Axes to draw on.
+
+    paths : list of matplotlib.path.Path
+        Paths in the order they would have been added as patches.
+
+    path_rows : list of int
+        Row of ``styles`` (i.e. position in the styled atlas ordering) each path belongs to.
+
+    styles : dict
+        Region fill colours, line widths and backing colour, from ``_region_styles``.
+
+    line_color : color
+        Outline colour of the region paths.
+
+    zorders : list of float
+        Z-order each path would have been drawn at.
+
+    backing : list of bool, optional
+        Marks paths drawn as an outline-less backing in ``styles['base_color']`` rather
+        than as the region fill.
+
+    autolim : bool, default=False
+        If True, extend the axes data limits to the paths, as ``ax.add_patch`` does.
+
+    Returns
+    -------
+    list of matplotlib.collections.PathCollection or matplotlib.patches.PathPatch
+        The collections added, in increasing z-order; a z-order held by a single path gets a
+        PathPatch instead. Empty if there are no paths.
+    """
+    if not paths:
+        return []
+
+    path_rows = np.asarray(path_rows, dtype=np.intp)
+    backing = np.zeros(len(paths), dtype=bool) if backing is None else np.asarray(backing, dtype=bool)
+
+    facecolors = styles['facecolors'][path_rows]
+    linewidths = np.where(backing, 0.0, styles['linewidths'][path_rows])
+    edgecolors = np.tile(mcolors.to_rgba(line_color), (len(paths), 1))
+    if backing.any():
+        facecolors[backing] = mcolors.to_rgba(styles['base_color'])
+        edgecolors[backing] = 0.0  # no outline on the backing
+
+    zorders = np.asarray(zorders, dtype=float)
+    artists = []
+    for zorder in np.unique(zorders):
+        members = np.flatnonzero(zorders == zorder)
+        if len(members) == 1:
+            # matplotlib draws a one-path collection as a marker snapped to whole pixels, so a
+            # lone path is drawn as the PathPatch it stands for
+            i = members[0]
+            artist = PathPatch(paths[i], facecolor=tuple(facecolors[i]), edgecolor=tuple(edgecolors[i]),
+                               linewidth=linewidths[i], zorder=float(zorder))
+            ax.add_artist(artist)
+        else:
+            artist = PathCollection([paths[i] for i in members],
+                                    facecolors=facecolors[members],
+                                    edgecolors=edgecolors[members],
+                                    linewidths=linewidths[members],
+                                    joinstyle='miter', capstyle='butt',
+                                    transform=ax.transData,
+                                    zorder=float(zorder))
+            ax.add_collection(artist, autolim=False)
+        artists.append(artist)
+
+    if autolim:
+        corners = [path.get_extents().get_points() for path in paths if len(path.vertices) > 0]
+        if corners:
+            ax.update_datalim(np.concatenate(corners))
+    return artists
+
+def _plot_helper_cerebellum(atlas_ordering, geometry, value_column='value', hemisphere='L', subcortex_data=None, 
                            color_lookup=None, cmap=None, NA_fill="#cccccc", fill_alpha=1.0, 
                            fill_by_significance=False, nonsig_fill_alpha=0.5,
                            line_color='black', line_thickness=1.5, norm=None, ax=None):
@@ -442,8 +972,8 @@ def _plot_helper_cerebellum(atlas_ordering, paths, value_column='value', hemisph
     atlas_ordering : pandas.DataFrame
         DataFrame containing the atlas ordering information.
 
-    paths : list of xml.etree.ElementTree.Element
-        List of SVG path elements to be plotted.
+    geometry : dict
+        Geometry of the flatmap SVG file, with its title index, from ``_composite_geometry``.
 
     value_column : str, default='value'
         The name of the column in `atlas_ordering` that contains the values to be visualized.
@@ -498,9 +1028,6 @@ def _plot_helper_cerebellum(atlas_ordering, paths, value_column='value', hemisph
         The axes object containing the plot.
 
     """
-    # Define patches
-    patches = []
-
     # Create figure/axes only if none were provided
     if ax is None:
         if hemisphere == 'both': 
@@ -514,29 +1041,23 @@ def _plot_helper_cerebellum(atlas_ordering, paths, value_column='value', hemisph
     # flatmap, so we do not need to worry about plot_order.
     atlas_ordering = atlas_ordering.sort_values(by='seg_index')
 
-    for _, row in atlas_ordering.iterrows():
-        this_region = row['region']
-        this_region_side = row['face']
-        this_region_hemi = row['hemisphere']
-
-        # Determine color and alpha
-        this_region_color, base_color, this_line_thickness = _get_region_color(subcortex_data=subcortex_data, color_lookup=color_lookup, 
-                                                               row=row, value_column=value_column, cmap=cmap, 
-                                                               norm=norm, NA_fill=NA_fill, fill_alpha=fill_alpha, 
-                                                               fill_by_significance=fill_by_significance, 
-                                                               nonsig_fill_alpha=nonsig_fill_alpha,
-                                                               is_cerebellum=True, line_thickness=line_thickness)
-            
-        # Match title to region
-        for path in paths:
-            for child in path:
-                if child.tag.endswith('title') and child.text == f"{this_region}_{this_region_side}_{this_region_hemi}":
-                    d = path.attrib['d']
-                    path_obj = parse_path(d)
-                    patch = PathPatch(path_obj, facecolor=this_region_color,
-                                      edgecolor=line_color, lw=this_line_thickness)
-                    ax.add_patch(patch)
-                    patches.append(patch)
+    # Determine color and line thickness of every region
+    styles = _region_styles(atlas_ordering, subcortex_data=subcortex_data, color_lookup=color_lookup,
+                            value_column=value_column, cmap=cmap, norm=norm, NA_fill=NA_fill,
+                            fill_alpha=fill_alpha, fill_by_significance=fill_by_significance,
+                            nonsig_fill_alpha=nonsig_fill_alpha, is_cerebellum=True,
+                            line_thickness=line_thickness)
+
+    # Match titles to regions through the prebuilt title index
+    region_paths, path_rows = [], []
+    for row_idx, (this_region, this_region_side, this_region_hemi) in enumerate(
+            atlas_ordering[['region', 'face', 'hemisphere']].itertuples(index=False)):
+        for path_idx in geometry['title_index'].get(f"{this_region}_{this_region_side}_{this_region_hemi}", []):
+            region_paths.append(geometry['paths'][path_idx])
+            path_rows.append(row_idx)
+
+    _add_region_collection(ax, region_paths, path_rows, styles, line_color,
+                           [1] * len(region_paths), autolim=True)
 
     ax.autoscale_view()
     ax.set_aspect('equal')
@@ -670,20 +1191,12 @@ def _plot_helper(atlas_ordering, atlas_data_path, value_column='value',
     # 3. Helper: draw one SVG file onto one axes
     # ------------------------------------------------------------------
     def _draw_svg_on_ax(ax, svg_path_str, df_panel):
-        """Parse svg_path_str and paint each region in df_panel onto ax."""
-        try:
-            tree = ET.parse(svg_path_str)
-        except Exception as e:
-            print(f"  Could not load {svg_path_str}: {e}")
+        """Load the geometry of svg_path_str and paint each region in df_panel onto ax."""
+        geometry = _composite_geometry('Brainstem_Navigator', svg_path_str)
+        if geometry is None:
             return
 
-        root = tree.getroot()
-        ns_uri = 'http://www.w3.org/2000/svg'
-        ns     = {'svg': ns_uri}
-        ET.register_namespace('', ns_uri)
-
-        canvas_w = _parse_svg_dimension(root.get('width'),  fallback=500)
-        canvas_h = _parse_svg_dimension(root.get('height'), fallback=500)
+        canvas_w, canvas_h = geometry['canvas']
 
         ax.set_visible(True)
         ax.set_aspect('equal')
@@ -691,73 +1204,50 @@ def _plot_helper(atlas_ordering, atlas_data_path, value_column='value',
         ax.set_xlim(0, canvas_w)
         ax.set_ylim(canvas_h, 0)   # SVG y-axis is top-down
 
-        all_x, all_y = [], []
+        drawn = []
+        region_paths, path_rows, backing, zorders = [], [], [], []
+
+        # Determine color and line thickness of every region in the panel
+        styles = _region_styles(df_panel, subcortex_data=subcortex_data, color_lookup=color_lookup,
+                                value_column=value_column, cmap=cmap, norm=norm, NA_fill=NA_fill,
+                                fill_alpha=fill_alpha, fill_by_significance=fill_by_significance,
+                                nonsig_fill_alpha=nonsig_fill_alpha, line_thickness=line_thickness)
 
-        # Index df_panel by the title key used in the SVG
+        # Index df_panel rows by the title key used in the SVG
         # Title format in SVG: {region}_{face}_{hemisphere}
         title_to_row = {}
-        for _, row in df_panel.iterrows():
-            hemi_key = _normalise_hemi(row['hemisphere'])
-            key = f"{row['region']}_{row['face']}_{hemi_key}"
-            title_to_row[key] = row
-
-        paths = root.findall('.//svg:path', ns)
-
-        for path_el in paths:
-            # Find the <title> child of this <path>
-            title_el = path_el.find('svg:title', ns)
-            if title_el is None:
-                # try without namespace
-                title_el = path_el.find('title')
-            title_text = title_el.text if title_el is not None else None
-
-            row = title_to_row.get(title_text)
-            if row is None:
+        for row_idx, (region, face, hemi) in enumerate(df_panel[['region', 'face', 'hemisphere']].itertuples(index=False)):
+            title_to_row[f"{region}_{face}_{_normalise_hemi(hemi)}"] = row_idx
+        plot_order = df_panel['plot_order'].to_numpy()
+
+        for path_idx, (mpl_path, title_text) in enumerate(zip(geometry['paths'], geometry['titles'])):
+            row_idx = title_to_row.get(title_text)
+            if row_idx is None:
                 # Region not in our ordering — skip silently
                 continue
 
-            d = path_el.get('d', '')
-            if not d:
-                continue
+            drawn.append(path_idx)
+
+            # Draw white backing first if needed, just below the colour fill
+            if styles['base_color'] is not None:
+                region_paths.append(mpl_path)
+                path_rows.append(row_idx)
+                backing.append(True)
+                zorders.append(int(plot_order[row_idx]) - 0.5)
 
-            # Determine color and alpha
-            this_region_color, base_color, this_line_thickness = _get_region_color(subcortex_data=subcortex_data, color_lookup=color_lookup, 
-                                                                row=row, value_column=value_column, cmap=cmap, 
-                                                                norm=norm, NA_fill=NA_fill, fill_alpha=fill_alpha, 
-                                                                fill_by_significance=fill_by_significance, 
-                                                                nonsig_fill_alpha=nonsig_fill_alpha,
-                                                                line_thickness=line_thickness)
-
-
-            try:
-                mpl_path = parse_path(d)
-                verts = mpl_path.vertices
-                all_x.extend(verts[:, 0])
-                all_y.extend(verts[:, 1])
-
-                # Draw white backing first if needed
-                if base_color is not None:
-                    base_patch = PathPatch(mpl_path,        # or mpl_path depending on the helper
-                                        facecolor=base_color,
-                                        edgecolor='none',  # no outline on the backing
-                                        linewidth=0,
-                                        zorder=int(row['plot_order']) - 0.5)  # just below the colour patch
-                    ax.add_patch(base_patch)
-                    
-                patch = PathPatch(mpl_path,
-                                  facecolor=this_region_color,
-                                  edgecolor=line_color,
-                                  linewidth=this_line_thickness,
-                                  zorder=int(row['plot_order']))
-                ax.add_patch(patch)
-            except Exception as e:
-                print(f"  Could not parse path (title={title_text}): {e}")
+            region_paths.append(mpl_path)
+            path_rows.append(row_idx)
+            backing.append(False)
+            zorders.append(int(plot_order[row_idx]))
+
+        _add_region_collection(ax, region_paths, path_rows, styles, line_color, zorders, backing=backing)
 
         # Tight autoscale based on actual vertices
-        if all_x and all_y:
+        extent = _union_extent(geometry['extents'][drawn])
+        if extent is not None:
             pad = 5
-            ax.set_xlim(min(all_x) - pad, max(all_x) + pad)
-            ax.set_ylim(max(all_y) + pad, min(all_y) - pad)
+            ax.set_xlim(extent[0] - pad, extent[2] + pad)
+            ax.set_ylim(extent[3] + pad, extent[1] - pad)
 
     # ------------------------------------------------------------------
     # 4. Render each panel
@@ -811,7 +1301,7 @@ def _plot_helper(atlas_ordering, atlas_data_path, value_column='value',
     plt.tight_layout(pad=0)
     return fig, axes
 
-def _plot_helper_individual(atlas_ordering, svg_dir, value_column='value', 
+def _plot_helper_individual(atlas_ordering, svg_dir, atlas=None, value_column='value', 
                            hemisphere='L', subcortex_data=None, 
                            views=['medial', 'lateral'], figsize=(8, 8),
                            color_lookup=None, cmap=None, NA_fill="#cccccc", fill_alpha=1.0,
@@ -831,6 +1321,10 @@ def _plot_helper_individual(atlas_ordering, svg_dir, value_column='value',
     svg_dir : str or pathlib.Path
         Directory containing the SVG files for each region.
 
+    atlas : str, optional
+        Atlas name, under which parsed region geometry is cached (see ``warm_geometry_cache``).
+        Defaults to ``svg_dir``.
+
     value_column : str, default='value'
         The name of the column in `atlas_ordering` that contains the values to be visualized.
 
@@ -883,6 +1377,9 @@ def _plot_helper_individual(atlas_ordering, svg_dir, value_column='value',
         2-D array of axes (shape [num_rows, num_cols]). Unused panels are hidden.
     """
 
+    if atlas is None:
+        atlas = str(svg_dir)
+
     # Specify outward--inward view order for single-hemisphere
     SINGLE_VIEW_ORDER = {
         'L': ['medial', 'lateral', 'superior', 'inferior'],
@@ -987,70 +1484,42 @@ def _plot_helper_individual(atlas_ordering, svg_dir, value_column='value',
 
         ax_canvas_w, ax_canvas_h = None, None
         all_x, all_y = [], []
+        region_paths, path_rows, backing, zorders = [], [], [], []
 
-        for _, row in df_view.iterrows():
-            this_region = row['region']
-            hemi = row['hemisphere']
+        # Determine color and line thickness of every region in the view
+        styles = _region_styles(df_view, subcortex_data=subcortex_data, color_lookup=color_lookup,
+                                value_column=value_column, cmap=cmap, norm=norm, NA_fill=NA_fill,
+                                fill_alpha=fill_alpha, fill_by_significance=fill_by_significance,
+                                nonsig_fill_alpha=nonsig_fill_alpha, line_thickness=line_thickness)
 
-            if hemi in ['BL', 'BR']:
-                svg_filename = f"{svg_dir}/{this_region}_{view}.svg"
-            else:
-                svg_filename = f"{svg_dir}/{this_region}_{hemi}_{view}.svg"
-
-            # Determine color and alpha
-            this_region_color, base_color, this_line_thickness = _get_region_color(subcortex_data=subcortex_data, color_lookup=color_lookup, 
-                                                                row=row, value_column=value_column, cmap=cmap, 
-                                                                norm=norm, NA_fill=NA_fill, fill_alpha=fill_alpha, 
-                                                                fill_by_significance=fill_by_significance, 
-                                                                nonsig_fill_alpha=nonsig_fill_alpha,
-                                                                line_thickness=line_thickness)
-
-            try:
-                tree = ET.parse(svg_filename)
-            except Exception as e:
-                print(f"  Skipping {svg_filename}: {e}")
+        for row_idx, (region, hemi, plot_order) in enumerate(df_view[['region', 'hemisphere', 'plot_order']].itertuples(index=False)):
+            geometry = _region_geometry(atlas, svg_dir, region, hemi, view)
+            if geometry is None:
                 continue
 
-            root = tree.getroot()
-            ns = 'http://www.w3.org/2000/svg'
-
             if ax_canvas_w is None:
-                ax_canvas_w = float(root.get('width', 500))
-                ax_canvas_h = float(root.get('height', 500))
+                ax_canvas_w, ax_canvas_h = geometry['canvas']
                 ax.set_xlim(0, ax_canvas_w)
                 ax.set_ylim(ax_canvas_h, 0)
 
-            for path_el in root.findall(f'.//{{{ns}}}path'):
-                d = path_el.get('d', '')
-                if not d:
-                    continue
-                try:
-                    mpl_path = parse_path(d)
-                    verts = mpl_path.vertices
-                    if len(verts) > 0:
-                        all_x.extend(verts[:, 0])
-                        all_y.extend(verts[:, 1])
-
-                    # Draw white backing first if needed
-                    if base_color is not None:
-                        base_patch = PathPatch(mpl_path,        # or mpl_path depending on the helper
-                                            facecolor=base_color,
-                                            edgecolor='none',  # no outline on the backing
-                                            linewidth=0,
-                                            zorder=int(row['plot_order']) - 0.5)  # just below the colour patch
-                        ax.add_patch(base_patch)
-
-                    patch = PathPatch(
-                        mpl_path,
-                        facecolor=this_region_color,
-                        edgecolor=line_color,
-                        linewidth=this_line_thickness,
-                        zorder=row['plot_order'],
-                    )
-                    ax.add_patch(patch)
-                except Exception as e:
-                    print(f"  Could not parse path in {svg_filename}: {e}")
-                    continue
+            if geometry['extent'] is not None:
+                all_x.extend(geometry['extent'][0::2])
+                all_y.extend(geometry['extent'][1::2])
+
+            for mpl_path in geometry['paths']:
+                # Draw white backing first if needed, just below the colour fill
+                if styles['base_color'] is not None:
+                    region_paths.append(mpl_path)
+                    path_rows.append(row_idx)
+                    backing.append(True)
+                    zorders.append(int(plot_order) - 0.5)
+
+                region_paths.append(mpl_path)
+                path_rows.append(row_idx)
+                backing.append(False)
+                zorders.append(plot_order)
+
+        _add_region_collection(ax, region_paths, path_rows, styles, line_color, zorders, backing=backing)
 
         if all_x and all_y:
             pad = 5
@@ -1231,14 +1700,12 @@ def plot_subcortical_data(subcortex_data=None, atlas='aseg_subcortex', value_col
     elif atlas=='SUIT_cerebellar_lobule':
         svg_path = files("subcortex_visualization").joinpath(
             f"data/{atlas}/{atlas}_{hemisphere}.svg")
-        tree = ET.parse(svg_path)
-        root = tree.getroot()
-        ns   = {'svg': 'http://www.w3.org/2000/svg'}
-        ET.register_namespace('', ns['svg'])
-        paths = root.findall('.//svg:path', ns)
+        geometry = _composite_geometry(atlas, str(svg_path))
+        if geometry is None:
+            raise ValueError(f"Could not load the {atlas} flatmap from {svg_path}")
 
         if subcortex_data is None:
-            fig, ax = _plot_helper_cerebellum(atlas_ordering, paths=paths,
+            fig, ax = _plot_helper_cerebellum(atlas_ordering, geometry=geometry,
                                     value_column=value_column,
                                     hemisphere=hemisphere,
                                     cmap=cmap,
@@ -1250,7 +1717,7 @@ def plot_subcortical_data(subcortex_data=None, atlas='aseg_subcortex', value_col
                                     line_thickness=line_thickness,
                                     ax=ax)
         else:
-            fig, ax = _plot_helper_cerebellum(atlas_ordering, paths=paths,
+            fig, ax = _plot_helper_cerebellum(atlas_ordering, geometry=geometry,
                                     value_column=value_column,
                                     hemisphere=hemisphere,
                                     subcortex_data=subcortex_data,
@@ -1271,7 +1738,7 @@ def plot_subcortical_data(subcortex_data=None, atlas='aseg_subcortex', value_col
     else:
         svg_dir=f'{atlas_data_path}/vectors/'
         
-        fig, axes = _plot_helper_individual(atlas_ordering, svg_dir, value_column=value_column, 
+        fig, axes = _plot_helper_individual(atlas_ordering, svg_dir, atlas=atlas, value_column=value_column, 
             hemisphere=hemisphere, subcortex_data=subcortex_data, 
             views=views, figsize=(8, 8), line_color=line_color, line_thickness=line_thickness,
             color_lookup=color_lookup, cmap=cmap, NA_fill=NA_fill, 
@@ -0,0 +1,340 @@
+# Necessary imports
+import numpy as np
+
+def _segments(seg, ufunc, values, empty=np.nan, dtype=None):
+    """
+    Reduce ``values`` over every parcel segment with ``ufunc.reduceat``.
+
+    ``reduceat`` misbehaves on empty segments, so only the non-empty ones are reduced
+    and empty parcels are filled with ``empty``.
+    """
+    out = np.full((len(seg['counts']),) + values.shape[1:], empty)
+    if seg['starts'].size:
+        out[seg['nonempty']] = ufunc.reduceat(values, seg['starts'], axis=0, dtype=dtype)
+    return out
+
+def _per_parcel(seg, counts):
+    """Reshape per-parcel counts to broadcast against per-parcel statistics."""
+    return counts.reshape((-1,) + (1,) * (seg['voxels'].ndim - 1))
+
+def _seg_stat(seg, name):
+    """
+    Compute (or reuse) the registered statistic ``name`` for every parcel of a segment layout.
+
+    Intermediate results such as sums and counts are memoised in ``seg`` so that, e.g.,
+    asking for both the mean and the standard deviation sums each parcel only once.
+    """
+    computed = seg['computed']
+    if name not in computed:
+        computed[name] = _SEGMENT_KERNELS[name](seg)
+    return computed[name]
+
+def _finite_mask(seg):
+    """Boolean mask of the non-NaN voxel values."""
+    return ~np.isnan(seg['voxels'])
+
+def _kernel_count(seg):
+    return seg['counts']
+
+def _kernel_sum(seg):
+    return _segments(seg, np.add, seg['voxels'], empty=0.0, dtype=np.float64)
+
+def _kernel_mean(seg):
+    return _seg_stat(seg, 'sum') / _per_parcel(seg, seg['counts'])
+
+def _kernel_var(seg):
+    # Two-pass variance, as np.var does, for numerical agreement
+    dev = seg['voxels'] - np.repeat(_seg_stat(seg, 'mean'), seg['counts'], axis=0)
+    return _segments(seg, np.add, dev * dev) / _per_parcel(seg, seg['counts'])
+
+def _kernel_std(seg):
+    return np.sqrt(_seg_stat(seg, 'var'))
+
+def _kernel_min(seg):
+    return _segments(seg, np.minimum, seg['voxels'])
+
+def _kernel_max(seg):
+    return _segments(seg, np.maximum, seg['voxels'])
+
+def _kernel_nancount(seg):
+    return _segments(seg, np.add, _finite_mask(seg), empty=0, dtype=np.int64)
+
+def _kernel_nansum(seg):
+    return _segments(seg, np.add, np.where(_finite_mask(seg), seg['voxels'], 0), empty=0.0, dtype=np.float64)
+
+def _kernel_nanmean(seg):
+    return _seg_stat(seg, 'nansum') / _seg_stat(seg, 'nancount')
+
+def _kernel_nanvar(seg):
+    dev = np.where(_finite_mask(seg), seg['voxels'] - np.repeat(_seg_stat(seg, 'nanmean'), seg['counts'], axis=0), 0)
+    return _segments(seg, np.add, dev * dev) / _seg_stat(seg, 'nancount')
+
+def _kernel_nanstd(seg):
+    return np.sqrt(_seg_stat(seg, 'nanvar'))
+
+def _kernel_nanmin(seg):
+    # fmin/fmax skip NaNs unless every value in the segment is NaN
+    return _segments(seg, np.fmin, seg['voxels'])
+
+def _kernel_nanmax(seg):
+    return _segments(seg, np.fmax, seg['voxels'])
+
+def _kernel_sorted(seg):
+    """
+    Sort the voxel values within every parcel segment (independently per volume for 4D input).
+
+    One argsort along the voxel axis followed by a stable argsort on the parcel id (a linear
+    radix sort for small integer ids) regroups the sorted values by parcel, so all parcels are
+    sorted together rather than one at a time. NaNs sort last within each parcel.
+    """
+    # Sort along the last, contiguous axis: one row per volume
+    rows = np.ascontiguousarray(np.atleast_2d(seg['voxels'].T))
+    n_parcels = len(seg['counts'])
+    id_dtype = np.int16 if n_parcels <= np.iinfo(np.int16).max else np.int64
+    parcel_ids = np.repeat(np.arange(n_parcels, dtype=id_dtype), seg['counts'])
+
+    order = np.argsort(rows, axis=1)
+    regroup = np.argsort(parcel_ids[order], axis=1, kind='stable')
+    sorted_rows = np.take_along_axis(rows, np.take_along_axis(order, regroup, axis=1), axis=1)
+    return sorted_rows.T if seg['voxels'].ndim > 1 else sorted_rows[0]
+
+def _sorted_at(seg, positions):
+    """
+    Gather segment-sorted values at absolute voxel ``positions``, shaped like a statistic.
+
+    Positions are clipped to the voxel range; callers mask out parcels where that matters.
+    """
+    sorted_voxels = _seg_stat(seg, 'sorted')
+    positions = np.clip(positions, 0, max(sorted_voxels.shape[0] - 1, 0))
+    return np.take_along_axis(sorted_voxels, positions, axis=0)
+
+def _order_stat(seg, q, nan=False, median=False):
+    """
+    ``q``-th percentile of every parcel from the segment-sorted values, with NumPy's
+    default linear interpolation. Empty parcels (or all-NaN parcels with ``nan=True``) give NaN.
+    """
+    stat_shape = (len(seg['counts']),) + seg['voxels'].shape[1:]
+    if seg['voxels'].shape[0] == 0:
+        return np.full(stat_shape, np.nan)
+
+    if nan:
+        n_valid = _seg_stat(seg, 'nancount')
+    else:
+        n_valid = np.broadcast_to(_per_parcel(seg, seg['counts']), stat_shape)
+    has_values = n_valid > 0
+
+    # Bracketing ranks within each parcel; NaNs sort last, so they are never reached with nan=True
+    virtual = (q / 100) * np.maximum(n_valid - 1, 0)
+    below = np.floor(virtual).astype(np.int64)
+    above = np.ceil(virtual).astype(np.int64)
+    starts = _per_parcel(seg, seg['offsets'][:-1])
+    a = _sorted_at(seg, starts + below)
+    b = _sorted_at(seg, starts + above)
+
+    if median:
+        # np.median averages the two middle values
+        out = (a + b) / 2
+    else:
+        # Same interpolation as NumPy's linear method
+        gamma = virtual - below
+        diff = b - a
+        out = np.where(gamma >= 0.5, b - diff * (1 - gamma), a + diff * gamma)
+
+    if not nan:
+        # Any NaN in a parcel sorts last and makes its percentile NaN, as in np.percentile
+        out = np.where(np.isnan(_sorted_at(seg, _per_parcel(seg, seg['offsets'][1:]) - 1)), np.nan, out)
+    return np.where(has_values, out, np.nan)
+
+def _percentile_kernel(q, nan=False, median=False):
+    """
+    Build a kernel for the ``q``-th percentile (linear interpolation, as ``np.percentile``).
+    """
+    def _kernel(seg):
+        return _order_stat(seg, q, nan=nan, median=median)
+    return _kernel
+
+# Registered statistics: the callable passed as ``parc_stat`` maps to a kernel name,
+# and each kernel computes that statistic for all parcels at once. Any callable not
+# listed here falls back to one call per parcel.
+_SEGMENT_STATS = {
+    np.mean: 'mean',
+    np.std: 'std',
+    np.var: 'var',
+    np.sum: 'sum',
+    np.min: 'min',
+    np.amin: 'min',
+    np.max: 'max',
+    np.amax: 'max',
+    np.size: 'count',
+    np.median: 'median',
+    np.nanmean: 'nanmean',
+    np.nanstd: 'nanstd',
+    np.nanvar: 'nanvar',
+    np.nansum: 'nansum',
+    np.nanmin: 'nanmin',
+    np.nanmax: 'nanmax',
+    np.nanmedian: 'nanmedian',
+}
+
+_SEGMENT_KERNELS = {
+    'count': _kernel_count,
+    'sum': _kernel_sum,
+    'mean': _kernel_mean,
+    'var': _kernel_var,
+    'std': _kernel_std,
+    'min': _kernel_min,
+    'max': _kernel_max,
+    'sorted': _kernel_sorted,
+    'median': _percentile_kernel(50, median=True),
+    'nancount': _kernel_nancount,
+    'nansum': _kernel_nansum,
+    'nanmean': _kernel_nanmean,
+    'nanvar': _kernel_nanvar,
+    'nanstd': _kernel_nanstd,
+    'nanmin': _kernel_nanmin,
+    'nanmax': _kernel_nanmax,
+    'nanmedian': _percentile_kernel(50, nan=True, median=True),
+}
+
+# Kernel names that users may not replace
+_BUILTIN_KERNELS = frozenset(_SEGMENT_KERNELS)
+
+# Percentile statistics created so far, so the same q always gives the same callable
+_PERCENTILE_STATS = {}
+
+def register_segment_stat(func, kernel, name=None):
+    """
+    Register a vectorised implementation of a summary statistic.
+
+    After registration, passing ``func`` as (or in) ``parc_stat`` computes the statistic
+    for every parcel with a single call to ``kernel`` instead of calling ``func`` once per parcel.
+
+    Parameters
+    ----------
+    func : callable
+        The statistic as users pass it to ``parc_stat``. Its ``__name__`` labels the output.
+
+    kernel : callable
+        ``kernel(voxels, offsets)`` returning an array of shape ``(n_parcels,) + voxels.shape[1:]``.
+        ``voxels`` holds every parcel voxel grouped by parcel, with shape (n_voxels,) for 3D
+        input or (n_voxels, T) for 4D input; parcel ``i`` occupies ``voxels[offsets[i]:offsets[i + 1]]``
+        and may be empty.
+
+    name : str, optional
+        Registry name for the kernel. Defaults to ``func.__name__``. Built-in names such as
+        'mean' or 'median' cannot be replaced.
+
+    Returns
+    -------
+    callable
+        ``func``, unchanged.
+    """
+    if name is None:
+        name = func.__name__
+    if name in _BUILTIN_KERNELS:
+        raise ValueError(f"'{name}' is a built-in statistic and cannot be re-registered; choose another name.")
+    _SEGMENT_KERNELS[name] = lambda seg: kernel(seg['voxels'], seg['offsets'])
+    _SEGMENT_STATS[func] = name
+    return func
+
+def percentile_stat(q, nan=False):
+    """
+    Return a summary statistic computing the ``q``-th percentile of each parcel.
+
+    Parameters
+    ----------
+    q : float
+        Percentile in [0, 100].
+
+    nan : bool, default=False
+        If True, ignore NaN voxels (as ``np.nanpercentile``).
+
+    Returns
+    -------
+    callable
+        A function ``f(x, axis=0)`` named e.g. 'percentile_95' (or 'nanpercentile_95'),
+        usable as ``parc_stat`` and computed for all parcels at once.
+    """
+    q = float(q)
+    if not 0 <= q <= 100:
+        raise ValueError(f"Percentiles must be in [0, 100]; got {q}.")
+    key = (q, bool(nan))
+    if key not in _PERCENTILE_STATS:
+        reduce = np.nanpercentile if nan else np.percentile
+        def _stat(x, axis=0):
+            return reduce(x, q, axis=axis)
+        _stat.__name__ = f"{'nan' if nan else ''}percentile_{q:g}"
+        _SEGMENT_KERNELS[_stat.__name__] = _percentile_kernel(q, nan=nan)
+        _SEGMENT_STATS[_stat] = _stat.__name__
+        _PERCENTILE_STATS[key] = _stat
+    return _PERCENTILE_STATS[key]
+
+def _segment_columns(input_data, index, offsets, parc_stat):
+    """
+    Apply each summary statistic to every parcel of a label-sorted voxel layout, by statistic.
+
+    Statistics registered in ``_SEGMENT_STATS`` are computed for all parcels at once
+    by their kernels over a single gather of the input; any other callable is called
+    once per parcel as ``s(voxels, axis=0)``.
+
+    Parameters
+    ----------
+    input_data : numpy.ndarray
+        3D or 4D input data. Only the first three dimensions are indexed.
+
+    index : numpy.ndarray
+        Flat voxel indices grouped by parcel, as returned by ``_parcel_layout``.
+
+    offsets : numpy.ndarray
+        Segment boundaries into ``index``, as returned by ``_parcel_layout``.
+
+    parc_stat : list of callable
+        Summary statistics to compute.
+
+    Returns
+    -------
+    list
+        ``columns[j][i]`` is statistic ``parc_stat[j]`` for parcel ``i``. Registered
+        statistics give an array with one row per parcel, other callables a list.
+    """
+    n_parcels = len(offsets) - 1
+
+    # One gather of every parcel voxel; shape (n_voxels,) or (n_voxels, T)
+    voxels = input_data[np.unravel_index(index, input_data.shape[:3])]
+
+    counts = np.diff(offsets)
+    seg = {
+        'voxels': voxels,
+        'offsets': offsets,
+        'counts': counts,
+        'nonempty': counts > 0,
+        'starts': offsets[:-1][counts > 0],
+        'computed': {},
+    }
+
+    columns = []
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for s in parc_stat:
+            name = _SEGMENT_STATS.get(s)
+            if name is not None:
+                columns.append(_seg_stat(seg, name))
+            else:
+                # Arbitrary user callable: per-parcel fallback on contiguous segments
+                columns.append([s(voxels[offsets[i]:offsets[i + 1]], axis=0) for i in range(n_parcels)])
+
+    return columns
+
+def _segment_reduce(input_data, index, offsets, parc_stat):
+    """
+    Apply each summary statistic to every parcel of a label-sorted voxel layout, by parcel.
+
+    Takes the arguments of ``_segment_columns``.
+
+    Returns
+    -------
+    list of list
+        ``vals[i][j]`` is statistic ``parc_stat[j]`` for parcel ``i`` — a scalar for
+        3D input, or an array of length T for 4D input.
+    """
+    columns = _segment_columns(input_data, index, offsets, parc_stat)
+    return [list(parcel_vals) for parcel_vals in zip(*columns)]
@@ -1,5 +1,7 @@
 # Necessary imports 
 import os
+import gzip
+import warnings
 import numpy as np
 import pandas as pd
 
@@ -7,22 +9,1565 @@ import pandas as pd
 import nibabel as nib
 from nilearn.image import resample_img
 
+# Sparse parcel-averaging matrices
+from scipy import sparse
+
 # Files 
 from importlib.resources import files
 
-# Regular expressions
-import re
+# In-process atlas cache
+from .atlas_cache import _cache_get, _cache_put, _disk_cache_load, _disk_cache_store, _load_npz, clear_atlas_cache
+from .atlas_cache import _INPUT_CACHE_STATE, _input_cache_get, _input_cache_put
+from .atlas_cache import _SIDECAR_STATE, _source_digest, _sidecar_paths, _sidecar_load, _sidecar_store
+
+# Vectorised per-parcel statistics
+from .segment_stats import _SEGMENT_STATS, _segment_columns, _segment_reduce
+
+# Regular expressions
+import re
+
+# Batch processing
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+def _unique_labels(labels):
+    """
+    Return the sorted unique labels of an integer label volume.
+
+    Uses a single ``np.bincount`` pass for non-negative labels rather than sorting the whole volume.
+    """
+    flat_labels = labels.ravel()
+    if flat_labels.size and flat_labels.min() >= 0:
+        return np.flatnonzero(np.bincount(flat_labels))
+    return np.unique(flat_labels)
+
+def _parcel_layout(labels, label_ids):
+    """
+    Build a label-sorted voxel layout in which every parcel is a contiguous segment.
+
+    Parameters
+    ----------
+    labels : numpy.ndarray
+        3D integer label volume.
+
+    label_ids : array-like of int
+        Sorted, unique labels to include.
+
+    Returns
+    -------
+    index : numpy.ndarray
+        Flat (C-order) voxel indices grouped by parcel. Within each parcel, voxels
+        keep C order, matching the order of ``input_data[labels == lab]``.
+
+    offsets : numpy.ndarray
+        Array of length ``len(label_ids) + 1``; parcel ``i`` occupies
+        ``index[offsets[i]:offsets[i + 1]]``.
+    """
+    label_ids = np.asarray(label_ids)
+    flat_labels = labels.ravel()
+
+    # Only voxels belonging to a requested parcel take part in the sort
+    in_parcel = np.flatnonzero(np.isin(flat_labels, label_ids))
+    in_parcel_labels = flat_labels[in_parcel]
+    order = np.argsort(in_parcel_labels, kind='stable')
+    index = in_parcel[order]
+
+    # Segment boundaries
+    counts = (np.searchsorted(in_parcel_labels[order], label_ids, side='right')
+              - np.searchsorted(in_parcel_labels[order], label_ids, side='left'))
+    offsets = np.concatenate([[0], np.cumsum(counts)])
+
+    return index, offsets
+
+def _layout_bbox(index, shape):
+    """
+    Return the bounding box of a set of flat voxel indices.
+
+    Parameters
+    ----------
+    index : numpy.ndarray
+        Flat (C-order) voxel indices.
+
+    shape : tuple of int
+        Spatial shape the indices refer to.
+
+    Returns
+    -------
+    lo, hi : numpy.ndarray
+        Inclusive lower and exclusive upper corner of the box (both zero for an empty index).
+    """
+    if len(index) == 0:
+        return np.zeros(3, dtype=np.int64), np.zeros(3, dtype=np.int64)
+    coords = np.unravel_index(index, shape)
+    lo = np.array([c.min() for c in coords], dtype=np.int64)
+    hi = np.array([c.max() + 1 for c in coords], dtype=np.int64)
+    return lo, hi
+
+def _read_block(input_vol, lo, hi, dtype=None, volumes=None):
+    """
+    Read only the spatial sub-block ``[lo, hi)`` of an image (all volumes, if 4D).
+
+    Slicing ``dataobj`` lets nibabel's array proxy read just the needed part of the file,
+    rather than decoding the whole image as float64 with ``get_fdata()``.
+
+    Parameters
+    ----------
+    input_vol : nibabel.spatialimages.SpatialImage
+        Input image.
+
+    lo, hi : array-like of int
+        Inclusive lower and exclusive upper corner of the block.
+
+    dtype : numpy dtype, optional
+        Cast the block to this dtype. If None, the stored dtype (after any scaling) is kept.
+
+    volumes : slice, optional
+        For 4D images, the range of volumes to read; all volumes by default.
+
+    Returns
+    -------
+    numpy.ndarray
+        The block, of shape ``hi - lo`` (plus the time dimension for 4D images).
+    """
+    slices = tuple(slice(int(l), int(h)) for l, h in zip(lo, hi))
+    if volumes is not None and len(input_vol.shape) > 3:
+        slices = slices + (volumes,)
+    block = np.asanyarray(input_vol.dataobj[slices])
+    if dtype is not None:
+        block = block.astype(dtype, copy=False)
+    return block
+
+def _block_index(index, shape, lo, block_shape):
+    """
+    Re-express flat voxel indices into ``shape`` as flat indices into a sub-block starting at ``lo``.
+    """
+    coords = np.unravel_index(index, shape)
+    return np.ravel_multi_index(tuple(c - l for c, l in zip(coords, lo)), block_shape)
+
+def _parse_hemisphere(region_name):
+    """
+    Infer the hemisphere of an atlas region from its name suffix.
+
+    Parameters
+    ----------
+    region_name : str
+        Region name as listed in the atlas lookup table (or Brainstem_Navigator ROI filename).
+
+    Returns
+    -------
+    region : str
+        Region name with the hemisphere suffix stripped.
+
+    hemisphere : str
+        'L', 'R', 'V' (vermis), or 'B' (bilateral/midline).
+    """
+    hemisphere = 'B'
+    if region_name.endswith(('_lh', '-lh', '-L', '_L', '_l', '_LH')):
+        hemisphere = 'L'
+    elif region_name.endswith(('_rh', '-rh', '-R', '_R', '_r', '_RH')):
+        hemisphere = 'R'
+    elif 'vermis' in region_name:
+        hemisphere = 'V'
+
+    # Strip hemisphere suffix to get the clean region name
+    region = re.sub(r'(_lh|-lh|-L|_L|_l|_LH|_rh|-rh|-R|_R|_r|_RH|-vermis)$', '', region_name)
+
+    return region, hemisphere
+
+def _source_fingerprint(paths):
+    """
+    Return a short fingerprint of the contents of atlas source files (see ``_source_digest``),
+    so that pyramid files, ROI indices and disk cache entries derived from them are not reused
+    after the packaged files change, even if their sizes stay the same.
+    """
+    return _source_digest(paths)[:16]
+
+def _resample_key(this_atlas, atlas_space, atlas_entry, input_affine, input_shape, interpolation):
+    """Disk cache key for an atlas resampled to the input grid."""
+    return ('resampled', atlas_space, this_atlas, tuple(int(s) for s in input_shape),
+            np.round(np.asarray(input_affine, dtype=float), 6).tobytes(), interpolation,
+            atlas_entry['fingerprint'])
+
+def _label_dtype(max_label):
+    """Smallest unsigned integer dtype that holds labels up to ``max_label``."""
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if max_label <= np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+def _compact_labels(labels):
+    """
+    Return a label volume as integers of the smallest dtype that holds them.
+
+    Float volumes (e.g. scaled or resampled labels) are rounded first; integer volumes that
+    already fit are returned without a copy.
+    """
+    labels = np.asanyarray(labels)
+    if not np.issubdtype(labels.dtype, np.integer):
+        labels = np.round(labels)
+    if labels.size == 0:
+        return labels.astype(np.uint8)
+    min_label, max_label = labels.min(), labels.max()
+    if min_label >= 0:
+        dtype = _label_dtype(max_label)
+    else:
+        # Signed labels (e.g. undershoot of cubic resampling) keep the smallest signed type that holds them
+        dtype = np.promote_types(np.min_scalar_type(int(min_label)), np.min_scalar_type(int(max_label)))
+    return labels.astype(dtype, copy=False)
+
+def _decode_labels(vol):
+    """
+    Decode a NIfTI label volume into compact integers.
+
+    Integer files without scaling are read in their stored dtype; otherwise the (scaled) values
+    are read in the proxy's native float precision, rather than float64 via ``get_fdata()``.
+    """
+    return _compact_labels(np.asanyarray(vol.dataobj))
+
+def _decode_brainstem_navigator(nifti_files):
+    """
+    Decode the per-ROI NIfTI files of the Brainstem_Navigator atlas into one compact ROI index.
+
+    Parameters
+    ----------
+    nifti_files : list of importlib.resources.abc.Traversable or pathlib.Path
+        The ROI files, in ROI order.
+
+    Returns
+    -------
+    dict
+        Atlas entry; see ``_load_atlas``.
+    """
+    roi_names, roi_indices, roi_values = [], [], []
+    affine, shape = None, None
+    for nifti_path in nifti_files:
+        roi_vol = nib.load(nifti_path)
+        roi_data = np.asanyarray(roi_vol.dataobj)
+        # All ROIs of a space share one grid
+        affine, shape = roi_vol.affine, roi_data.shape[:3]
+
+        roi_index = np.flatnonzero(roi_data)
+        roi_names.append(nifti_path.name.replace('.nii.gz', ''))
+        roi_indices.append(roi_index)
+        roi_values.append(roi_data.ravel()[roi_index].astype(np.float32))
+
+    return {
+        'fingerprint': _source_fingerprint(nifti_files),
+        'affine': affine,
+        'shape': shape,
+        'roi_names': roi_names,
+        'index': np.concatenate(roi_indices) if roi_indices else np.empty(0, dtype=np.int64),
+        'offsets': np.concatenate([[0], np.cumsum([len(idx) for idx in roi_indices])]).astype(np.int64),
+        'values': np.concatenate(roi_values) if roi_values else np.empty(0, dtype=np.float32),
+    }
+
+def build_brainstem_navigator_index(atlas_space='MNI152NLin6Asym', output_path=None):
+    """
+    Build the consolidated ROI index for the Brainstem_Navigator atlas.
+
+    The atlas ships one NIfTI file per ROI. This decodes them once and writes every ROI's
+    flat voxel indices and values (overlaps preserved) into a single uncompressed ``.npz``
+    file, which ``parcel_segstats`` memory-maps instead of decoding the ROI files. The index
+    records a fingerprint of the ROI files and is ignored if they change.
+
+    Parameters
+    ----------
+    atlas_space : str, default='MNI152NLin6Asym'
+        Standard space of the atlas files.
+
+    output_path : str, optional
+        Where to write the index. Defaults to ``Brainstem_Navigator_index.npz`` alongside
+        the ROI files in the package directory.
+
+    Returns
+    -------
+    str
+        Path of the written index file.
+    """
+    atlas_dir = files("subcortex_visualization.atlases").joinpath(f"{atlas_space}/Brainstem_Navigator")
+    nifti_files = sorted([f for f in atlas_dir.iterdir() if f.name.endswith('.nii.gz')])
+    atlas_entry = _decode_brainstem_navigator(nifti_files)
+
+    if output_path is None:
+        output_path = str(atlas_dir.joinpath("Brainstem_Navigator_index.npz"))
+
+    index_dtype = np.int32 if np.prod(atlas_entry['shape']) < np.iinfo(np.int32).max else np.int64
+    np.savez(output_path,
+             fingerprint=np.array(atlas_entry['fingerprint']),
+             affine=atlas_entry['affine'],
+             shape=np.array(atlas_entry['shape']),
+             roi_names=np.array(atlas_entry['roi_names']),
+             index=atlas_entry['index'].astype(index_dtype),
+             offsets=atlas_entry['offsets'],
+             values=atlas_entry['values'].astype(np.float32))
+
+    return output_path
+
+def _atlas_files(this_atlas, atlas_space):
+    """
+    Resolve the packaged volume and lookup table files of a label atlas.
+
+    Returns
+    -------
+    this_atlas_volume_path, this_atlas_LUT_path : importlib.resources.abc.Traversable
+        Paths of the atlas volume and its lookup table.
+    """
+    # Some atlases carry a '_subcortex' suffix
+    atlas_dir = files("subcortex_visualization.atlases").joinpath(f"{atlas_space}/{this_atlas}")
+    if atlas_dir.joinpath(f"{this_atlas}.nii.gz").is_file():
+        this_atlas_volume_path = atlas_dir.joinpath(f"{this_atlas}.nii.gz")
+        this_atlas_LUT_path = atlas_dir.joinpath(f"{this_atlas}_lookup.csv")
+    elif atlas_dir.joinpath(f"{this_atlas}_subcortex.nii.gz").is_file():
+        this_atlas_volume_path = atlas_dir.joinpath(f"{this_atlas}_subcortex.nii.gz")
+        this_atlas_LUT_path = atlas_dir.joinpath(f"{this_atlas}_subcortex_lookup.csv")
+        Warning(f"Atlas volume file for atlas '{this_atlas}' not found with expected filename '{this_atlas}.nii.gz'. Successfully loaded atlas volume with alternative filename '{this_atlas}_subcortex.nii.gz'. Please check that the atlas volume file in the package directory is named according to one of these two conventions to avoid this warning in the future.")
+    else:
+        raise FileNotFoundError(f"Atlas volume file not found for atlas '{this_atlas}'. Looked for files named '{this_atlas}.nii.gz' and '{this_atlas}_subcortex.nii.gz' in the subcortex_visualization.atlases package directory. Please check that the atlas name is correct and that the corresponding atlas volume file is present in the package directory.")
+
+    return this_atlas_volume_path, this_atlas_LUT_path
+
+def _sidecar_labels(key, source_paths, decode):
+    """
+    Return labels memory-mapped from a valid sidecar, or decode them with ``decode()``
+    (writing a sidecar if sidecars are enabled; see ``set_atlas_sidecars``).
+    """
+    if not (_SIDECAR_STATE['enabled'] or os.path.exists(_sidecar_paths(key)[1])):
+        return decode()
+
+    digest = _source_digest(source_paths)
+    labels = _sidecar_load(key, digest)
+    if labels is None:
+        labels = decode()
+        if _SIDECAR_STATE['enabled']:
+            labels = _sidecar_store(key, labels, digest)
+    return labels
+
+def _load_atlas(this_atlas, atlas_space):
+    """
+    Load an atlas from the package directory, decoded once per process and kept in the atlas cache.
+
+    Parameters
+    ----------
+    this_atlas : str
+        Name of the atlas.
+
+    atlas_space : str
+        Standard space of the atlas files.
+
+    Returns
+    -------
+    dict
+        For label atlases: 'labels' (3D integer array), 'affine', and the per-LUT-row
+        metadata 'lut_index' (label value), 'lut_region' and 'lut_hemisphere'.
+        For Brainstem_Navigator: 'affine', 'shape', 'roi_names', and the ROIs stored as
+        flat (C-order) voxel indices 'index' with segment 'offsets' and ROI 'values'.
+        Both include a 'fingerprint' of the source files.
+    """
+    cache_key = ('atlas', atlas_space, this_atlas)
+    atlas_entry = _cache_get(cache_key)
+    if atlas_entry is not None:
+        return atlas_entry
+
+    if this_atlas == 'Brainstem_Navigator':
+        atlas_dir = files("subcortex_visualization.atlases").joinpath(f"{atlas_space}/{this_atlas}")
+        nifti_files = sorted([f for f in atlas_dir.iterdir() if f.name.endswith('.nii.gz')])
+        fingerprint = _source_fingerprint(nifti_files)
+
+        # Prefer the consolidated ROI index (one memory-mapped read) over decoding every ROI file
+        index_path = atlas_dir.joinpath(f"{this_atlas}_index.npz")
+        atlas_entry = None
+        if index_path.is_file():
+            stored = _load_npz(index_path)
+            if str(stored['fingerprint']) == fingerprint:
+                atlas_entry = {
+                    'fingerprint': fingerprint,
+                    'affine': np.asarray(stored['affine']),
+                    'shape': tuple(int(s) for s in stored['shape']),
+                    'roi_names': [str(name) for name in stored['roi_names']],
+                    'index': stored['index'],
+                    'offsets': np.asarray(stored['offsets']),
+                    'values': stored['values'],
+                }
+            else:
+                warnings.warn(f"The Brainstem_Navigator ROI index for '{atlas_space}' is out of date with the ROI files; decoding the ROI files instead. Re-build it with build_brainstem_navigator_index('{atlas_space}').", stacklevel=2)
+
+        if atlas_entry is None:
+            atlas_entry = _decode_brainstem_navigator(nifti_files)
+        return _cache_put(cache_key, atlas_entry)
+
+    this_atlas_volume_path, this_atlas_LUT_path = _atlas_files(this_atlas, atlas_space)
+    this_atlas_vol = nib.load(this_atlas_volume_path)
+    # Define atlas lookup table (LUT)
+    this_atlas_LUT = pd.read_csv(this_atlas_LUT_path, header=None)
+
+    # If first row has 'Region_Name' in any column, then set the column names to the first row and drop the first row from the data
+    if this_atlas_LUT.iloc[0].str.contains('Region_Name').any():
+        this_atlas_LUT.columns = this_atlas_LUT.iloc[0]
+        this_atlas_LUT = this_atlas_LUT.drop(0).reset_index(drop=True)
+
+    this_atlas_LUT.columns = ['Index', 'Region']
+    # Label values as integers, whether read as numbers or (possibly BOM-prefixed) strings
+    lut_index = [int(float(str(value).strip().lstrip('\ufeff'))) for value in this_atlas_LUT['Index'].values]
+    lut_region, lut_hemisphere = zip(*[_parse_hemisphere(name) for name in this_atlas_LUT['Region'].values])
+
+    atlas_entry = {
+        'fingerprint': _source_fingerprint([this_atlas_volume_path, this_atlas_LUT_path]),
+        # Label volumes may be stored as (scaled) floats; keep them as compact integers
+        'labels': _sidecar_labels(cache_key, [this_atlas_volume_path], lambda: _decode_labels(this_atlas_vol)),
+        'affine': this_atlas_vol.affine,
+        'lut_index': lut_index,
+        'lut_region': list(lut_region),
+        'lut_hemisphere': list(lut_hemisphere),
+    }
+    return _cache_put(cache_key, atlas_entry)
+
+# Standard grids of each space that atlases are pre-resampled to: 'res' -> (affine, shape).
+# MNI152NLin6Asym follows the FSL MNI152 templates and MNI152NLin2009cAsym the TemplateFlow ones.
+_STANDARD_GRIDS = {
+    'MNI152NLin6Asym': {
+        f'{res}mm': (np.array([[-res, 0, 0, 90], [0, res, 0, -126], [0, 0, res, -72], [0, 0, 0, 1]], dtype=float),
+                     tuple(int(np.ceil(n / res)) for n in (182, 218, 182)))
+        for res in (1, 2, 3)
+    },
+    'MNI152NLin2009cAsym': {
+        f'{res}mm': (np.array([[res, 0, 0, -96], [0, res, 0, -132], [0, 0, res, -78], [0, 0, 0, 1]], dtype=float),
+                     tuple(int(np.ceil(n / res)) for n in (193, 229, 193)))
+        for res in (1, 2, 3)
+    },
+}
+
+def _match_standard_grid(atlas_space, affine, shape):
+    """
+    Find the standard grid of ``atlas_space`` whose voxel centres coincide with a given grid.
+
+    Grids may differ from the standard grid by flipped axes (e.g. LAS vs RAS storage of the
+    same voxels), which are returned so that data can be flipped exactly instead of resampled.
+
+    Returns
+    -------
+    grid : str or None
+        Name of the matching grid (e.g. '2mm'), or None if no standard grid matches.
+
+    flip_axes : tuple of int
+        Axes along which the given grid runs opposite to the standard grid.
+    """
+    shape = tuple(int(s) for s in shape[:3])
+    affine = np.asarray(affine, dtype=float)
+    for grid, (grid_affine, grid_shape) in _STANDARD_GRIDS.get(atlas_space, {}).items():
+        if shape != grid_shape:
+            continue
+        flip_axes = tuple(axis for axis in range(3)
+                          if np.allclose(affine[:3, axis], -grid_affine[:3, axis]) and not np.allclose(affine[:3, axis], 0))
+        # Flipping an axis moves the origin to the far end of that axis
+        flipped = grid_affine.copy()
+        for axis in flip_axes:
+            flipped[:3, 3] += grid_affine[:3, axis] * (grid_shape[axis] - 1)
+            flipped[:3, axis] *= -1
+        if np.allclose(affine, flipped):
+            return grid, flip_axes
+    return None, ()
+
+def _flip_index(index, shape, flip_axes):
+    """Re-express flat voxel indices after flipping a grid of ``shape`` along ``flip_axes``."""
+    if not flip_axes:
+        return index
+    coords = list(np.unravel_index(index, shape))
+    for axis in flip_axes:
+        coords[axis] = shape[axis] - 1 - coords[axis]
+    return np.ravel_multi_index(tuple(coords), shape)
+
+def _grid_transform(atlas_affine, input_affine):
+    """
+    Relate an input grid to an atlas grid when they are axis-aligned with integer zoom factors.
+
+    Returns
+    -------
+    tuple of numpy.ndarray or None
+        ``(scale, offset)`` such that input voxel ``i`` is centred on atlas voxel coordinate
+        ``scale * i + offset`` along each axis, where every ``|scale|`` is an integer (input
+        coarser than or equal to the atlas) or the reciprocal of one (input finer). None if the
+        grids are rotated or sheared relative to each other, or the zoom is not integer.
+    """
+    voxel_map = np.linalg.solve(np.asarray(atlas_affine, dtype=float), np.asarray(input_affine, dtype=float))
+    linear = voxel_map[:3, :3]
+    scale = np.diag(linear).copy()
+    if not np.allclose(linear, np.diag(scale), atol=1e-6) or np.any(np.isclose(scale, 0)):
+        return None
+    zoom = np.where(np.abs(scale) >= 1, np.abs(scale), 1 / np.abs(scale))
+    if not np.allclose(zoom, np.round(zoom), atol=1e-6):
+        return None
+    # Snap to exact values so that voxel arithmetic is not thrown off by float noise
+    scale = np.sign(scale) * np.where(np.abs(scale) >= 1, np.round(zoom), 1 / np.round(zoom))
+    offset = voxel_map[:3, 3]
+    offset = np.where(np.isclose(offset * 2, np.round(offset * 2), atol=1e-6), np.round(offset * 2) / 2, offset)
+    return scale, offset
+
+def _axis_taps(scale, offset, mode):
+    """
+    Atlas voxels covered by each input voxel along one axis, relative to ``floor(scale * i + offset)``.
+
+    Returns
+    -------
+    list of (int, float)
+        (offset, overlap fraction) pairs, heaviest (then most central) first; the pattern is the
+        same for every input voxel because the zoom is an integer. None if input voxel centres
+        fall halfway between atlas voxels, where there is no single nearest atlas voxel (when the
+        input is finer, in either mode; when it is coarser, with ``mode='nearest'``).
+    """
+    if abs(scale) < 1:
+        # Finer input: every input voxel lies within one atlas voxel, unless its centre is on a boundary.
+        # Centres repeat the same positions relative to atlas voxels every 1/|scale| input voxels.
+        zoom = int(round(1 / abs(scale)))
+        if np.any(np.isclose((np.arange(zoom) / zoom + offset) % 1, 0.5)):
+            return None
+        return [(0, 1.0)]
+
+    frac = offset - np.floor(offset)
+    if mode == 'nearest':
+        if np.isclose(frac, 0.5):
+            return None
+        return [(int(frac > 0.5), 1.0)]
+
+    half = abs(scale) / 2
+    taps = []
+    for j in range(int(np.floor(frac - half)), int(np.ceil(frac + half)) + 1):
+        overlap = min(frac + half, j + 0.5) - max(frac - half, j - 0.5)
+        if overlap > 1e-9:
+            taps.append((j, overlap / abs(scale)))
+    return sorted(taps, key=lambda tap: (-tap[1], abs(tap[0] - frac)))
+
+def _gather_taps(labels, transform, input_shape, mode='majority'):
+    """
+    Gather, for every input voxel, the atlas labels it covers, by index arithmetic.
+
+    Work is restricted to the sub-box of the input grid that can reach an atlas parcel.
+
+    Returns
+    -------
+    ranges : tuple of slice
+        The sub-box of the input grid.
+
+    taps : list of (numpy.ndarray, float)
+        One (labels on the sub-box, overlap fraction) pair per covered atlas voxel position,
+        heaviest first. Positions outside the atlas read label 0.
+
+    None is returned instead if nearest atlas voxels are ambiguous on this grid (see ``_axis_taps``).
+    """
+    scale, offset = transform
+    axis_taps = [_axis_taps(scale[axis], offset[axis], mode) for axis in range(3)]
+    if any(taps is None for taps in axis_taps):
+        return None
+
+    in_parcel = labels != 0
+    ranges, bases = [], []
+    for axis in range(3):
+        centre = scale[axis] * np.arange(input_shape[axis]) + offset[axis]
+        # Upsampled input voxels sit inside the nearest atlas voxel
+        axis_base = np.floor(centre + (1e-9 if abs(scale[axis]) >= 1 else 0.5 - 1e-9)).astype(np.int64)
+
+        occupied = np.flatnonzero(np.any(in_parcel, axis=tuple(a for a in range(3) if a != axis)))
+        hits = np.zeros(input_shape[axis], dtype=bool)
+        if occupied.size:
+            for tap, _ in axis_taps[axis]:
+                hits |= (axis_base + tap >= occupied[0]) & (axis_base + tap <= occupied[-1])
+        keep = np.flatnonzero(hits)
+        ranges.append(slice(int(keep[0]), int(keep[-1]) + 1) if keep.size else slice(0, 0))
+        bases.append(axis_base[ranges[-1]])
+
+    taps = []
+    for (ox, wx) in axis_taps[0]:
+        for (oy, wy) in axis_taps[1]:
+            for (oz, wz) in axis_taps[2]:
+                coords = [bases[0] + ox, bases[1] + oy, bases[2] + oz]
+                inside = [(c >= 0) & (c < n) for c, n in zip(coords, labels.shape)]
+                inside = inside[0][:, None, None] & inside[1][None, :, None] & inside[2][None, None, :]
+                gathered = labels[np.ix_(*[np.clip(c, 0, n - 1) for c, n in zip(coords, labels.shape)])]
+                taps.append((np.where(inside, gathered, 0), wx * wy * wz))
+    taps.sort(key=lambda tap: -tap[1])
+
+    return tuple(ranges), taps
+
+def _labels_by_index(labels, transform, input_shape, mode='majority'):
+    """
+    Map an atlas label volume onto an axis-aligned input grid by index arithmetic, without resampling.
+
+    Translations, field-of-view differences and flips copy labels exactly. When input voxels are
+    an integer factor larger than atlas voxels, each takes the label covering most of its volume
+    (``mode='majority'``; ties go to the heavier, then more central, atlas voxel) or the label at
+    its centre (``mode='nearest'``). Input voxels outside the atlas are labelled 0.
+
+    Returns
+    -------
+    numpy.ndarray or None
+        The label volume on the input grid, or None if nearest atlas voxels are ambiguous on this grid.
+    """
+    gathered = _gather_taps(labels, transform, input_shape, mode=mode)
+    if gathered is None:
+        return None
+    ranges, taps = gathered
+
+    best, best_score = taps[0][0], np.zeros(taps[0][0].shape)
+    if len(taps) > 1:
+        # Majority vote over the overlap-weighted labels of the covered atlas voxels
+        for candidate, _ in taps:
+            score = np.zeros(candidate.shape)
+            for other, weight in taps:
+                score += weight * (other == candidate)
+            better = score > best_score + 1e-9
+            best = np.where(better, candidate, best)
+            best_score = np.where(better, score, best_score)
+
+    out = np.zeros(input_shape, dtype=labels.dtype)
+    out[ranges] = best
+    return out
+
+def _weighted_index_layout(labels, transform, input_shape, ignore_background=True, background_value=0):
+    """
+    Parcel layout with partial-volume weights for an input grid coarser than the atlas grid.
+
+    Every input voxel is listed under each parcel it overlaps, weighted by the fraction of its
+    volume that parcel covers.
+
+    Returns
+    -------
+    label_ids, index, offsets, weights : numpy.ndarray
+        The parcels' labels, the layout as in ``_parcel_layout``, and one weight per entry of ``index``.
+        None if nearest atlas voxels are ambiguous on this grid (see ``_axis_taps``).
+    """
+    gathered = _gather_taps(labels, transform, input_shape)
+    if gathered is None:
+        return None
+    ranges, taps = gathered
+    sub_shape = taps[0][0].shape
+    sub_index = np.ravel_multi_index(np.indices(sub_shape).reshape(3, -1) + np.array([r.start for r in ranges])[:, None], input_shape)
+
+    tap_labels = np.concatenate([tap_labels.ravel() for tap_labels, _ in taps])
+    tap_weights = np.concatenate([np.full(tap_labels_i.size, weight) for tap_labels_i, weight in taps])
+    tap_voxels = np.tile(sub_index, len(taps))
+
+    label_ids = _unique_labels(tap_labels)
+    if ignore_background:
+        label_ids = label_ids[label_ids != background_value]
+
+    # Sum the overlaps of each (parcel, voxel) pair, grouped by parcel
+    in_parcel = np.isin(tap_labels, label_ids)
+    parcel_pos = np.searchsorted(label_ids, tap_labels[in_parcel])
+    pair_key = parcel_pos * np.prod(input_shape, dtype=np.int64) + tap_voxels[in_parcel]
+    unique_keys, inverse = np.unique(pair_key, return_inverse=True)
+    weights = np.bincount(inverse, weights=tap_weights[in_parcel])
+
+    index = unique_keys % np.prod(input_shape, dtype=np.int64)
+    counts = np.bincount(unique_keys // np.prod(input_shape, dtype=np.int64), minlength=len(label_ids))
+    offsets = np.concatenate([[0], np.cumsum(counts)])
+    return label_ids, index, offsets, weights
+
+def _pyramid_path(this_atlas, atlas_space, grid):
+    """Packaged file holding ``this_atlas`` pre-resampled to a standard grid."""
+    atlas_dir = files("subcortex_visualization.atlases").joinpath(f"{atlas_space}/{this_atlas}")
+    if this_atlas == 'Brainstem_Navigator':
+        return atlas_dir.joinpath(f"Brainstem_Navigator_index_res-{grid}.npz")
+    return atlas_dir.joinpath(f"{this_atlas}_res-{grid}.nii.gz")
+
+def _resample_to_grid(this_atlas, atlas_space, grid):
+    """
+    Resample an atlas to a standard grid with nearest-neighbour interpolation.
+
+    Returns a dict with 'labels' for label atlases, or the ROI index arrays 'index',
+    'offsets' and 'values' (see ``_decode_brainstem_navigator``) for Brainstem_Navigator.
+    """
+    atlas_entry = _load_atlas(this_atlas, atlas_space)
+    grid_affine, grid_shape = _STANDARD_GRIDS[atlas_space][grid]
+
+    if this_atlas == 'Brainstem_Navigator':
+        atlas_shape = atlas_entry['shape']
+        native_grid, native_flips = _match_standard_grid(atlas_space, atlas_entry['affine'], atlas_shape)
+        if native_grid == grid:
+            # Same voxels, possibly stored in another orientation
+            return {'index': _flip_index(np.asarray(atlas_entry['index']), atlas_shape, native_flips),
+                    'offsets': np.asarray(atlas_entry['offsets']), 'values': np.asarray(atlas_entry['values'])}
+
+        roi_indices, roi_values = [], []
+        for roi_idx in range(len(atlas_entry['roi_names'])):
+            roi_slice = slice(atlas_entry['offsets'][roi_idx], atlas_entry['offsets'][roi_idx + 1])
+            roi_data = np.zeros(atlas_shape)
+            roi_data.ravel()[atlas_entry['index'][roi_slice]] = atlas_entry['values'][roi_slice]
+            roi_data = resample_img(nib.Nifti1Image(roi_data, atlas_entry['affine']), target_affine=grid_affine, target_shape=grid_shape, interpolation='nearest', force_resample=True, copy_header=True).get_fdata()
+            roi_indices.append(np.flatnonzero(roi_data))
+            roi_values.append(roi_data.ravel()[roi_indices[-1]])
+        return {
+            'index': np.concatenate(roi_indices),
+            'offsets': np.concatenate([[0], np.cumsum([len(idx) for idx in roi_indices])]).astype(np.int64),
+            'values': np.concatenate(roi_values),
+        }
+
+    labels = atlas_entry['labels']
+    native_grid, native_flips = _match_standard_grid(atlas_space, atlas_entry['affine'], labels.shape)
+    if native_grid == grid:
+        labels = np.flip(labels, axis=native_flips) if native_flips else labels
+    else:
+        labels = resample_img(nib.Nifti1Image(labels.astype(np.float32), atlas_entry['affine']), target_affine=grid_affine, target_shape=grid_shape, interpolation='nearest', force_resample=True, copy_header=True).dataobj
+    return {'labels': _compact_labels(labels)}
+
+def _load_pyramid(this_atlas, atlas_space, grid):
+    """
+    Load an atlas pre-resampled to a standard grid.
+
+    Uses the packaged pyramid file if present and built from the current atlas files;
+    otherwise resamples once and keeps the result in the disk cache (if enabled; see ``set_disk_cache``).
+    """
+    cache_key = ('pyramid', atlas_space, this_atlas, grid)
+    pyramid = _cache_get(cache_key)
+    if pyramid is not None:
+        return pyramid
+
+    atlas_entry = _load_atlas(this_atlas, atlas_space)
+    atlas_shape = atlas_entry['shape'] if this_atlas == 'Brainstem_Navigator' else atlas_entry['labels'].shape
+    if _match_standard_grid(atlas_space, atlas_entry['affine'], atlas_shape)[0] == grid:
+        # Atlas already on this grid in another orientation: flipping is exact and cheap
+        return _cache_put(cache_key, _resample_to_grid(this_atlas, atlas_space, grid))
+
+    pyramid_path = _pyramid_path(this_atlas, atlas_space, grid)
+    if pyramid_path.is_file():
+        if this_atlas == 'Brainstem_Navigator':
+            stored = _load_npz(str(pyramid_path))
+            if str(stored['fingerprint']) == atlas_entry['fingerprint']:
+                pyramid = {'index': stored['index'], 'offsets': np.asarray(stored['offsets']), 'values': stored['values']}
+        else:
+            pyramid_vol = nib.load(pyramid_path)
+            if pyramid_vol.header['descrip'].item().decode() == f"fingerprint={atlas_entry['fingerprint']}":
+                pyramid = {'labels': _sidecar_labels(cache_key, [pyramid_path], lambda: _decode_labels(pyramid_vol))}
+        if pyramid is None:
+            warnings.warn(f"The packaged {grid} grid of atlas '{this_atlas}' is out of date with the atlas files; re-building it. Re-run build_atlas_pyramid('{atlas_space}', '{this_atlas}') to update it.", stacklevel=2)
+
+    if pyramid is None:
+        disk_key = ('pyramid', atlas_space, this_atlas, grid, atlas_entry['fingerprint'])
+        pyramid = _disk_cache_load(disk_key)
+        if pyramid is None:
+            print(f"Building the {grid} grid of atlas '{this_atlas}' in {atlas_space} (once)...")
+            pyramid = _resample_to_grid(this_atlas, atlas_space, grid)
+            _disk_cache_store(disk_key, pyramid)
+
+    return _cache_put(cache_key, pyramid)
+
+def _compressed_nifti_bytes(img):
+    """
+    Return a NIfTI image as ``.nii.gz`` bytes at the highest gzip level, with no timestamp so
+    that rebuilding unchanged files gives identical bytes. (``nib.save`` uses gzip level 1.)
+    """
+    return gzip.compress(img.to_bytes(), compresslevel=9, mtime=0)
+
+def build_atlas_pyramid(atlas_space=None, atlas=None, grids=None):
+    """
+    Pre-resample atlases to the standard 1mm, 2mm and 3mm grids of their space.
+
+    The resampled volumes are written next to each atlas in the package directory
+    (``<atlas>_res-<grid>.nii.gz``, or ``Brainstem_Navigator_index_res-<grid>.npz``).
+    ``parcel_segstats`` picks them automatically when an input lies on one of these grids,
+    so no ``interpolation`` argument or resampling is needed. Grids that an atlas is
+    already stored on (in any orientation) are skipped.
+
+    Parameters
+    ----------
+    atlas_space : str or list of str, optional
+        Standard space(s) to build. Defaults to every space with standard grids.
+
+    atlas : str or list of str, optional
+        Atlas name(s) to build. Defaults to every atlas shipped for the space.
+
+    grids : str or list of str, optional
+        Grid name(s) among '1mm', '2mm' and '3mm'. Defaults to all of them.
+
+    Returns
+    -------
+    list of str
+        Paths of the written files.
+    """
+    atlas_spaces = list(_STANDARD_GRIDS) if atlas_space is None else ([atlas_space] if isinstance(atlas_space, str) else atlas_space)
+
+    written = []
+    for this_space in atlas_spaces:
+        space_dir = files("subcortex_visualization.atlases").joinpath(this_space)
+        this_atlases = sorted(d.name for d in space_dir.iterdir() if d.is_dir() and not d.name.startswith('_')) if atlas is None else ([atlas] if isinstance(atlas, str) else atlas)
+        this_grids = list(_STANDARD_GRIDS[this_space]) if grids is None else ([grids] if isinstance(grids, str) else grids)
+
+        for this_atlas in this_atlases:
+            atlas_entry = _load_atlas(this_atlas, this_space)
+            atlas_shape = atlas_entry['shape'] if this_atlas == 'Brainstem_Navigator' else atlas_entry['labels'].shape
+            native_grid, _ = _match_standard_grid(this_space, atlas_entry['affine'], atlas_shape)
+
+            for grid in this_grids:
+                if grid == native_grid:
+                    continue
+                grid_affine, grid_shape = _STANDARD_GRIDS[this_space][grid]
+                pyramid = _resample_to_grid(this_atlas, this_space, grid)
+                output_path = str(_pyramid_path(this_atlas, this_space, grid))
+
+                if this_atlas == 'Brainstem_Navigator':
+                    np.savez(output_path,
+                             fingerprint=np.array(atlas_entry['fingerprint']),
+                             index=pyramid['index'].astype(np.int32),
+                             offsets=pyramid['offsets'],
+                             values=pyramid['values'].astype(np.float32))
+                else:
+                    labels = pyramid['labels']
+                    pyramid_vol = nib.Nifti1Image(_compact_labels(labels), grid_affine)
+                    pyramid_vol.header['descrip'] = f"fingerprint={atlas_entry['fingerprint']}"
+                    with open(output_path, 'wb') as f:
+                        f.write(_compressed_nifti_bytes(pyramid_vol))
+                written.append(output_path)
+
+    return written
+
+def build_atlas_sidecars(atlas_space=None, atlas=None, verify=False):
+    """
+    Write uncompressed, memory-mappable copies ("sidecars") of the packaged label atlases.
+
+    For every label atlas, the decoded label volume and each of its pre-resampled grids are
+    written as raw ``.npy`` files to the sidecar directory (see ``set_atlas_sidecars``), each with
+    a manifest recording a digest of the packaged file it was decoded from. Any process then
+    memory-maps them instead of decompressing the NIfTI files; concurrent workers share the
+    same pages. Brainstem_Navigator is skipped, as its packaged ROI indices are already
+    uncompressed and memory-mapped.
+
+    Parameters
+    ----------
+    atlas_space : str or list of str, optional
+        Standard space(s) to build. Defaults to every space with standard grids.
+
+    atlas : str or list of str, optional
+        Atlas name(s) to build. Defaults to every atlas shipped for the space.
+
+    verify : bool, default=False
+        Check the data checksum of existing sidecars (reading them in full) rather than only
+        their source digest, size, shape and dtype; failing sidecars are re-written.
+
+    Returns
+    -------
+    list of str
+        Paths of the sidecar files.
+    """
+    atlas_spaces = list(_STANDARD_GRIDS) if atlas_space is None else ([atlas_space] if isinstance(atlas_space, str) else atlas_space)
+
+    written = []
+    for this_space in atlas_spaces:
+        space_dir = files("subcortex_visualization.atlases").joinpath(this_space)
+        this_atlases = sorted(d.name for d in space_dir.iterdir() if d.is_dir() and not d.name.startswith('_')) if atlas is None else ([atlas] if isinstance(atlas, str) else atlas)
+
+        for this_atlas in this_atlases:
+            if this_atlas == 'Brainstem_Navigator':
+                continue
+            sources = [(('atlas', this_space, this_atlas), _atlas_files(this_atlas, this_space)[0])]
+            sources += [(('pyramid', this_space, this_atlas, grid), _pyramid_path(this_atlas, this_space, grid))
+                        for grid in _STANDARD_GRIDS.get(this_space, {})]
+
+            for key, source_path in sources:
+                if not source_path.is_file():
+                    continue
+                digest = _source_digest([source_path])
+                if _sidecar_load(key, digest, verify=verify) is None:
+                    _sidecar_store(key, _decode_labels(nib.load(source_path)), digest)
+                written.append(_sidecar_paths(key)[0])
+
+    return written
+
+def reencode_atlas_volumes(atlas_space=None, atlas=None):
+    """
+    Re-encode the packaged atlas volumes as compact integers.
+
+    Label volumes (and the binary Brainstem_Navigator ROI files) are rewritten in place in the
+    smallest unsigned integer dtype that holds their labels (``uint8`` or ``uint16``), without
+    intensity scaling and at the highest gzip level, so they decode without float conversion.
+    Labels are unchanged. A volume is only rewritten if the compact file is smaller than the
+    current one; otherwise the current file is kept. As the files change, the Brainstem_Navigator
+    ROI index and the pre-resampled grids of every re-encoded atlas are rebuilt to match them.
+
+    Parameters
+    ----------
+    atlas_space : str or list of str, optional
+        Standard space(s) to re-encode. Defaults to every space with standard grids.
+
+    atlas : str or list of str, optional
+        Atlas name(s) to re-encode. Defaults to every atlas shipped for the space.
+
+    Returns
+    -------
+    list of str
+        Paths of the re-encoded volumes.
+    """
+    atlas_spaces = list(_STANDARD_GRIDS) if atlas_space is None else ([atlas_space] if isinstance(atlas_space, str) else atlas_space)
+
+    written = []
+    for this_space in atlas_spaces:
+        space_dir = files("subcortex_visualization.atlases").joinpath(this_space)
+        this_atlases = sorted(d.name for d in space_dir.iterdir() if d.is_dir() and not d.name.startswith('_')) if atlas is None else ([atlas] if isinstance(atlas, str) else atlas)
+
+        for this_atlas in this_atlases:
+            atlas_dir = space_dir.joinpath(this_atlas)
+            if this_atlas == 'Brainstem_Navigator':
+                volume_paths = sorted(f for f in atlas_dir.iterdir() if f.name.endswith('.nii.gz'))
+            else:
+                volume_paths = [f for f in (atlas_dir.joinpath(f"{this_atlas}.nii.gz"), atlas_dir.joinpath(f"{this_atlas}_subcortex.nii.gz")) if f.is_file()]
+
+            atlas_written = []
+            for volume_path in volume_paths:
+                this_vol = nib.load(volume_path)
+                labels = _decode_labels(this_vol)
+                if this_vol.get_data_dtype() == labels.dtype and this_vol.dataobj.slope == 1 and this_vol.dataobj.inter == 0:
+                    continue
+                compact_vol = nib.Nifti1Image(labels, this_vol.affine, this_vol.header)
+                compact_vol.set_data_dtype(labels.dtype)
+                compact_vol.header.set_slope_inter(1, 0)
+                compact_bytes = _compressed_nifti_bytes(compact_vol)
+                if len(compact_bytes) >= os.path.getsize(str(volume_path)):
+                    continue
+                if not np.array_equal(labels, np.asanyarray(this_vol.dataobj)):
+                    print(f"Rounding non-integer values of '{volume_path.name}' to the nearest label.")
+                with open(str(volume_path), 'wb') as f:
+                    f.write(compact_bytes)
+                atlas_written.append(str(volume_path))
+
+            if atlas_written:
+                # Derived files record the source fingerprint; rebuild them for the new files
+                clear_atlas_cache()
+                if this_atlas == 'Brainstem_Navigator':
+                    build_brainstem_navigator_index(this_space)
+                if this_space in _STANDARD_GRIDS:
+                    build_atlas_pyramid(this_space, this_atlas)
+                written.extend(atlas_written)
+
+    return written
+
+def _brainstem_navigator_layout(atlas_space, input_affine, input_shape, interpolation=None, weighted=False):
+    """
+    Build the parcel layout for the Brainstem_Navigator atlas, which ships one NIfTI file per ROI.
+
+    ROIs may overlap, so each ROI keeps its own segment of voxel indices.
+
+    Parameters
+    ----------
+    atlas_space : str
+        Standard space of the atlas files.
+
+    input_affine : numpy.ndarray
+        4x4 affine of the input volume.
+
+    input_shape : tuple of int
+        Spatial (3D) shape of the input volume.
+
+    interpolation : str or None, optional
+        Interpolation used to resample ROIs whose affine differs from ``input_affine``.
+
+    weighted : bool, default=False
+        If True, also return each voxel's ROI value (e.g. partial-volume weights after resampling).
+
+    Returns
+    -------
+    dict
+        Parcel layout; see ``_atlas_layout``.
+    """
+    atlas_entry = _load_atlas('Brainstem_Navigator', atlas_space)
+    atlas_shape, atlas_affine = atlas_entry['shape'], atlas_entry['affine']
+
+    roi_index_all, roi_offsets, roi_values_all = atlas_entry['index'], atlas_entry['offsets'], atlas_entry['values']
+
+    # Inputs on a standard grid use the pre-resampled (nearest-neighbour) ROIs
+    grid, flip_axes = (None, ())
+    if not np.allclose(input_affine, atlas_affine) and interpolation in (None, 'nearest'):
+        grid, flip_axes = _match_standard_grid(atlas_space, input_affine, input_shape)
+
+    # Other grids that differ from the atlas grid only by whole-voxel shifts, flips or FOV map by index arithmetic
+    transform = None
+    if grid is None and interpolation in (None, 'nearest', 'majority') and not (
+            np.allclose(input_affine, atlas_affine) and tuple(input_shape) == tuple(atlas_shape)):
+        transform = _grid_transform(atlas_affine, input_affine)
+        if transform is not None and not (np.all(np.abs(transform[0]) == 1) and np.allclose(transform[1], np.round(transform[1]))):
+            transform = None
+
+    if grid is not None:
+        pyramid = _load_pyramid('Brainstem_Navigator', atlas_space, grid)
+        roi_index_all = _flip_index(np.asarray(pyramid['index']), tuple(input_shape), flip_axes)
+        roi_offsets, roi_values_all = pyramid['offsets'], pyramid['values']
+
+    elif transform is not None:
+        # Translations, flips and FOV differences move ROI voxels exactly; keep those inside the input grid
+        scale, offset = transform
+        roi_coords = [np.round((c - o) / sc).astype(np.int64) for c, sc, o in zip(np.unravel_index(roi_index_all, atlas_shape), scale, offset)]
+        inside = np.all([(c >= 0) & (c < n) for c, n in zip(roi_coords, input_shape)], axis=0)
+        roi_index_all = np.ravel_multi_index(tuple(c[inside] for c in roi_coords), tuple(input_shape))
+        roi_values_all = roi_values_all[inside]
+        roi_ids = np.repeat(np.arange(len(roi_offsets) - 1), np.diff(roi_offsets))
+        roi_offsets = np.concatenate([[0], np.cumsum(np.bincount(roi_ids[inside], minlength=len(roi_offsets) - 1))]).astype(np.int64)
+
+    elif not np.allclose(input_affine, atlas_affine) or tuple(input_shape) != tuple(atlas_shape):
+        if interpolation == 'majority':
+            raise ValueError(f"interpolation='majority' requires the input grid to differ from the Brainstem_Navigator grid only by whole-voxel shifts, flips or field of view.\nInput data affine:\n{input_affine}\nROI affine:\n{atlas_affine}\n")
+        if interpolation is None:
+            raise ValueError(f"No resampling method was specified. Re-run this function with a specified 'interpolation' argument from the available options for resample_img (including 'nearest', 'cubic', or 'linear') to resample ROI '{atlas_entry['roi_names'][0]}' to your input data.\nInput data affine:\n{input_affine}\nROI affine:\n{atlas_affine}\n")
+
+        # Integer-valued ROIs are resampled in the integer dtype of their files, so that interpolated
+        # values round as they do when resampling the files; weighted ROIs keep partial-volume fractions
+        roi_dtype = np.float64
+        if not weighted and np.all(roi_values_all == np.round(roi_values_all)) and np.all(roi_values_all >= 0):
+            roi_dtype = _label_dtype(roi_values_all.max(initial=0))
+
+        # Resampled ROIs are shared across calls and processes through the disk cache, if enabled
+        disk_key = _resample_key('Brainstem_Navigator', atlas_space, atlas_entry, input_affine, input_shape, interpolation) + (np.dtype(roi_dtype).name,)
+        resampled = _disk_cache_load(disk_key)
+
+        if resampled is None:
+            roi_indices, roi_values = [], []
+            for roi_idx, roi_name in enumerate(atlas_entry['roi_names']):
+                print(f"Resampling ROI '{roi_name}' to match input data affine and dimensions using {interpolation} interpolation...")
+                roi_slice = slice(roi_offsets[roi_idx], roi_offsets[roi_idx + 1])
+                roi_data = np.zeros(atlas_shape, dtype=roi_dtype)
+                roi_data.ravel()[roi_index_all[roi_slice]] = roi_values_all[roi_slice]
+                roi_vol = resample_img(nib.Nifti1Image(roi_data, atlas_affine), target_affine=input_affine, target_shape=input_shape, interpolation=interpolation, force_resample=True, copy_header=True)
+                roi_data = roi_vol.get_fdata()
+                roi_indices.append(np.flatnonzero(roi_data))
+                roi_values.append(roi_data.ravel()[roi_indices[-1]])
+
+            resampled = {
+                'index': np.concatenate(roi_indices),
+                'offsets': np.concatenate([[0], np.cumsum([len(idx) for idx in roi_indices])]).astype(np.int64),
+                'values': np.concatenate(roi_values),
+            }
+            _disk_cache_store(disk_key, resampled)
+
+        roi_index_all, roi_offsets, roi_values_all = resampled['index'], resampled['offsets'], resampled['values']
+
+    regions, hemispheres = zip(*[_parse_hemisphere(name) for name in atlas_entry['roi_names']]) if atlas_entry['roi_names'] else ((), ())
+
+    return {
+        'index': roi_index_all,
+        'bbox': _layout_bbox(roi_index_all, tuple(input_shape)),
+        'offsets': roi_offsets,
+        'weights': roi_values_all if weighted else None,
+        'shape': tuple(input_shape),
+        'region': list(regions),
+        'hemisphere': list(hemispheres),
+        'region_index': list(range(1, len(atlas_entry['roi_names']) + 1)),
+    }
+
+def _atlas_layout(this_atlas, atlas_space, input_affine, input_shape, interpolation=None,
+                  ignore_background=True, background_value=0, weighted=False):
+    """
+    Build (or fetch from the atlas cache) the label-sorted parcel layout of an atlas on the input grid.
+
+    Parameters
+    ----------
+    this_atlas : str
+        Name of the atlas.
+
+    atlas_space : str
+        Standard space of the atlas files.
+
+    input_affine : numpy.ndarray
+        4x4 affine of the input volume.
+
+    input_shape : tuple of int
+        Spatial (3D) shape of the input volume.
+
+    interpolation : str or None, optional
+        Interpolation used to resample the atlas if its affine differs from ``input_affine``.
+        Standard grids use the atlas pyramid and other axis-aligned grids with integer zooms use
+        index arithmetic when this is None, 'nearest' or 'majority' (see ``_labels_by_index``);
+        None and 'nearest' give nearest-neighbour labels on every such grid, and 'majority'
+        gives each coarser input voxel the label covering most of its volume.
+
+    ignore_background : bool, default=True
+        If True, ``background_value`` is not treated as a parcel.
+
+    background_value : int, default=0
+        Label of background voxels.
+
+    weighted : bool, default=False
+        Return per-voxel weights: ROI values for Brainstem_Navigator (see
+        ``_brainstem_navigator_layout``), or partial-volume fractions for label atlases on
+        axis-aligned input grids coarser than the atlas by an integer factor, standard grids
+        included (see ``_weighted_index_layout``).
+
+    Returns
+    -------
+    dict
+        With keys 'index' and 'offsets' (as returned by ``_parcel_layout``, with indices
+        into ``input_shape``), 'bbox' (bounding box of the parcel voxels, see ``_layout_bbox``),
+        'weights' (per-voxel weights or None), 'shape', and the per-parcel metadata lists
+        'region', 'hemisphere' and 'region_index'.
+    """
+    input_shape = tuple(int(s) for s in input_shape)
+    cache_key = ('layout', atlas_space, this_atlas, input_shape, np.asarray(input_affine, dtype=float).tobytes(),
+                 interpolation, ignore_background, background_value, weighted)
+    layout = _cache_get(cache_key)
+    if layout is not None:
+        return layout
+
+    if this_atlas == 'Brainstem_Navigator':
+        layout = _brainstem_navigator_layout(atlas_space, input_affine, input_shape,
+                                             interpolation=interpolation, weighted=weighted)
+        return _cache_put(cache_key, layout)
+
+    atlas_entry = _load_atlas(this_atlas, atlas_space)
+    labels = atlas_entry['labels']
+
+    # Find affines
+    this_atlas_vol_affine = atlas_entry['affine']
+
+    # Inputs on a standard grid use the pre-resampled (nearest-neighbour) atlas, unless they
+    # need partial-volume weights
+    grid, flip_axes = (None, ())
+    if not np.allclose(input_affine, this_atlas_vol_affine) and interpolation in (None, 'nearest') and not weighted:
+        grid, flip_axes = _match_standard_grid(atlas_space, input_affine, input_shape)
+
+    # Other axis-aligned grids with integer zooms map onto the atlas by index arithmetic,
+    # unless input voxel centres fall halfway between atlas voxels
+    mapped_labels, weighted_layout = None, None
+    if grid is None and interpolation in (None, 'nearest', 'majority') and not (
+            np.allclose(input_affine, this_atlas_vol_affine) and input_shape == labels.shape[:3]):
+        transform = _grid_transform(this_atlas_vol_affine, input_affine)
+        downsampled = transform is not None and np.any(np.abs(transform[0]) > 1)
+        if transform is not None and weighted and downsampled:
+            # Partial-volume weights of every parcel overlapping each (larger) input voxel
+            weighted_layout = _weighted_index_layout(labels, transform, input_shape,
+                                                     ignore_background=ignore_background,
+                                                     background_value=background_value)
+        elif transform is not None:
+            # None gives nearest-neighbour labels, as the pyramid does on standard grids
+            mapped_labels = _labels_by_index(labels, transform, input_shape, mode='majority' if interpolation == 'majority' else 'nearest')
+
+    weights = None
+    if grid is not None:
+        labels = _load_pyramid(this_atlas, atlas_space, grid)['labels']
+        if flip_axes:
+            labels = np.flip(labels, axis=flip_axes)
+
+    elif mapped_labels is not None:
+        labels = mapped_labels
+
+    elif weighted_layout is not None:
+        unique_labels, index, offsets, weights = weighted_layout
+
+    # Compare affines and raise error if they don't match
+    elif not np.allclose(input_affine, this_atlas_vol_affine) or input_shape != labels.shape[:3]:
+        if interpolation == 'majority':
+            raise ValueError(f"interpolation='majority' requires the input grid to be axis-aligned with the atlas grid, with voxel sizes an integer multiple (or fraction) of the atlas voxel size and no input voxel centred halfway between atlas voxels.\nInput data affine:\n{input_affine}\nAtlas affine:\n{this_atlas_vol_affine} \n")
+
+        # Affines don't match; resample if interpolation is specified, otherwise raise an error
+        warnings.warn(f"Affines of input data and atlas do not match. Atlas affine:\n{this_atlas_vol_affine}\nInput data affine:\n{input_affine}\n", stacklevel=2)
+
+        # Resample the atlas to match the input volume
+        if interpolation is not None:
+            # Resampled labels are shared across calls and processes through the disk cache, if enabled
+            disk_key = _resample_key(this_atlas, atlas_space, atlas_entry, input_affine, input_shape, interpolation)
+            resampled = _disk_cache_load(disk_key)
+
+            if resampled is not None:
+                labels = resampled['labels']
+            else:
+                print(f"Resampling atlas '{this_atlas}' to match input data affine and dimensions using {interpolation} interpolation...")
+                this_atlas_vol = resample_img(nib.Nifti1Image(labels.astype(np.float32), this_atlas_vol_affine), target_affine=input_affine, target_shape=input_shape, interpolation=interpolation, force_resample=True, copy_header=True)
+
+                # Resampled atlases may have fractional label values; round back to compact integers
+                labels = _compact_labels(np.asanyarray(this_atlas_vol.dataobj))
+                _disk_cache_store(disk_key, {'labels': labels})
+
+        else:
+            raise ValueError(f"No resampling method was specified. Re-run this function with a specified 'interpolation' argument from the available options for resample_img (including 'nearest', 'cubic', or 'linear') to resample the desired atlas volume to your input data.\nInput data affine:\n{input_affine}\nAtlas affine:\n{this_atlas_vol_affine} \n")
+
+    if weights is None:
+        unique_labels = _unique_labels(labels)
+
+        # skip background if requested, which is the default
+        if ignore_background:
+            unique_labels = unique_labels[unique_labels != background_value]
+
+        # Label-sorted voxel layout
+        index, offsets = _parcel_layout(labels, unique_labels)
+
+    # LUT rows are matched to labels by their Index, so that labels missing from a resampled
+    # atlas do not shift the names of the others; labels without a LUT row are named by value
+    lut_rows = dict(zip(atlas_entry['lut_index'], zip(atlas_entry['lut_region'], atlas_entry['lut_hemisphere'])))
+    region, hemisphere = zip(*[lut_rows.get(int(lab), (str(int(lab)), 'B')) for lab in unique_labels]) if len(unique_labels) else ((), ())
+    layout = {
+        'index': index,
+        'bbox': _layout_bbox(index, input_shape),
+        'offsets': offsets,
+        'weights': weights,
+        'shape': input_shape,
+        'region': list(region),
+        'hemisphere': list(hemisphere),
+        'region_index': [int(lab) for lab in unique_labels],
+    }
+    return _cache_put(cache_key, layout)
+
+# Long-format results columns, and those stored as categoricals
+_RESULT_COLUMNS = ['stat', 'value', 'Atlas', 'Functional_Map', 'region', 'Hemisphere', 'Region_Index']
+_RESULT_CATEGORICALS = ['stat', 'Atlas', 'region', 'Hemisphere']
+
+def _layout_results_columns(layout, parcel_vals, parc_stat, this_atlas, func_name):
+    """
+    Assemble the long-format results columns for one atlas.
+
+    Parameters
+    ----------
+    layout : dict
+        Parcel layout from ``_atlas_layout``.
+
+    parcel_vals : list of list
+        Per-parcel statistic values, as returned by ``_segment_reduce``.
+
+    parc_stat : list of callable
+        Summary statistics, in the order of ``parcel_vals``.
+
+    this_atlas : str
+        Atlas name.
+
+    func_name : str
+        Name of the functional map.
+
+    Returns
+    -------
+    dict of numpy.ndarray
+        One array per results column, with one row per parcel per summary statistic
+        (parcel-major, matching the row order of the long-format output).
+    """
+    n_parcels, n_stats = len(layout['region']), len(parc_stat)
+    n_rows = n_parcels * n_stats
+
+    # Scalars (3D input) make a numeric column; arrays (4D input) are kept as objects
+    flat_vals = [val for vals in parcel_vals for val in vals]
+    if all(np.ndim(val) == 0 for val in flat_vals):
+        values = np.array(flat_vals, dtype=float).reshape(n_rows)
+    else:
+        values = np.empty(n_rows, dtype=object)
+        values[:] = flat_vals
+
+    return {
+        'stat': np.tile([s.__name__ for s in parc_stat], n_parcels),
+        'value': values,
+        'Atlas': np.full(n_rows, this_atlas, dtype=object),
+        'Functional_Map': np.full(n_rows, func_name, dtype=object),
+        'region': np.repeat(np.asarray(layout['region'], dtype=object), n_stats),
+        'Hemisphere': np.repeat(np.asarray(layout['hemisphere'], dtype=object), n_stats),
+        'Region_Index': np.repeat(np.asarray(layout['region_index']), n_stats),
+    }
+
+def _results_frame(columns_list, output='long'):
+    """
+    Build the results DataFrame from the per-atlas columns of ``_layout_results_columns``.
+
+    Each column is concatenated across atlases once; 'stat', 'Atlas', 'region' and
+    'Hemisphere' become categoricals. With ``output='wide'``, the frame is pivoted to one
+    row per region and one column per statistic.
+    """
+    if output not in ('long', 'wide'):
+        raise ValueError(f"output must be 'long' or 'wide'; got {output!r}.")
+
+    data = {}
+    for col in _RESULT_COLUMNS:
+        col_arrays = [columns[col] for columns in columns_list]
+        if col == 'value' and any(arr.dtype == object for arr in col_arrays):
+            values = np.empty(sum(len(arr) for arr in col_arrays), dtype=object)
+            values[:] = [val for arr in col_arrays for val in arr]
+            data[col] = values
+        else:
+            data[col] = np.concatenate(col_arrays) if col_arrays else np.array([], dtype=object)
+        if col in _RESULT_CATEGORICALS:
+            # Categories in order of first appearance, so sorting keeps the atlas order
+            data[col] = pd.Categorical(data[col], categories=pd.unique(data[col]))
+    results_df = pd.DataFrame(data, columns=_RESULT_COLUMNS)
+
+    if output == 'wide':
+        results_df = _wide_results(results_df, ['Atlas', 'Functional_Map', 'region', 'Hemisphere', 'Region_Index'], ['stat'])
+    return results_df
+
+def _load_input(input_vol, affine=None, dtype=None):
+    """
+    Return the input as a nibabel image.
+
+    File paths are loaded lazily, or served decoded from the input cache when it is enabled
+    (see ``atlas_cache.set_input_cache``). NumPy arrays, including memory maps, are wrapped
+    with ``affine`` without copying.
+    """
+    if isinstance(input_vol, np.ndarray):
+        if affine is None:
+            raise ValueError("An affine is required when the input is given as a NumPy array; pass it with the 'affine' argument.")
+        return nib.Nifti1Image(input_vol, np.asarray(affine, dtype=float))
+
+    if not isinstance(input_vol, (str, os.PathLike)):
+        return input_vol
+
+    if not _INPUT_CACHE_STATE['enabled']:
+        return nib.load(input_vol)
+
+    input_path = os.path.abspath(os.fspath(input_vol))
+    input_stat = os.stat(input_path)
+    cache_key = (input_path, input_stat.st_size, input_stat.st_mtime_ns, None if dtype is None else np.dtype(dtype).str)
+    cached_vol = _input_cache_get(cache_key)
+    if cached_vol is not None:
+        return cached_vol
+
+    input_vol = nib.load(input_path)
+    # Scaled data decode to floats of up to 8 bytes per voxel
+    if dtype is not None:
+        itemsize = np.dtype(dtype).itemsize
+    elif input_vol.dataobj.slope == 1 and input_vol.dataobj.inter == 0:
+        itemsize = input_vol.get_data_dtype().itemsize
+    else:
+        itemsize = 8
+    nbytes = int(np.prod(input_vol.shape)) * itemsize
+    if nbytes > _INPUT_CACHE_STATE['max_bytes']:
+        # Too large to keep; read lazily, block by block
+        return input_vol
+
+    input_data = np.asanyarray(input_vol.dataobj)
+    if dtype is not None:
+        input_data = input_data.astype(dtype, copy=False)
+    return _input_cache_put(cache_key, input_vol.__class__(input_data, input_vol.affine, input_vol.header), input_data.nbytes)
+
+def _map_atlases(func, items, n_threads=None):
+    """
+    Apply ``func`` to every per-atlas item, concurrently in a thread pool.
+
+    NumPy's reductions, sorts and gathers release the GIL, so atlases are processed in
+    parallel while sharing the same read-only input block. Results keep the order of ``items``.
+    ``n_threads`` defaults to one thread per item, up to the number of CPUs.
+    """
+    items = list(items)
+    if n_threads is None:
+        n_threads = os.cpu_count() or 1
+    n_threads = max(1, min(int(n_threads), len(items)))
+    if n_threads == 1:
+        return [func(item) for item in items]
+    with ThreadPoolExecutor(max_workers=n_threads) as executor:
+        return list(executor.map(func, items))
+
+def _prepare_extraction(input_vol, atlas, atlas_space, interpolation=None, ignore_background=True,
+                        background_value=0, weighted=False, affine=None, dtype=None, n_threads=None):
+    """
+    Load the input (if given as a path or array) and build the parcel layout of every requested atlas.
+
+    Returns
+    -------
+    input_vol : nibabel.spatialimages.SpatialImage
+        The input image.
+
+    layouts : list of dict
+        One parcel layout per atlas (see ``_atlas_layout``).
+
+    lo, hi : numpy.ndarray
+        Union bounding box of the layouts, i.e. the only block of the input that needs to be read.
+    """
+    # Load in the input volume, if it's a file path or array
+    input_vol = _load_input(input_vol, affine=affine, dtype=dtype)
+
+    layouts = _map_atlases(lambda this_atlas: _atlas_layout(this_atlas, atlas_space, input_vol.affine, input_vol.shape[:3],
+                                                            interpolation=interpolation, ignore_background=ignore_background,
+                                                            background_value=background_value, weighted=weighted),
+                           atlas, n_threads=n_threads)
+
+    lo = np.min([layout['bbox'][0] for layout in layouts], axis=0)
+    hi = np.max([layout['bbox'][1] for layout in layouts], axis=0)
+
+    return input_vol, layouts, lo, hi
+
+def _volume_chunks(input_vol, chunk_size=None):
+    """
+    Split the volumes of a 4D image into consecutive slices of at most ``chunk_size`` volumes.
+
+    Yields a single ``None`` (meaning "everything") for 3D images or when ``chunk_size`` is None.
+    """
+    if chunk_size is None or len(input_vol.shape) < 4:
+        yield None
+        return
+    if chunk_size < 1:
+        raise ValueError(f"chunk_size must be a positive number of volumes; got {chunk_size}.")
+    n_volumes = input_vol.shape[3]
+    for start in range(0, n_volumes, chunk_size):
+        yield slice(start, min(start + chunk_size, n_volumes))
+
+def _iter_chunk_vals(input_vol, layouts, lo, hi, parc_stats, chunk_size=None, dtype=None, n_threads=None):
+    """
+    Read the input one chunk of volumes at a time and reduce every parcel of every atlas.
+
+    ``parc_stats`` holds one list of summary statistics per layout. Each chunk is read once
+    and the atlases are reduced concurrently from it (see ``_map_atlases``).
+
+    Yields
+    ------
+    volumes : slice or None
+        Volumes covered by this chunk (None if the whole input was read at once).
+
+    atlas_vals : list of list of list
+        For each atlas, the per-parcel statistic values (see ``_segment_reduce``) for this chunk.
+    """
+    input_shape = input_vol.shape[:3]
+    block_indices = None
+    for volumes in _volume_chunks(input_vol, chunk_size):
+        input_data = _read_block(input_vol, lo, hi, dtype=dtype, volumes=volumes)
+
+        # Block-relative indices are the same for every chunk
+        if block_indices is None:
+            block_indices = _map_atlases(lambda layout: _block_index(layout['index'], input_shape, lo, input_data.shape[:3]),
+                                         layouts, n_threads=n_threads)
+
+        def _reduce(atlas_item):
+            index, layout, parc_stat = atlas_item
+            return _segment_reduce(input_data, index, layout['offsets'], parc_stat)
+
+        yield volumes, _map_atlases(_reduce, zip(block_indices, layouts, parc_stats), n_threads=n_threads)
+
+def _merge_chunk_vals(chunk_vals):
+    """
+    Join per-chunk parcel statistics along the time axis.
+
+    Statistics that are arrays over time (the usual case for 4D input) are concatenated;
+    scalar statistics that do not depend on time (e.g. voxel counts) are taken from the first chunk.
+    """
+    if len(chunk_vals) == 1:
+        return chunk_vals[0]
+    merged = []
+    for parcel_chunks in zip(*chunk_vals):
+        merged.append([stat_chunks[0] if np.ndim(stat_chunks[0]) == 0 else np.concatenate(stat_chunks)
+                       for stat_chunks in zip(*parcel_chunks)])
+    return merged
+
+# Nested Melbourne subcortex atlas scales, coarsest first
+_MELBOURNE_SCALES = ['Melbourne_S1', 'Melbourne_S2', 'Melbourne_S3', 'Melbourne_S4']
+
+# Per-parcel moments from which the hierarchy derives coarser scales, and the
+# statistics that can be derived from them
+_MOMENT_STATS = [np.size, np.sum, np.var, np.min, np.max]
+_HIERARCHY_STATS = ('count', 'sum', 'mean', 'var', 'std', 'min', 'max')
+
+def melbourne_nesting_maps(atlas_space='MNI152NLin6Asym'):
+    """
+    Map every finest-scale (S4) Melbourne parcel to the parcel containing it at each coarser scale.
+
+    The maps are built from the packaged Melbourne_S1–S4 volumes, by reading off which
+    coarser-scale label every S4 voxel carries, and are cached for the session.
+
+    Parameters
+    ----------
+    atlas_space : str, optional
+        Standard space of the packaged atlases. Default is 'MNI152NLin6Asym'.
+
+    Returns
+    -------
+    pandas.DataFrame
+        One row per S4 label, with integer label columns 'Melbourne_S4', 'Melbourne_S3',
+        'Melbourne_S2' and 'Melbourne_S1'.
+
+    Raises
+    ------
+    ValueError
+        If an S4 parcel is split across coarser-scale parcels, i.e. the scales are not nested.
+    """
+    cache_key = ('melbourne_nesting', atlas_space)
+    nesting = _cache_get(cache_key)
+    if nesting is not None:
+        return nesting.copy()
+
+    finest_labels = _load_atlas(_MELBOURNE_SCALES[-1], atlas_space)['labels']
+    in_parcel = finest_labels > 0
+    finest_ids = _unique_labels(finest_labels[in_parcel])
+
+    nesting = {_MELBOURNE_SCALES[-1]: finest_ids}
+    for scale in reversed(_MELBOURNE_SCALES[:-1]):
+        coarse_labels = _load_atlas(scale, atlas_space)['labels']
+        if coarse_labels.shape != finest_labels.shape:
+            raise ValueError(f"'{scale}' and '{_MELBOURNE_SCALES[-1]}' have different grids in '{atlas_space}'; they cannot be nested.")
+
+        # Every S4 voxel must carry the same coarser label as the rest of its parcel
+        pairs = np.unique(np.stack([finest_labels[in_parcel], coarse_labels[in_parcel]]), axis=1)
+        if pairs.shape[1] != len(finest_ids) or np.any(pairs[1] <= 0):
+            raise ValueError(f"'{_MELBOURNE_SCALES[-1]}' parcels are not nested within '{scale}' parcels in '{atlas_space}'.")
+        nesting[scale] = pairs[1]
+
+    nesting = pd.DataFrame(nesting)
+    _cache_put(cache_key, nesting)
+    return nesting.copy()
+
+def _melbourne_parents(fine_atlas, coarse_atlas, fine_layout, coarse_layout, atlas_space):
+    """
+    Position in ``coarse_layout`` of the parcel containing each parcel of ``fine_layout``.
+    """
+    nesting = melbourne_nesting_maps(atlas_space)
+    parent_of = dict(zip(nesting[fine_atlas], nesting[coarse_atlas]))
+    coarse_ids = np.asarray(coarse_layout['region_index'])
+
+    parents = np.array([parent_of.get(label, -1) for label in fine_layout['region_index']], dtype=int)
+    positions = np.searchsorted(coarse_ids, parents)
+    positions = np.minimum(positions, max(len(coarse_ids) - 1, 0))
+    if np.any(parents < 0) or np.any(coarse_ids[positions] != parents):
+        raise ValueError(f"'{fine_atlas}' parcels on this grid are not nested within '{coarse_atlas}' parcels; re-run with hierarchical=False.")
+    return positions
+
+def _parcel_moments(parcel_vals):
+    """
+    Stack per-parcel ``_MOMENT_STATS`` values (see ``_segment_reduce``) into per-statistic arrays.
+    """
+    count, total, var, vmin, vmax = (np.array([vals[j] for vals in parcel_vals]) for j in range(len(_MOMENT_STATS)))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = total / count.reshape((-1,) + (1,) * (total.ndim - 1))
+    return {'count': count, 'sum': total, 'mean': mean, 'var': var, 'min': vmin, 'max': vmax}
+
+def _aggregate_moments(moments, parents, n_parents):
+    """
+    Combine per-parcel moments of nested child parcels into moments of their parents.
+
+    Counts, sums, minima and maxima combine directly; variances are pooled exactly as
+    ``sum(n_child * (var_child + (mean_child - mean_parent) ** 2)) / n_parent``.
+    Empty children contribute nothing.
+    """
+    keep = moments['count'] > 0
+    order = np.argsort(parents[keep], kind='stable')
+    child = {name: values[keep][order] for name, values in moments.items()}
+    child_parents = parents[keep][order]
+
+    n_children = np.bincount(child_parents, minlength=n_parents)
+    nonempty = n_children > 0
+    starts = np.concatenate([[0], np.cumsum(n_children)[:-1]])[nonempty]
+
+    def _by_parent(ufunc, values, empty=np.nan):
+        out = np.full((n_parents,) + values.shape[1:], empty)
+        if starts.size:
+            out[nonempty] = ufunc.reduceat(values, starts, axis=0)
+        return out
+
+    child_counts = child['count'].reshape((-1,) + (1,) * (child['sum'].ndim - 1))
+    count = _by_parent(np.add, child['count'], empty=0).astype(int)
+    parent_counts = count.reshape((-1,) + (1,) * (child['sum'].ndim - 1))
+    total = _by_parent(np.add, child['sum'], empty=0.0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = total / parent_counts
+        spread = child_counts * (child['var'] + (child['mean'] - mean[child_parents]) ** 2)
+        var = _by_parent(np.add, spread) / parent_counts
+
+    return {'count': count, 'sum': total, 'mean': mean, 'var': var,
+            'min': _by_parent(np.minimum, child['min']), 'max': _by_parent(np.maximum, child['max'])}
+
+def _moments_parcel_vals(moments, parc_stat):
+    """
+    Per-parcel values of the requested statistics (in ``_segment_reduce`` format) from moments.
+    """
+    columns = []
+    for s in parc_stat:
+        name = _SEGMENT_STATS[s]
+        columns.append(list(np.sqrt(moments['var']) if name == 'std' else moments[name]))
+    return [list(parcel_vals) for parcel_vals in zip(*columns)]
 
 def parcel_segstats(input_vol, atlas_space='MNI152NLin6Asym', 
                     atlas='aseg_subcortex', func_name='Functional map', parc_stat=np.mean,
-                    ignore_background=True, background_value=0, interpolation=None):
+                    ignore_background=True, background_value=0, interpolation=None, dtype=None,
+                    chunk_size=None, output='long', hierarchical=False, affine=None, n_threads=None):
     """
     Extract voxel values from an input volume based on a parcellation atlas and apply a reduction function to each parcel.
 
     Parameters
     ----------
-    input_vol : nibabel.nifti1.Nifti1Image or str
-        The input 3D or 4D NIfTI image from which to extract voxel values. Can be a nibabel Nifti1Image object or a file path to a NIfTI image.
+    input_vol : nibabel.nifti1.Nifti1Image, str or numpy.ndarray
+        The input 3D or 4D NIfTI image from which to extract voxel values. Can be a nibabel Nifti1Image object, a file path to a NIfTI image, or a NumPy array (including a memory map) together with its ``affine``, which is used without copying.
+        Repeated calls on the same file can skip decoding it with the input cache (see ``atlas_cache.set_input_cache``).
 
     atlas_space : str, optional
         The standard space to use for the corresponding atlas. Options include 'MNI152NLin6Asym' (the default) and 'MNI152NLin2009cAsym'.
@@ -36,6 +1581,10 @@ def parcel_segstats(input_vol, atlas_space='MNI152NLin6Asym',
     parc_stat : function, optional
         A function like np.mean, np.std, etc. that takes an array of values and returns a single summary statistic (scalar). Default is np.mean.
         Can also be a list of functions, in which case the output DataFrame will have one row per parcel per summary statistic.
+        Common NumPy reductions (mean, std, var, sum, min, max, median, size and their nan-variants),
+        percentiles from ``segment_stats.percentile_stat`` and statistics added with
+        ``segment_stats.register_segment_stat`` are computed for all parcels at once; any other
+        function is called once per parcel as ``f(voxels, axis=0)``.
 
     ignore_background : bool, default=True
         If True, the background label (as defined by ``background_value``) is skipped
@@ -49,12 +1598,58 @@ def parcel_segstats(input_vol, atlas_space='MNI152NLin6Asym',
         specifies the interpolation method for resampling the atlas to match the input volume.
         Options include 'nearest', 'linear', and 'cubic'. If None (default), no resampling is
         performed and an error will be raised if affines or dimensions do not match.
+        Inputs on one of the standard 1mm, 2mm or 3mm grids of ``atlas_space`` use atlases
+        pre-resampled to that grid (see ``build_atlas_pyramid``), which needs no interpolation
+        and gives the same result as 'nearest'.
+        Other inputs whose grid is axis-aligned with the atlas grid (whole-voxel shifts, flips,
+        different field of view, or voxel sizes an integer multiple or fraction of the atlas
+        voxel size) are mapped by index arithmetic instead of resampling: None and 'nearest'
+        give the same labels as nearest-neighbour resampling, as on the standard grids, and
+        'majority' gives each coarser input voxel the label covering most of its volume
+        instead. Grids on which some input voxel centres fall halfway between atlas voxels
+        have no unique nearest label and are resampled (or raise an error when
+        ``interpolation`` is None) as other grids are.
+
+    dtype : numpy dtype, optional
+        Data type in which to read the input voxels. If None (default), the stored data type
+        is kept (after any scaling), which keeps memory low for integer or float32 inputs;
+        built-in sums and means are still accumulated in float64. Use ``np.float64`` to read
+        values exactly as ``get_fdata()`` would.
+
+    chunk_size : int, optional
+        For 4D input, read and reduce this many volumes at a time to bound memory use, and
+        join the per-volume results at the end. Results are identical to reading all volumes at
+        once for statistics that reduce over voxels only (``axis=0``), which includes all of
+        NumPy's reductions. See ``iter_parcel_segstats`` to receive each chunk as it is done.
+
+    output : {'long', 'wide'}, default='long'
+        Layout of the returned DataFrame (see below).
+
+    hierarchical : bool, default=False
+        If True and several Melbourne scales (Melbourne_S1–S4) are requested, only the finest
+        requested scale is extracted from the input; the coarser scales are derived from its
+        per-parcel counts, sums, variances, minima and maxima through the nesting maps of
+        ``melbourne_nesting_maps``. Supports np.size, np.sum, np.mean, np.var, np.std, np.min
+        and np.max, and requires the scales to stay nested on the input grid (no resampling,
+        or 'nearest').
+
+    affine : numpy.ndarray, optional
+        4x4 voxel-to-world affine of ``input_vol``; required, and only used, when it is a NumPy array.
+
+    n_threads : int, optional
+        Number of threads over which multiple atlases are processed concurrently. The input is
+        read once and shared by all atlases, and results keep the order of ``atlas``. Defaults
+        to one thread per atlas, up to the number of CPUs; 1 processes atlases one by one.
+        Statistics computed per parcel by a custom function must then be thread-safe.
 
     Returns
     -------
     results_df : pandas.DataFrame
-        One row per parcel per summary statistic, with columns:
+        With ``output='long'`` (the default), one row per parcel per summary statistic, with columns:
         'stat', 'value', 'Atlas', 'Functional_Map', 'region', 'Hemisphere', 'Region_Index'.
+        'stat', 'Atlas', 'region' and 'Hemisphere' are categoricals.
+        With ``output='wide'``, one row per parcel (indexed by 'Atlas', 'Functional_Map',
+        'region', 'Hemisphere', 'Region_Index') and one column per summary statistic.
 
     Notes
     -----
@@ -67,193 +1662,520 @@ def parcel_segstats(input_vol, atlas_space='MNI152NLin6Asym',
     if not isinstance(parc_stat, list):
         parc_stat = [parc_stat]
 
-    # Load in the input volume, if it's a file path
-    if isinstance(input_vol, str):
-        input_vol = nib.load(input_vol)
+    # Build parcel layouts and find the block of the input they cover
+    input_vol, layouts, lo, hi = _prepare_extraction(input_vol, atlas, atlas_space, interpolation=interpolation,
+                                                     ignore_background=ignore_background,
+                                                     background_value=background_value, affine=affine, dtype=dtype,
+                                                     n_threads=n_threads)
 
-    # Find the affine and input data dimensions
-    input_vol_affine = input_vol.affine
-    input_data = input_vol.get_fdata()
+    # Melbourne scales derived from the finest requested scale rather than extracted
+    derived = []
+    if hierarchical:
+        unsupported = [s.__name__ for s in parc_stat if _SEGMENT_STATS.get(s) not in _HIERARCHY_STATS]
+        if unsupported:
+            raise ValueError(f"hierarchical=True supports only count, sum, mean, var, std, min and max statistics; got {unsupported}.")
+        melbourne = [this_atlas for this_atlas in atlas if this_atlas in _MELBOURNE_SCALES]
+        if len(melbourne) > 1:
+            finest = max(melbourne, key=_MELBOURNE_SCALES.index)
+            derived = [this_atlas for this_atlas in melbourne if this_atlas != finest]
 
-    # Initialize list to hold results dataframes for each atlas
-    results_df_list = []
+    # Only extracted atlases are read; the finest Melbourne scale yields moments for the hierarchy
+    extracted = [atlas_idx for atlas_idx, this_atlas in enumerate(atlas) if this_atlas not in derived]
+    extracted_stats = [_MOMENT_STATS if derived and atlas[atlas_idx] == finest else parc_stat for atlas_idx in extracted]
+
+    # Compute every parcel in one pass over each label-sorted voxel layout, chunk by chunk if requested
+    chunk_vals = [atlas_vals for _, atlas_vals in _iter_chunk_vals(input_vol, [layouts[atlas_idx] for atlas_idx in extracted],
+                                                                   lo, hi, extracted_stats,
+                                                                   chunk_size=chunk_size, dtype=dtype, n_threads=n_threads)]
+    atlas_parcel_vals = {atlas[atlas_idx]: _merge_chunk_vals([atlas_vals[chunk_idx] for atlas_vals in chunk_vals])
+                         for chunk_idx, atlas_idx in enumerate(extracted)}
+
+    if derived:
+        finest_layout = layouts[atlas.index(finest)]
+        finest_moments = _parcel_moments(atlas_parcel_vals[finest])
+        atlas_parcel_vals[finest] = _moments_parcel_vals(finest_moments, parc_stat)
+        for this_atlas in derived:
+            layout = layouts[atlas.index(this_atlas)]
+            parents = _melbourne_parents(finest, this_atlas, finest_layout, layout, atlas_space)
+            moments = _aggregate_moments(finest_moments, parents, len(layout['offsets']) - 1)
+            if not np.array_equal(moments['count'], np.diff(layout['offsets'])):
+                raise ValueError(f"'{finest}' parcels on this grid do not cover '{this_atlas}' exactly; re-run with hierarchical=False.")
+            atlas_parcel_vals[this_atlas] = _moments_parcel_vals(moments, parc_stat)
+
+    # Initialize list to hold results columns for each atlas
+    results_columns_list = []
     
     # Iterate over user-specified atlas(es)
-    for this_atlas in atlas:
+    for this_atlas, layout in zip(atlas, layouts):
+        results_columns_list.append(_layout_results_columns(layout, atlas_parcel_vals[this_atlas], parc_stat, this_atlas, func_name))
 
-        if this_atlas == 'Brainstem_Navigator':
-            # One NIFTI file per ROI — discover all .nii.gz files in the atlas directory
-            atlas_dir = files("subcortex_visualization.atlases").joinpath(f"{atlas_space}/{this_atlas}")
-            nifti_files = sorted([f for f in atlas_dir.iterdir() if f.name.endswith('.nii.gz')])
-
-            for roi_idx, nifti_path in enumerate(nifti_files):
-                roi_name = nifti_path.name.replace('.nii.gz', '')
-                roi_vol = nib.load(nifti_path)
-                roi_vol_affine = roi_vol.affine
-
-                if not np.allclose(input_vol_affine, roi_vol_affine):
-                    if interpolation is not None:
-                        print(f"Resampling ROI '{roi_name}' to match input data affine and dimensions using {interpolation} interpolation...")
-                        roi_vol = resample_img(roi_vol, target_affine=input_vol_affine, target_shape=input_data.shape[:3], interpolation=interpolation, force_resample=True, copy_header=True)
-                    else:
-                        raise ValueError(f"No resampling method was specified. Re-run this function with a specified 'interpolation' argument from the available options for resample_img (including 'nearest', 'cubic', or 'linear') to resample ROI '{roi_name}' to your input data.\nInput data affine:\n{input_vol_affine}\nROI affine:\n{roi_vol_affine}\n")
+    # Build a single DataFrame from the results of all atlases
+    results_df = _results_frame(results_columns_list, output=output)
 
-                roi_data = roi_vol.get_fdata()
-                mask = roi_data != 0
+    # Return the dataframe
+    return results_df
 
-                if input_data.shape[:3] != roi_data.shape[:3]:
-                    min_shape = np.minimum(input_data.shape[:3], roi_data.shape[:3])
-                    input_data_roi = input_data[:min_shape[0], :min_shape[1], :min_shape[2]]
-                    mask = mask[:min_shape[0], :min_shape[1], :min_shape[2]]
-                else:
-                    input_data_roi = input_data
+def iter_parcel_segstats(input_vol, atlas_space='MNI152NLin6Asym', atlas='aseg_subcortex',
+                         func_name='Functional map', parc_stat=np.mean, ignore_background=True,
+                         background_value=0, interpolation=None, dtype=None, chunk_size=100, affine=None,
+                         n_threads=None):
+    """
+    Stream parcel statistics from a 4D volume, one chunk of volumes at a time.
 
-                voxels = input_data_roi[mask]
+    Only ``chunk_size`` volumes of the atlas-covered block of the input are held in memory
+    at once, so long runs can be processed on small-memory machines.
 
-                if input_data.ndim == 4:
-                    voxels = voxels.reshape(-1, input_data.shape[-1])
-                    vals = [s(voxels, axis=0) for s in parc_stat]
-                else:
-                    vals = [s(voxels, axis=0) for s in parc_stat]
+    Parameters
+    ----------
+    input_vol : nibabel.nifti1.Nifti1Image, str or numpy.ndarray
+        The input 4D NIfTI image (or a file path to one, or an array with its ``affine``).
+        A 3D image yields a single chunk.
+
+    atlas_space, atlas, func_name, parc_stat, ignore_background, background_value, interpolation, dtype, affine, n_threads
+        As in ``parcel_segstats``.
 
-                this_lab_df = pd.DataFrame({
-                    'stat': [s.__name__ for s in parc_stat],
-                    'value': vals
-                })
+    chunk_size : int, default=100
+        Number of volumes per chunk.
 
-                this_hemi = 'B'
-                if roi_name.endswith(('_lh', '-lh', '-L', '_L', '_l')):
-                    this_hemi = 'L'
-                elif roi_name.endswith(('_rh', '-rh', '-R', '_R', '_r')):
-                    this_hemi = 'R'
-                elif 'vermis' in roi_name:
-                    this_hemi = 'V'
+    Yields
+    ------
+    volumes : slice
+        The range of volumes covered by this chunk.
 
-                this_region_clean = re.sub(r'(_lh|-lh|-L|_L|_l|_rh|-rh|-R|_R|_r|-vermis)$', '', roi_name)
+    results_df : pandas.DataFrame
+        Results for those volumes, in the same format as ``parcel_segstats``.
+    """
+
+    if isinstance(atlas, str):
+        atlas = [atlas]
 
-                this_lab_df['Atlas'] = this_atlas
-                this_lab_df['Functional_Map'] = func_name
-                this_lab_df['region'] = this_region_clean
-                this_lab_df['Hemisphere'] = this_hemi
-                this_lab_df['Region_Index'] = roi_idx + 1
+    if not isinstance(parc_stat, list):
+        parc_stat = [parc_stat]
 
-                results_df_list.append(this_lab_df)
+    input_vol, layouts, lo, hi = _prepare_extraction(input_vol, atlas, atlas_space, interpolation=interpolation,
+                                                     ignore_background=ignore_background,
+                                                     background_value=background_value, affine=affine, dtype=dtype,
+                                                     n_threads=n_threads)
 
-        else:
-            # Define atlas volume
-            this_atlas_volume_path = files("subcortex_visualization.atlases").joinpath(f"{atlas_space}/{this_atlas}/{this_atlas}.nii.gz")
-            # Try loading atlas, if that fails, append _subcortex and try again (since some atlases have that suffix in the filename)
+    for volumes, atlas_vals in _iter_chunk_vals(input_vol, layouts, lo, hi, [parc_stat] * len(layouts),
+                                                chunk_size=chunk_size, dtype=dtype, n_threads=n_threads):
+        results_columns_list = [_layout_results_columns(layout, parcel_vals, parc_stat, this_atlas, func_name)
+                                for this_atlas, layout, parcel_vals in zip(atlas, layouts, atlas_vals)]
+
+        if volumes is None:
+            volumes = slice(0, input_vol.shape[3] if len(input_vol.shape) > 3 else 1)
+        yield volumes, _results_frame(results_columns_list)
+
+def _indicator_matrix(layout, lo, block_shape, order='C'):
+    """
+    Build a sparse (parcels x voxels) averaging matrix from a parcel layout.
+
+    Each row holds ``1 / n_voxels`` (or normalised voxel weights, if the layout has them)
+    at the parcel's voxels, so that ``matrix @ data`` gives the parcel means.
+
+    Parameters
+    ----------
+    layout : dict
+        Parcel layout from ``_atlas_layout``.
+
+    lo : array-like of int
+        Corner of the input block the matrix is applied to (see ``_read_block``).
+
+    block_shape : tuple of int
+        Spatial shape of that block.
+
+    order : {'C', 'F'}, default='C'
+        Memory order used to flatten the block. Matching the block's own order lets the
+        4D data be reshaped to (voxels, T) without a copy.
+
+    Returns
+    -------
+    scipy.sparse.csr_matrix
+        Matrix of shape (n_parcels, prod(block_shape)).
+    """
+    offsets = layout['offsets']
+    counts = np.diff(offsets)
+    rows = np.repeat(np.arange(len(counts)), counts)
+
+    if layout['weights'] is not None:
+        weights = np.asarray(layout['weights'], dtype=float)
+        totals = np.bincount(rows, weights=weights, minlength=len(counts))
+    else:
+        weights = np.ones(len(rows))
+        totals = counts.astype(float)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        values = weights / totals[rows]
+
+    coords = np.unravel_index(layout['index'], layout['shape'])
+    columns = np.ravel_multi_index(tuple(c - l for c, l in zip(coords, lo)), block_shape, order=order)
+
+    return sparse.csr_matrix((values, (rows, columns)), shape=(len(counts), int(np.prod(block_shape))))
+
+def parcel_timeseries(input_vol, atlas_space='MNI152NLin6Asym', atlas='aseg_subcortex',
+                      func_name='Functional map', ignore_background=True, background_value=0,
+                      interpolation=None, weighted=False, return_df=False, dtype=None, chunk_size=None,
+                      affine=None):
+    """
+    Extract the mean time series of every parcel from a 4D volume with one sparse matrix product per atlas.
+
+    The sparse (parcels x voxels) averaging matrix for each atlas and input grid is kept in the
+    in-process atlas cache (see ``atlas_cache``), so repeated calls on data sharing a grid only pay for the matrix product.
+
+    Parameters
+    ----------
+    input_vol : nibabel.nifti1.Nifti1Image, str or numpy.ndarray
+        The input 4D NIfTI image (or a file path to one, or an array with its ``affine``).
+
+    atlas_space : str, optional
+        The standard space to use for the corresponding atlas. Options include 'MNI152NLin6Asym' (the default) and 'MNI152NLin2009cAsym'.
+
+    atlas : str or list of str, optional
+        Name(s) of the subcortical atlas/atlases to apply. Default is 'aseg_subcortex'. With multiple atlases, rows are stacked in the given atlas order.
+
+    func_name : str, optional
+        A name for the functional map being summarized, used in the output DataFrame. Default is 'Functional map'.
+
+    ignore_background : bool, default=True
+        If True, the background label (as defined by ``background_value``) is skipped.
+
+    background_value : int, default=0
+        Integer label in the parcellation that represents background (non-parcel) voxels.
+
+    interpolation : str or None, optional
+        Interpolation method used to resample the atlas if its affine differs from the input, as in ``parcel_segstats``.
+
+    weighted : bool, default=False
+        For Brainstem_Navigator, weight each voxel by its ROI value (e.g. partial-volume
+        fractions after linear resampling) instead of averaging all non-zero voxels equally.
+        For other atlases on axis-aligned input grids coarser than the atlas by an integer
+        factor, weight each input voxel by the fraction of its volume each parcel covers,
+        listing it under every parcel it overlaps, instead of assigning it a single label.
+
+    return_df : bool, default=False
+        If True, also return the long-format DataFrame produced by
+        ``parcel_segstats(..., parc_stat=np.mean)``.
+
+    dtype : numpy dtype, optional
+        Data type in which to read the input voxels; see ``parcel_segstats``. Only the block
+        of the input covered by the atlas(es) is read.
+
+    chunk_size : int, optional
+        Read this many volumes at a time, writing each chunk's rows into the preallocated
+        output, to bound memory use for long runs.
+
+    affine : numpy.ndarray, optional
+        4x4 affine of ``input_vol``; required, and only used, when it is a NumPy array.
+
+    Returns
+    -------
+    timeseries : numpy.ndarray
+        Array of shape (n_parcels, T) with one mean time series per parcel.
+
+    results_df : pandas.DataFrame
+        Only if ``return_df`` is True. One row per parcel, with columns
+        'stat', 'value', 'Atlas', 'Functional_Map', 'region', 'Hemisphere', 'Region_Index'.
+    """
+
+    if isinstance(atlas, str):
+        atlas = [atlas]
+
+    # Load in the input volume, if it's a file path or array
+    input_vol = _load_input(input_vol, affine=affine, dtype=dtype)
+
+    if len(input_vol.shape) != 4:
+        raise ValueError(f"parcel_timeseries requires a 4D input volume; got an input with shape {input_vol.shape}. Use parcel_segstats for 3D volumes.")
+
+    input_vol, layouts, lo, hi = _prepare_extraction(input_vol, atlas, atlas_space, interpolation=interpolation,
+                                                     ignore_background=ignore_background,
+                                                     background_value=background_value, weighted=weighted)
+    input_affine_bytes = np.asarray(input_vol.affine, dtype=float).tobytes()
+
+    # Preallocate the output; rows of each atlas are contiguous
+    n_parcels = [len(layout['offsets']) - 1 for layout in layouts]
+    row_starts = np.concatenate([[0], np.cumsum(n_parcels)])
+    timeseries = np.empty((row_starts[-1], input_vol.shape[3]), dtype=np.float64)
+
+    indicators = None
+    for volumes in _volume_chunks(input_vol, chunk_size):
+        # Read only the block of the input covered by the atlas(es)
+        input_data = _read_block(input_vol, lo, hi, dtype=dtype, volumes=volumes)
+
+        # Flatten the spatial dimensions in the array's own memory order to avoid a copy
+        order = 'F' if input_data.flags['F_CONTIGUOUS'] and not input_data.flags['C_CONTIGUOUS'] else 'C'
+        input_2d = input_data.reshape(-1, input_data.shape[-1], order=order)
+
+        if indicators is None:
+            indicators = []
+            for this_atlas, layout in zip(atlas, layouts):
+                cache_key = ('indicator', atlas_space, this_atlas, input_vol.shape[:3], input_affine_bytes, interpolation,
+                             ignore_background, background_value, weighted, tuple(lo), input_data.shape[:3], order)
+                indicator = _cache_get(cache_key)
+                if indicator is None:
+                    indicator = _cache_put(cache_key, _indicator_matrix(layout, lo, input_data.shape[:3], order=order))
+                indicators.append(indicator)
+
+        # One sparse product per atlas gives every parcel's mean time series
+        columns = slice(None) if volumes is None else volumes
+        for atlas_idx, indicator in enumerate(indicators):
+            timeseries[row_starts[atlas_idx]:row_starts[atlas_idx + 1], columns] = indicator @ input_2d
+
+    # Parcels without voxels have no mean
+    timeseries[np.concatenate([np.diff(layout['offsets']) == 0 for layout in layouts])] = np.nan
+
+    if return_df:
+        results_columns_list = []
+        for atlas_idx, (this_atlas, layout) in enumerate(zip(atlas, layouts)):
+            rows = timeseries[row_starts[atlas_idx]:row_starts[atlas_idx + 1]]
+            results_columns_list.append(_layout_results_columns(layout, [[row] for row in rows], [np.mean], this_atlas, func_name))
+        return timeseries, _results_frame(results_columns_list)
+
+    return timeseries
+
+def _wide_results(results_df, index_cols, column_cols):
+    """
+    Pivot long-format results to one row per ``index_cols`` combination and one column per
+    ``column_cols`` combination, keeping the order in which rows and columns first appear.
+    """
+    def _first_seen(cols):
+        seen = results_df[cols].drop_duplicates()
+        return pd.MultiIndex.from_frame(seen) if len(cols) > 1 else pd.Index(seen[cols[0]])
+
+    wide_df = results_df.pivot(index=index_cols, columns=column_cols, values='value')
+    return wide_df.reindex(index=_first_seen(index_cols), columns=_first_seen(column_cols))
+
+def _batch_item(item):
+    """
+    Run ``parcel_segstats`` on one batch input, capturing any error instead of raising it.
+
+    Module-level so that it can be sent to worker processes.
+    """
+    position, input_vol, kwargs = item
+    try:
+        return position, parcel_segstats(input_vol, **kwargs), None
+    except Exception as error:
+        return position, None, f"{type(error).__name__}: {error}"
+
+def parcel_segstats_batch(input_vols, atlas_space='MNI152NLin6Asym', atlas='aseg_subcortex',
+                          func_name='Functional map', parc_stat=np.mean, ignore_background=True,
+                          background_value=0, interpolation=None, dtype=None, n_jobs=1,
+                          output='long', on_error='capture', affine=None, mp_context=None):
+    """
+    Run ``parcel_segstats`` over many input volumes, optionally in a pool of worker processes.
+
+    Parameters
+    ----------
+    input_vols : list of nibabel.nifti1.Nifti1Image, str or numpy.ndarray
+        Input volumes (or file paths to them, or arrays sharing ``affine``). Paths are cheaper
+        to send to worker processes than loaded images, since each worker then reads only the
+        block of its input it needs.
+
+    atlas_space, atlas, func_name, parc_stat, ignore_background, background_value, interpolation, dtype, affine
+        As in ``parcel_segstats``. With ``n_jobs > 1``, ``parc_stat`` must be picklable
+        (e.g. a NumPy function rather than a lambda).
+
+    n_jobs : int or None, default=1
+        Number of worker processes. 1 runs in the calling process; None uses every available CPU.
+
+    mp_context : multiprocessing context or None, default=None
+        Context used to start worker processes with ``n_jobs > 1``, e.g.
+        ``multiprocessing.get_context('spawn')``. None uses the platform's default start method.
+
+    output : {'long', 'wide'}, default='long'
+        'long' returns the ``parcel_segstats`` schema with an added 'Input' column.
+        'wide' returns one row per input and one column per (Atlas, region, Hemisphere, stat).
+
+    on_error : {'capture', 'raise'}, default='capture'
+        'capture' records failed inputs in ``errors_df`` and carries on with the rest;
+        'raise' raises a RuntimeError naming the first failed input.
+
+    Returns
+    -------
+    results_df : pandas.DataFrame
+        Results for all inputs that succeeded, in input order. The 'Input' column (or index,
+        for wide output) holds the file path for path inputs and the list position otherwise.
+
+    errors_df : pandas.DataFrame
+        One row per failed input, with columns 'Input' and 'Error'.
+
+    Notes
+    -----
+    - With a context that forks worker processes, atlases are decoded and resampled once in
+      the calling process on the first input's grid before the pool starts, and workers inherit
+      these cached atlases instead of loading their own copies. If the first input cannot be
+      read, the pool starts without them and that input fails in its worker like any other.
+      Other start methods load the atlases in each worker.
+    """
+
+    if output not in ('long', 'wide'):
+        raise ValueError(f"output must be 'long' or 'wide'; got {output!r}.")
+    if on_error not in ('capture', 'raise'):
+        raise ValueError(f"on_error must be 'capture' or 'raise'; got {on_error!r}.")
+
+    if isinstance(atlas, str):
+        atlas = [atlas]
+
+    input_vols = list(input_vols)
+    input_ids = [input_vol if isinstance(input_vol, str) else position for position, input_vol in enumerate(input_vols)]
+
+    kwargs = dict(atlas_space=atlas_space, atlas=atlas, func_name=func_name, parc_stat=parc_stat,
+                  ignore_background=ignore_background, background_value=background_value,
+                  interpolation=interpolation, dtype=dtype, affine=affine)
+
+    if n_jobs is None:
+        n_jobs = os.cpu_count() or 1
+    n_jobs = max(1, min(int(n_jobs), len(input_vols)))
+
+    # Worker processes already use every CPU; each then handles its atlases one by one
+    if n_jobs > 1:
+        kwargs['n_threads'] = 1
+
+    items = [(position, input_vol, kwargs) for position, input_vol in enumerate(input_vols)]
+
+    if n_jobs == 1:
+        outcomes = map(_batch_item, items)
+    else:
+        if mp_context is None:
+            mp_context = multiprocessing.get_context()
+        # Warm the atlas cache on the first input's grid so forked workers share it. If that
+        # input cannot be read, workers load their own atlases and its error is reported with
+        # the other inputs' (through ``on_error``)
+        if input_vols and mp_context.get_start_method() == 'fork':
             try:
-                this_atlas_vol = nib.load(this_atlas_volume_path)
-                # Define atlas lookup table (LUT)
-                this_atlas_LUT = pd.read_csv(files("subcortex_visualization.atlases").joinpath(f"{atlas_space}/{this_atlas}/{this_atlas}_lookup.csv"), header=None)
-            except FileNotFoundError:
-                try:
-                    this_atlas_volume_path = files("subcortex_visualization.atlases").joinpath(f"{atlas_space}/{this_atlas}/{this_atlas}_subcortex.nii.gz")
-                    this_atlas_vol = nib.load(this_atlas_volume_path)
-                    Warning(f"Atlas volume file for atlas '{this_atlas}' not found with expected filename '{this_atlas}.nii.gz'. Successfully loaded atlas volume with alternative filename '{this_atlas}_subcortex.nii.gz'. Please check that the atlas volume file in the package directory is named according to one of these two conventions to avoid this warning in the future.")
-
-                    this_atlas_LUT = pd.read_csv(files("subcortex_visualization.atlases").joinpath(f"{atlas_space}/{this_atlas}/{this_atlas}_subcortex_lookup.csv"), header=None)
-
-                except FileNotFoundError:
-                    raise FileNotFoundError(f"Atlas volume file not found for atlas '{this_atlas}'. Looked for files named '{this_atlas}.nii.gz' and '{this_atlas}_subcortex.nii.gz' in the subcortex_visualization.atlases package directory. Please check that the atlas name is correct and that the corresponding atlas volume file is present in the package directory.")
-
-            # If first row has 'Region_Name' in any column, then set the column names to the first row and drop the first row from the data
-            if this_atlas_LUT.iloc[0].str.contains('Region_Name').any():
-                this_atlas_LUT.columns = this_atlas_LUT.iloc[0]
-                this_atlas_LUT = this_atlas_LUT.drop(0).reset_index(drop=True)
-
-            # Find affines
-            this_atlas_vol_affine = this_atlas_vol.affine
-
-            # Compare affines and raise error if they don't match
-            if not np.allclose(input_vol_affine, this_atlas_vol_affine):
-                # Affines don't match; resample if interpolation is specified, otherwise raise an error
-                Warning(f"Affines of input data and atlas do not match. Atlas affine:\n{this_atlas_vol_affine}\nInput data affine:\n{input_vol_affine}\n")
-
-                # Resample the atlas to match the input volume
-                if interpolation is not None:
-                    print(f"Resampling atlas '{this_atlas}' to match input data affine and dimensions using {interpolation} interpolation...")
-                    this_atlas_vol = resample_img(this_atlas_vol, target_affine=input_vol_affine, target_shape=input_data.shape[:3], interpolation=interpolation, force_resample=True, copy_header=True)
-                    this_atlas_vol_affine = this_atlas_vol.affine
+                _prepare_extraction(input_vols[0], atlas, atlas_space, interpolation=interpolation,
+                                    ignore_background=ignore_background, background_value=background_value,
+                                    affine=affine)
+            except Exception:
+                pass
+        executor = ProcessPoolExecutor(max_workers=n_jobs, mp_context=mp_context)
+        outcomes = executor.map(_batch_item, items, chunksize=max(1, len(items) // (4 * n_jobs)))
 
-                else:
-                    raise ValueError(f"No resampling method was specified. Re-run this function with a specified 'interpolation' argument from the available options for resample_img (including 'nearest', 'cubic', or 'linear') to resample the desired atlas volume to your input data.\nInput data affine:\n{input_vol_affine}\nAtlas affine:\n{this_atlas_vol_affine} \n")
+    results_df_list, errors = [], []
+    try:
+        for position, results_df, error in outcomes:
+            if error is not None:
+                if on_error == 'raise':
+                    raise RuntimeError(f"parcel_segstats failed for input {input_ids[position]!r}: {error}")
+                errors.append({'Input': input_ids[position], 'Error': error})
+                continue
+            results_df.insert(0, 'Input', [input_ids[position]] * len(results_df))
+            results_df_list.append(results_df)
+    finally:
+        if n_jobs > 1:
+            executor.shutdown(cancel_futures=True)
+
+    if results_df_list:
+        results_df = pd.concat(results_df_list, ignore_index=True)
+        # Inputs with differing parcels would fall back to object columns on concat
+        for col in _RESULT_CATEGORICALS:
+            results_df[col] = pd.Categorical(results_df[col], categories=pd.unique(results_df[col]))
+    else:
+        results_df = pd.DataFrame(columns=['Input'] + _RESULT_COLUMNS)
+    errors_df = pd.DataFrame(errors, columns=['Input', 'Error'])
+
+    if output == 'wide':
+        results_df = _wide_results(results_df, ['Input'], ['Atlas', 'region', 'Hemisphere', 'stat'])
 
-            # Extract data
-            labels = this_atlas_vol.get_fdata()
+    return results_df, errors_df
 
-            # Round to int — resampled atlases may have fractional label values
-            labels = np.round(labels).astype(int)
+def parcel_segstats_stacked(maps, affine, atlas_space='MNI152NLin6Asym', atlas='aseg_subcortex',
+                            parc_stat=np.mean, ignore_background=True, background_value=0,
+                            interpolation=None, chunk_size=None):
+    """
+    Extract parcel statistics from a stack of maps that share one grid, e.g. permutation or null-model maps.
 
-            # If affines match but spatial dims still differ, it's likely an FOV mismatch — crop to the smaller shape
-            if input_data.shape[:3] != labels.shape[:3]:
-                Warning(f"Spatial dimensions of input data and atlas do not match. Input data shape: {input_data.shape}\nAtlas labels shape: {labels.shape}\nAttempting to crop atlas labels to match input data dimensions...")
-                try:
-                    min_shape = np.minimum(input_data.shape[:3], labels.shape[:3])
-                    input_data = input_data[:min_shape[0], :min_shape[1], :min_shape[2]]
-                    labels = labels[:min_shape[0], :min_shape[1], :min_shape[2]]
+    All maps are reduced together with one vectorised pass per atlas, and the result is a
+    plain array rather than a DataFrame per map.
 
-                except Exception as e:
-                    print(f"Error occurred while attempting to crop atlas labels to match input data dimensions: {e}\nUnable to proceed with extraction.")
+    Parameters
+    ----------
+    maps : numpy.ndarray
+        Array (or ``numpy.memmap``) of shape (N_maps, X, Y, Z). Only the block covered by the
+        atlas(es) is read, so memory-mapped stacks larger than memory are fine.
 
-            # If affines and data dimensions are compatible, proceed with extraction
+    affine : numpy.ndarray
+        4x4 affine shared by every map.
 
-            this_atlas_LUT.columns = ['Index', 'Region']
-            this_atlas_regions = this_atlas_LUT['Region'].values
-            unique_labels = np.unique(labels)
+    atlas_space : str, optional
+        The standard space to use for the corresponding atlas. Default is 'MNI152NLin6Asym'.
 
-            # skip background if requested, which is the default
-            if ignore_background:
-                unique_labels = unique_labels[unique_labels != background_value]
+    atlas : str or list of str, optional
+        Name(s) of the subcortical atlas/atlases to apply. Default is 'aseg_subcortex'.
 
+    parc_stat : function or list of functions, optional
+        Summary statistic(s), as in ``parcel_segstats``. Default is np.mean.
 
-            # Iterate over each unique label and extract voxel values
-            for i, lab in enumerate(unique_labels):
-                # If lab is a str/float, convert to int
-                lab = int(lab)
-                mask = labels == lab
-                voxels = input_data[mask]
+    ignore_background : bool, default=True
+        If True, the background label (as defined by ``background_value``) is skipped.
 
-                # Handle 4D (time series) vs 3D
-                if input_data.ndim == 4:
-                    voxels = voxels.reshape(-1, input_data.shape[-1])
-                    vals = [s(voxels, axis=0) for s in parc_stat]
-                else:
-                    vals = [s(voxels, axis=0) for s in parc_stat]
+    background_value : int, default=0
+        Integer label in the parcellation that represents background voxels.
 
-                # One row per summary statistic
-                this_lab_df = pd.DataFrame({
-                    'stat': [s.__name__ for s in parc_stat],
-                    'value': vals
-                })
+    interpolation : str or None, optional
+        Interpolation used to resample the atlas onto the maps' grid; see ``parcel_segstats``.
+
+    chunk_size : int, optional
+        Reduce this many maps at a time to bound memory use. By default all maps are reduced at once.
+
+    Returns
+    -------
+    values : numpy.ndarray
+        Array of shape (N_maps, n_regions, n_stats); ``values[k, i, j]`` is statistic
+        ``parc_stat[j]`` of region ``i`` in map ``k``.
+
+    regions_df : pandas.DataFrame
+        One row per region, in the order of the second axis of ``values``, with columns
+        'Atlas', 'region', 'Hemisphere', 'Region_Index'.
+    """
+
+    if isinstance(atlas, str):
+        atlas = [atlas]
+
+    if not isinstance(parc_stat, list):
+        parc_stat = [parc_stat]
 
-                this_atlas_region_full = this_atlas_regions[i]
+    if np.ndim(maps) != 4:
+        raise ValueError(f"parcel_segstats_stacked requires an (N_maps, X, Y, Z) array; got an input with shape {np.shape(maps)}.")
 
-                # Infer hemisphere from region name suffix
-                this_hemi = 'B'
-                if this_atlas_region_full.endswith(('_lh', '-lh', '-L', '_L', '_l', '_LH')):
-                    this_hemi = 'L'
-                elif this_atlas_region_full.endswith(('_rh', '-rh', '-R', '_R', '_r', '_RH')):
-                    this_hemi = 'R'
-                elif 'vermis' in this_atlas_region_full:
-                    this_hemi = 'V'
+    n_maps = maps.shape[0]
+    grid_shape = tuple(int(s) for s in maps.shape[1:])
 
-                # Strip hemisphere suffix to get the clean region name
-                this_region_clean = re.sub(r'(_lh|-lh|-L|_L|_l|_LH|_rh|-rh|-R|_R|_r|_RH|-vermis)$', '', this_atlas_region_full)
+    layouts = [_atlas_layout(this_atlas, atlas_space, affine, grid_shape, interpolation=interpolation,
+                             ignore_background=ignore_background, background_value=background_value)
+               for this_atlas in atlas]
 
-                # Add region/atlas metadata to the dataframe
-                this_lab_df['Atlas'] = this_atlas
-                this_lab_df['Functional_Map'] = func_name
-                this_lab_df['region'] = this_region_clean
-                this_lab_df['Hemisphere'] = this_hemi
-                this_lab_df['Region_Index'] = lab
+    # Only the block covered by the atlas(es) is read
+    lo = np.min([layout['bbox'][0] for layout in layouts], axis=0)
+    hi = np.max([layout['bbox'][1] for layout in layouts], axis=0)
+    block_shape = tuple(int(h - l) for l, h in zip(lo, hi))
+    block_indices = [_block_index(layout['index'], grid_shape, lo, block_shape) for layout in layouts]
+    spatial = tuple(slice(int(l), int(h)) for l, h in zip(lo, hi))
 
-                # Append this label's results to the list
-                results_df_list.append(this_lab_df)
+    n_regions = [len(layout['offsets']) - 1 for layout in layouts]
+    row_starts = np.concatenate([[0], np.cumsum(n_regions)])
+    values = np.empty((n_maps, row_starts[-1], len(parc_stat)), dtype=np.float64)
 
-    # Concatenate results from all atlases into a single DataFrame
-    results_df = pd.concat(results_df_list, ignore_index=True)
+    if chunk_size is None:
+        chunk_size = max(n_maps, 1)
+    for start in range(0, n_maps, chunk_size):
+        stop = min(start + chunk_size, n_maps)
+        # Maps last, so that each parcel reduction runs over voxels with one value per map
+        block = np.moveaxis(np.asarray(maps[(slice(start, stop),) + spatial]), 0, -1)
 
-    # Return the dataframe
-    return results_df
\ No newline at end of file
+        for atlas_idx, (index, layout) in enumerate(zip(block_indices, layouts)):
+            columns = _segment_columns(block, index, layout['offsets'], parc_stat)
+            rows = slice(row_starts[atlas_idx], row_starts[atlas_idx + 1])
+            for stat_idx, column in enumerate(columns):
+                # (regions,) for statistics that do not depend on the maps, such as np.size
+                if not isinstance(column, np.ndarray):
+                    column = np.stack(np.broadcast_arrays(*column)) if len(column) else np.empty(0)
+                values[start:stop, rows, stat_idx] = column.T
+
+    regions_df = pd.DataFrame({
+        'Atlas': np.repeat(atlas, n_regions),
+        'region': np.concatenate([layout['region'] for layout in layouts]),
+        'Hemisphere': np.concatenate([layout['hemisphere'] for layout in layouts]),
+        'Region_Index': np.concatenate([layout['region_index'] for layout in layouts]),
+    })
+
+    return values, regions_df
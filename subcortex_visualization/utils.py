@@ -4,6 +4,7 @@ import numpy as np
 
 # Files 
 from importlib.resources import files
+import zipfile
 
 def get_atlas_regions(atlas_name):
     """
@@ -59,3 +60,55 @@ def get_atlas_regions(atlas_name):
         unique_regions = atlas_ordering.sort_values('seg_index').region.unique()
 
         return unique_regions
+
+def _load_npz(path, mmap_mode='r'):
+    """
+    Load every array in an ``.npz`` file, memory-mapping members that are stored uncompressed.
+
+    ``np.load`` ignores ``mmap_mode`` for ``.npz`` archives; since ``np.savez`` stores members
+    without compression, each member's data can instead be mapped straight from its offset
+    in the archive. Compressed members are read into memory.
+
+    Parameters
+    ----------
+    path : str or os.PathLike
+        Path to the ``.npz`` file. It must be a file on disk that ``open`` accepts (e.g. a
+        ``pathlib.Path`` from ``importlib.resources.files`` for an installed package), since
+        uncompressed members are memory-mapped from it; file-like objects are not supported.
+
+    mmap_mode : {'r', 'c', None}, default='r'
+        Memory-map mode for uncompressed members; None reads everything into memory.
+
+    Returns
+    -------
+    dict of numpy.ndarray
+        Arrays keyed by member name (without the '.npy' suffix).
+
+    Raises
+    ------
+    ValueError
+        If a member holds an object array, which would need unpickling.
+    """
+    arrays = {}
+    with open(path, 'rb') as f, zipfile.ZipFile(f) as zf:
+        for info in zf.infolist():
+            name = info.filename[:-4] if info.filename.endswith('.npy') else info.filename
+            if mmap_mode is None or info.compress_type != zipfile.ZIP_STORED:
+                with zf.open(info) as member:
+                    arrays[name] = np.lib.format.read_array(member, allow_pickle=False)
+                continue
+
+            # Skip the local file header (30 bytes + file name + extra field) to reach the .npy payload
+            f.seek(info.header_offset + 26)
+            name_len, extra_len = np.frombuffer(f.read(4), dtype='<u2')
+            f.seek(info.header_offset + 30 + int(name_len) + int(extra_len))
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+            if dtype.hasobject:
+                raise ValueError(f"Object arrays cannot be memory-mapped from {path}")
+            arrays[name] = np.memmap(path, dtype=dtype, mode=mmap_mode, offset=f.tell(),
+                                     shape=shape, order='F' if fortran_order else 'C') if np.prod(shape) else np.empty(shape, dtype=dtype)
+    return arrays
@@ -0,0 +1,358 @@
+# Baseline (pre-optimisation) implementations that the tests compare the package against
+
+# Necessary imports
+import numpy as np
+import pandas as pd
+
+# neuromaps imports
+import nibabel as nib
+from nilearn.image import resample_img
+
+# Files
+from importlib.resources import files
+
+# Regular expressions
+import re
+
+# Vector graphics
+import xml.etree.ElementTree as ET
+from svgpath2mpl import parse_path
+import matplotlib.colors as mcolors
+from matplotlib.patches import PathPatch
+
+def atlas_grid(atlas, atlas_space='MNI152NLin6Asym'):
+    """
+    Return the affine and shape of a packaged atlas's full-resolution volume.
+    """
+    atlas_dir = files("subcortex_visualization.atlases").joinpath(f"{atlas_space}/{atlas}")
+    volume_path = sorted((f for f in atlas_dir.iterdir() if f.name.endswith('.nii.gz') and '_res-' not in f.name),
+                         key=lambda f: f.name)[0]
+    vol = nib.load(volume_path)
+    return vol.affine, vol.shape[:3]
+
+def random_image(atlas, atlas_space='MNI152NLin6Asym', n_volumes=None, seed=0):
+    """
+    Return a random normal 3D (or 4D, with ``n_volumes`` volumes) image on an atlas's grid.
+    """
+    affine, shape = atlas_grid(atlas, atlas_space)
+    if n_volumes is not None:
+        shape = shape + (n_volumes,)
+    rng = np.random.default_rng(seed)
+    return nib.Nifti1Image(rng.standard_normal(shape), affine)
+
+def parcel_segstats(input_vol, atlas_space='MNI152NLin6Asym',
+                    atlas='aseg_subcortex', func_name='Functional map', parc_stat=np.mean,
+                    ignore_background=True, background_value=0, interpolation=None):
+    """
+    The original parcel_segstats: one boolean mask and one reduction per parcel.
+    """
+
+    if isinstance(atlas, str):
+        atlas = [atlas]
+
+    if not isinstance(parc_stat, list):
+        parc_stat = [parc_stat]
+
+    # Load in the input volume, if it's a file path
+    if isinstance(input_vol, str):
+        input_vol = nib.load(input_vol)
+
+    # Find the affine and input data dimensions
+    input_vol_affine = input_vol.affine
+    input_data = input_vol.get_fdata()
+
+    # Initialize list to hold results dataframes for each atlas
+    results_df_list = []
+
+    # Iterate over user-specified atlas(es)
+    for this_atlas in atlas:
+
+        if this_atlas == 'Brainstem_Navigator':
+            # One NIFTI file per ROI — discover all .nii.gz files in the atlas directory
+            atlas_dir = files("subcortex_visualization.atlases").joinpath(f"{atlas_space}/{this_atlas}")
+            nifti_files = sorted([f for f in atlas_dir.iterdir() if f.name.endswith('.nii.gz')])
+
+            for roi_idx, nifti_path in enumerate(nifti_files):
+                roi_name = nifti_path.name.replace('.nii.gz', '')
+                roi_vol = nib.load(nifti_path)
+                roi_vol_affine = roi_vol.affine
+
+                if not np.allclose(input_vol_affine, roi_vol_affine):
+                    if interpolation is not None:
+                        roi_vol = resample_img(roi_vol, target_affine=input_vol_affine, target_shape=input_data.shape[:3], interpolation=interpolation, force_resample=True, copy_header=True)
+                    else:
+                        raise ValueError(f"No resampling method was specified for ROI '{roi_name}'.")
+
+                roi_data = roi_vol.get_fdata()
+                mask = roi_data != 0
+
+                if input_data.shape[:3] != roi_data.shape[:3]:
+                    min_shape = np.minimum(input_data.shape[:3], roi_data.shape[:3])
+                    input_data_roi = input_data[:min_shape[0], :min_shape[1], :min_shape[2]]
+                    mask = mask[:min_shape[0], :min_shape[1], :min_shape[2]]
+                else:
+                    input_data_roi = input_data
+
+                voxels = input_data_roi[mask]
+
+                if input_data.ndim == 4:
+                    voxels = voxels.reshape(-1, input_data.shape[-1])
+                vals = [s(voxels, axis=0) for s in parc_stat]
+
+                this_lab_df = pd.DataFrame({
+                    'stat': [s.__name__ for s in parc_stat],
+                    'value': vals
+                })
+
+                this_hemi = 'B'
+                if roi_name.endswith(('_lh', '-lh', '-L', '_L', '_l')):
+                    this_hemi = 'L'
+                elif roi_name.endswith(('_rh', '-rh', '-R', '_R', '_r')):
+                    this_hemi = 'R'
+                elif 'vermis' in roi_name:
+                    this_hemi = 'V'
+
+                this_region_clean = re.sub(r'(_lh|-lh|-L|_L|_l|_rh|-rh|-R|_R|_r|-vermis)$', '', roi_name)
+
+                this_lab_df['Atlas'] = this_atlas
+                this_lab_df['Functional_Map'] = func_name
+                this_lab_df['region'] = this_region_clean
+                this_lab_df['Hemisphere'] = this_hemi
+                this_lab_df['Region_Index'] = roi_idx + 1
+
+                results_df_list.append(this_lab_df)
+
+        else:
+            # Define atlas volume and lookup table; some atlases carry a '_subcortex' suffix
+            atlas_dir = files("subcortex_visualization.atlases").joinpath(f"{atlas_space}/{this_atlas}")
+            stem = this_atlas if atlas_dir.joinpath(f"{this_atlas}.nii.gz").is_file() else f"{this_atlas}_subcortex"
+            this_atlas_vol = nib.load(atlas_dir.joinpath(f"{stem}.nii.gz"))
+            this_atlas_LUT = pd.read_csv(atlas_dir.joinpath(f"{stem}_lookup.csv"), header=None)
+
+            # If first row has 'Region_Name' in any column, then set the column names to the first row and drop the first row from the data
+            if this_atlas_LUT.iloc[0].str.contains('Region_Name').any():
+                this_atlas_LUT.columns = this_atlas_LUT.iloc[0]
+                this_atlas_LUT = this_atlas_LUT.drop(0).reset_index(drop=True)
+
+            # Resample the atlas to the input volume if their affines differ
+            if not np.allclose(input_vol_affine, this_atlas_vol.affine):
+                if interpolation is not None:
+                    this_atlas_vol = resample_img(this_atlas_vol, target_affine=input_vol_affine, target_shape=input_data.shape[:3], interpolation=interpolation, force_resample=True, copy_header=True)
+                else:
+                    raise ValueError(f"No resampling method was specified for atlas '{this_atlas}'.")
+
+            # Round to int — resampled atlases may have fractional label values
+            labels = np.round(this_atlas_vol.get_fdata()).astype(int)
+
+            # If affines match but spatial dims still differ, crop to the smaller shape
+            if input_data.shape[:3] != labels.shape[:3]:
+                min_shape = np.minimum(input_data.shape[:3], labels.shape[:3])
+                input_data = input_data[:min_shape[0], :min_shape[1], :min_shape[2]]
+                labels = labels[:min_shape[0], :min_shape[1], :min_shape[2]]
+
+            this_atlas_LUT.columns = ['Index', 'Region']
+            this_atlas_regions = this_atlas_LUT['Region'].values
+            unique_labels = np.unique(labels)
+
+            # skip background if requested, which is the default
+            if ignore_background:
+                unique_labels = unique_labels[unique_labels != background_value]
+
+            # Iterate over each unique label and extract voxel values
+            for i, lab in enumerate(unique_labels):
+                lab = int(lab)
+                mask = labels == lab
+                voxels = input_data[mask]
+
+                # Handle 4D (time series) vs 3D
+                if input_data.ndim == 4:
+                    voxels = voxels.reshape(-1, input_data.shape[-1])
+                vals = [s(voxels, axis=0) for s in parc_stat]
+
+                # One row per summary statistic
+                this_lab_df = pd.DataFrame({
+                    'stat': [s.__name__ for s in parc_stat],
+                    'value': vals
+                })
+
+                this_atlas_region_full = this_atlas_regions[i]
+
+                # Infer hemisphere from region name suffix
+                this_hemi = 'B'
+                if this_atlas_region_full.endswith(('_lh', '-lh', '-L', '_L', '_l', '_LH')):
+                    this_hemi = 'L'
+                elif this_atlas_region_full.endswith(('_rh', '-rh', '-R', '_R', '_r', '_RH')):
+                    this_hemi = 'R'
+                elif 'vermis' in this_atlas_region_full:
+                    this_hemi = 'V'
+
+                # Strip hemisphere suffix to get the clean region name
+                this_region_clean = re.sub(r'(_lh|-lh|-L|_L|_l|_LH|_rh|-rh|-R|_R|_r|_RH|-vermis)$', '', this_atlas_region_full)
+
+                # Add region/atlas metadata to the dataframe
+                this_lab_df['Atlas'] = this_atlas
+                this_lab_df['Functional_Map'] = func_name
+                this_lab_df['region'] = this_region_clean
+                this_lab_df['Hemisphere'] = this_hemi
+                this_lab_df['Region_Index'] = lab
+
+                results_df_list.append(this_lab_df)
+
+    # Concatenate results from all atlases into a single DataFrame
+    return pd.concat(results_df_list, ignore_index=True)
+
+def weighted_roi_means(input_vol, atlas_space='MNI152NLin6Asym', interpolation='linear'):
+    """
+    Mean of each Brainstem_Navigator ROI, weighting every voxel by its (resampled) ROI value,
+    with one resampling and one reduction per ROI file.
+
+    Returns an array of shape (n_rois,) or (n_rois, T), with NaN for ROIs that miss the input grid.
+    """
+    input_data = input_vol.get_fdata()
+    atlas_dir = files("subcortex_visualization.atlases").joinpath(f"{atlas_space}/Brainstem_Navigator")
+    means = []
+    for nifti_path in sorted(f for f in atlas_dir.iterdir() if f.name.endswith('.nii.gz')):
+        roi_vol = nib.load(nifti_path)
+        if not np.allclose(input_vol.affine, roi_vol.affine) or roi_vol.shape[:3] != input_data.shape[:3]:
+            # Resample the ROI as floats, so that interpolation gives partial-volume fractions
+            roi_vol = nib.Nifti1Image(roi_vol.get_fdata(), roi_vol.affine)
+            roi_vol = resample_img(roi_vol, target_affine=input_vol.affine, target_shape=input_data.shape[:3],
+                                   interpolation=interpolation, force_resample=True, copy_header=True)
+        roi_data = roi_vol.get_fdata()
+        mask = roi_data != 0
+        if not mask.any():
+            means.append(np.full(input_data.shape[3:], np.nan))
+            continue
+        means.append(np.average(input_data[mask], axis=0, weights=roi_data[mask]))
+    return np.array(means)
+
+def assert_results_equal(results_df, expected_df, rtol=1e-9, atol=1e-9):
+    """
+    Assert that two parcel_segstats results have the same rows, labels and (to tolerance) values.
+    """
+    assert list(results_df.columns) == list(expected_df.columns)
+    assert len(results_df) == len(expected_df)
+    for column in results_df.columns:
+        if column == 'value':
+            for value, expected in zip(results_df[column], expected_df[column]):
+                np.testing.assert_allclose(np.asarray(value, dtype=float), np.asarray(expected, dtype=float),
+                                           rtol=rtol, atol=atol)
+        else:
+            np.testing.assert_array_equal(results_df[column].astype(str).values, expected_df[column].astype(str).values)
+
+def svg_geometry(svg_filename):
+    """
+    Parse an SVG file as the plotting helpers did for every region of every render.
+
+    Returns its paths (in document order, with their <title> text) and canvas size.
+    """
+    root = ET.parse(svg_filename).getroot()
+    ns = 'http://www.w3.org/2000/svg'
+
+    paths, titles = [], []
+    for path_el in root.findall(f'.//{{{ns}}}path'):
+        d = path_el.get('d', '')
+        if not d:
+            continue
+        paths.append(parse_path(d))
+        titles.append(next((child.text for child in path_el if child.tag.endswith('title')), None))
+
+    return {
+        'paths': paths,
+        'titles': titles,
+        'canvas': tuple(float(re.match(r'([\d.]+)', root.get(dim, '500')).group(1)) for dim in ('width', 'height')),
+    }
+
+def add_region_patches(ax, paths, path_rows, styles, line_color, zorders, backing=None, autolim=False):
+    """
+    Draw region paths as the plotting helpers did, one PathPatch per path.
+
+    Takes the arguments of ``plotting._add_region_collection``; ``autolim`` is ignored, since
+    ``ax.add_patch`` always extends the data limits.
+    """
+    for i, mpl_path in enumerate(paths):
+        if backing is not None and backing[i]:
+            patch = PathPatch(mpl_path, facecolor=styles['base_color'], edgecolor='none',
+                              linewidth=0, zorder=zorders[i])
+        else:
+            patch = PathPatch(mpl_path, facecolor=tuple(styles['facecolors'][path_rows[i]]),
+                              edgecolor=line_color, linewidth=styles['linewidths'][path_rows[i]],
+                              zorder=zorders[i])
+        ax.add_patch(patch)
+
+# Default colours of the SUIT cerebellar lobules, keyed by (region, 'vermis' or 'LR')
+SUIT_COLOR_LOOKUP = {
+    ('IV',      'LR'):     '#beff00',
+    ('V',       'LR'):     '#00ea43',
+    ('VI',      'LR'):     '#0068ff',
+    ('VI',      'vermis'): '#0054d4',
+    ('Crus_I',  'LR'):     '#df00ff',
+    ('Crus_II', 'LR'):     '#ff0000',
+    ('Crus_II', 'vermis'): '#df0000',
+    ('VIIb',    'LR'):     '#ff9300',
+    ('VIIb',    'vermis'): '#c86b00',
+    ('VIIIa',   'LR'):     '#00ff00',
+    ('VIIIa',   'vermis'): '#00d000',
+    ('VIIIb',   'LR'):     '#00ffff',
+    ('VIIIb',   'vermis'): '#00d0ce',
+    ('IX',      'LR'):     '#3900ff',
+    ('IX',      'vermis'): '#2e00d5',
+    ('X',       'LR'):     '#ff009d',
+    ('X',       'vermis'): '#df007c',
+}
+
+def region_color(color_lookup, row, cmap, subcortex_data=None, value_column='value', norm=None,
+                 NA_fill="#cccccc", fill_by_significance=False,
+                 nonsig_fill_alpha=0.5, fill_alpha=1.0, is_cerebellum=False,
+                 line_thickness=1.5):
+    """
+    Style one atlas region as the plotting helpers did, one ordering row at a time.
+
+    Returns its RGBA fill colour, backing colour (or None) and outline thickness.
+    """
+    # Determine colour
+    if subcortex_data is None:
+        if is_cerebellum:
+            hemi_type = 'vermis' if row['hemisphere'] == 'V' else 'LR'
+            this_region_color = SUIT_COLOR_LOOKUP.get((row['region'], hemi_type), NA_fill)
+        else:
+            this_region_color = color_lookup[row['region']]
+    else:
+        val = row[value_column]
+        this_region_color = cmap(norm(val)) if not pd.isnull(val) else NA_fill
+
+    # Adjust alpha based on p-value
+    if fill_by_significance:
+        this_region_pval = row['p_value'] if 'p_value' in row.index else np.nan
+        this_fill_alpha = nonsig_fill_alpha if pd.notnull(this_region_pval) and this_region_pval >= 0.05 else fill_alpha
+        base_color = 'white'
+    else:
+        this_fill_alpha = fill_alpha
+        base_color = None
+
+    # Take line thickness from a column, or reduce the constant for non-significant regions
+    if isinstance(line_thickness, str):
+        this_line_thickness = row[line_thickness] if line_thickness in row.index else 1.5
+    elif fill_by_significance:
+        this_line_thickness = 0.25*line_thickness if pd.notnull(this_region_pval) and this_region_pval >= 0.05 else line_thickness
+    else:
+        this_line_thickness = line_thickness
+
+    this_region_color = mcolors.to_rgba(this_region_color, alpha=this_fill_alpha)
+
+    return this_region_color, base_color, this_line_thickness
+
+def svg_paths_by_title(svg_filename):
+    """
+    Match paths to titles in a composite SVG file as the cerebellum helper did, scanning every
+    path's children for a <title>.
+
+    Returns a mapping of title to its parsed paths, in document order.
+    """
+    ns = {'svg': 'http://www.w3.org/2000/svg'}
+    paths_by_title = {}
+    for path in ET.parse(svg_filename).getroot().findall('.//svg:path', ns):
+        for child in path:
+            if child.tag.endswith('title'):
+                paths_by_title.setdefault(child.text, []).append(parse_path(path.attrib['d']))
+    return paths_by_title
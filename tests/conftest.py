@@ -0,0 +1,28 @@
+import pytest
+
+def pytest_addoption(parser):
+    parser.addoption('--run-benchmarks', action='store_true', default=False,
+                     help="Run the timing comparisons marked 'benchmark' and report their speedups.")
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption('--run-benchmarks'):
+        return
+    skip_benchmark = pytest.mark.skip(reason="timing comparison; run with --run-benchmarks")
+    for item in items:
+        if 'benchmark' in item.keywords:
+            item.add_marker(skip_benchmark)
+
+@pytest.fixture(scope='session')
+def benchmark_report(request):
+    """Collect one line per benchmark, printed in the terminal summary."""
+    lines = request.config.stash.setdefault(_REPORT_KEY, [])
+    return lines.append
+
+_REPORT_KEY = pytest.StashKey()
+
+def pytest_terminal_summary(terminalreporter, config):
+    lines = config.stash.get(_REPORT_KEY, [])
+    if lines:
+        terminalreporter.section('benchmarks')
+        for line in lines:
+            terminalreporter.write_line(line)
@@ -0,0 +1,281 @@
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+
+import numpy as np
+import nibabel as nib
+import pytest
+
+from subcortex_visualization import atlas_cache
+from subcortex_visualization.atlas_cache import (clear_atlas_cache, set_disk_cache, clear_disk_cache,
+                                                 disk_cache_stats, set_atlas_sidecars, clear_atlas_sidecars,
+                                                 create_shared_atlas_store, attach_shared_atlas_store,
+                                                 close_shared_atlas_store, set_input_cache, clear_input_cache,
+                                                 input_cache_stats, set_atlas_cache_limit, atlas_cache_stats)
+from subcortex_visualization import segmentation
+from subcortex_visualization.segmentation import parcel_segstats, build_atlas_sidecars
+
+import baseline
+
+def _coarse_image(seed=0):
+    """A random image on a 2.5mm grid, onto which the atlas has to be resampled."""
+    affine, _ = baseline.atlas_grid('aseg_subcortex')
+    affine = affine.copy()
+    affine[:3, :3] *= 2.5
+    return nib.Nifti1Image(np.random.default_rng(seed).standard_normal((70, 85, 70)), affine)
+
+def _no_resampling(*args, **kwargs):
+    raise AssertionError("the atlas was resampled again")
+
+@pytest.fixture
+def atlas_cache_limit():
+    max_bytes = atlas_cache_stats()['max_bytes']
+    clear_atlas_cache()
+    yield
+    set_atlas_cache_limit(max_bytes)
+    clear_atlas_cache()
+
+def test_atlas_cache_evicts_least_recently_used(atlas_cache_limit):
+    set_atlas_cache_limit(3 * 800)
+    for name in ('a', 'b', 'c'):
+        atlas_cache._cache_put(('test', name), np.zeros(100))
+    assert atlas_cache_stats()['nbytes'] == 3 * 800
+
+    # Using 'a' makes 'b' the least recently used entry, so it is evicted first
+    assert atlas_cache._cache_get(('test', 'a')) is not None
+    atlas_cache._cache_put(('test', 'd'), np.zeros(100))
+    stats = atlas_cache_stats()
+    assert stats['keys'] == [('test', 'c'), ('test', 'a'), ('test', 'd')]
+    assert (stats['entries'], stats['nbytes'], stats['evictions']) == (3, 3 * 800, 1)
+
+    # An entry larger than the limit is not stored, and evicts nothing
+    atlas_cache._cache_put(('test', 'e'), np.zeros(400))
+    stats = atlas_cache_stats()
+    assert ('test', 'e') not in stats['keys']
+    assert (stats['entries'], stats['evictions']) == (3, 1)
+
+def test_set_atlas_cache_limit(atlas_cache_limit):
+    for name in ('a', 'b', 'c'):
+        atlas_cache._cache_put(('test', name), np.zeros(100))
+
+    # Lowering the limit evicts immediately, least recently used first
+    set_atlas_cache_limit(1000)
+    stats = atlas_cache_stats()
+    assert (stats['max_bytes'], stats['keys'], stats['nbytes'], stats['evictions']) == (1000, [('test', 'c')], 800, 2)
+
+    # A limit of 0 disables caching
+    set_atlas_cache_limit(0)
+    assert atlas_cache_stats()['entries'] == 0
+    atlas_cache._cache_put(('test', 'd'), np.zeros(100))
+    assert atlas_cache_stats()['entries'] == 0
+
+    with pytest.raises(ValueError):
+        set_atlas_cache_limit(-1)
+    assert atlas_cache_stats()['max_bytes'] == 0
+
+def test_atlas_cache_stats_count_hits_and_misses(atlas_cache_limit):
+    img = baseline.random_image('aseg_subcortex', seed=86)
+    parcel_segstats(img)
+    first = atlas_cache_stats()
+    assert first['misses'] > 0 and first['entries'] > 0
+
+    # A second call on the same grid is served entirely from the cache
+    parcel_segstats(img)
+    second = atlas_cache_stats()
+    assert second['misses'] == first['misses']
+    assert second['hits'] > first['hits']
+    assert second['entries'] == first['entries']
+
+    clear_atlas_cache()
+    stats = atlas_cache_stats()
+    assert (stats['entries'], stats['nbytes'], stats['hits'], stats['misses'], stats['evictions']) == (0, 0, 0, 0, 0)
+
+@pytest.fixture
+def disk_cache_dir(tmp_path):
+    state = dict(atlas_cache._DISK_CACHE_STATE)
+    set_disk_cache(cache_dir=tmp_path)
+    clear_atlas_cache()
+    yield tmp_path
+    atlas_cache._DISK_CACHE_STATE.update(state)
+    clear_atlas_cache()
+
+@pytest.mark.skipif(os.environ.get('SUBCORTEX_VISUALIZATION_DISK_CACHE') == '1',
+                    reason="disk cache enabled through the environment")
+def test_disk_cache_is_opt_in(disk_cache_dir):
+    assert not disk_cache_stats()['enabled']
+    parcel_segstats(_coarse_image(), interpolation='nearest')
+    assert os.listdir(disk_cache_dir) == []
+
+def test_disk_cache_reuses_resampled_atlas(disk_cache_dir, monkeypatch):
+    set_disk_cache(enabled=True)
+    img = _coarse_image()
+    expected = baseline.parcel_segstats(img, interpolation='nearest')
+
+    first = parcel_segstats(img, interpolation='nearest')
+    assert disk_cache_stats()['entries'] == 1
+
+    # A fresh process-level cache reads the resampled atlas back from disk
+    clear_atlas_cache()
+    monkeypatch.setattr(segmentation, 'resample_img', _no_resampling)
+    second = parcel_segstats(img, interpolation='nearest')
+    assert disk_cache_stats()['entries'] == 1
+
+    baseline.assert_results_equal(first, expected)
+    baseline.assert_results_equal(second, expected)
+
+    clear_disk_cache()
+    assert disk_cache_stats()['entries'] == 0
+
+@pytest.fixture
+def sidecar_dir(tmp_path):
+    state = dict(atlas_cache._SIDECAR_STATE)
+    set_atlas_sidecars(sidecar_dir=tmp_path)
+    clear_atlas_cache()
+    yield tmp_path
+    atlas_cache._SIDECAR_STATE.update(state)
+    clear_atlas_cache()
+
+def _packaged_labels(atlas):
+    volume_path, _ = segmentation._atlas_files(atlas, 'MNI152NLin6Asym')
+    return np.round(nib.load(volume_path).get_fdata())
+
+def test_atlas_sidecars_are_memory_mapped(sidecar_dir):
+    sidecar_paths = build_atlas_sidecars('MNI152NLin6Asym', 'aseg_subcortex')
+    # The full-resolution volume and its 1mm, 2mm and 3mm grids
+    assert len(sidecar_paths) == 4
+    assert all(os.path.isfile(path) for path in sidecar_paths)
+
+    clear_atlas_cache()
+    labels = segmentation._load_atlas('aseg_subcortex', 'MNI152NLin6Asym')['labels']
+    assert isinstance(labels, np.memmap)
+    np.testing.assert_array_equal(labels, _packaged_labels('aseg_subcortex'))
+
+    img = baseline.random_image('aseg_subcortex', seed=80)
+    baseline.assert_results_equal(parcel_segstats(img), baseline.parcel_segstats(img))
+
+def test_atlas_sidecars_written_on_first_use(sidecar_dir):
+    set_atlas_sidecars(enabled=True)
+    segmentation._load_atlas('Melbourne_S1', 'MNI152NLin6Asym')
+    assert len([name for name in os.listdir(sidecar_dir) if name.endswith('.npy')]) == 1
+
+    clear_atlas_cache()
+    assert isinstance(segmentation._load_atlas('Melbourne_S1', 'MNI152NLin6Asym')['labels'], np.memmap)
+
+    clear_atlas_sidecars()
+    assert os.listdir(sidecar_dir) == []
+
+def test_stale_atlas_sidecars_are_ignored(sidecar_dir):
+    key = ('atlas', 'MNI152NLin6Asym', 'Melbourne_S1')
+    volume_path, _ = segmentation._atlas_files('Melbourne_S1', 'MNI152NLin6Asym')
+    digest = atlas_cache._source_digest([volume_path])
+    build_atlas_sidecars('MNI152NLin6Asym', 'Melbourne_S1')
+    array_path, manifest_path = atlas_cache._sidecar_paths(key)
+    assert atlas_cache._sidecar_load(key, digest) is not None
+
+    # Written from other source files
+    assert atlas_cache._sidecar_load(key, 'other digest') is None
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    manifest['digest'] = 'other digest'
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f)
+    clear_atlas_cache()
+    labels = segmentation._load_atlas('Melbourne_S1', 'MNI152NLin6Asym')['labels']
+    assert not isinstance(labels, np.memmap)
+    np.testing.assert_array_equal(labels, _packaged_labels('Melbourne_S1'))
+
+    # Corrupt data of the right size is only caught when verified
+    build_atlas_sidecars('MNI152NLin6Asym', 'Melbourne_S1')
+    with open(array_path, 'r+b') as f:
+        f.seek(-1, os.SEEK_END)
+        f.write(b'\xff')
+    assert atlas_cache._sidecar_load(key, digest) is not None
+    assert atlas_cache._sidecar_load(key, digest, verify=True) is None
+    build_atlas_sidecars('MNI152NLin6Asym', 'Melbourne_S1', verify=True)
+    assert atlas_cache._sidecar_load(key, digest, verify=True) is not None
+
+def _no_atlas_loading(*args, **kwargs):
+    raise AssertionError("the atlas was loaded instead of read from the shared store")
+
+def _shared_store_worker(item):
+    name, input_path = item
+    attach_shared_atlas_store(name)
+    segmentation._load_atlas = _no_atlas_loading
+    try:
+        return parcel_segstats(input_path, parc_stat=[np.mean, np.std])
+    finally:
+        close_shared_atlas_store()
+
+def test_shared_atlas_store_serves_worker_processes(tmp_path):
+    input_path = str(tmp_path / 'input.nii.gz')
+    nib.save(baseline.random_image('aseg_subcortex', seed=81), input_path)
+    expected = baseline.parcel_segstats(input_path, parc_stat=[np.mean, np.std])
+
+    clear_atlas_cache()
+    parcel_segstats(input_path)
+    name = create_shared_atlas_store()
+    try:
+        # A process attaching on its own exits without removing the block
+        subprocess.run([sys.executable, '-c', f"from subcortex_visualization.atlas_cache import attach_shared_atlas_store; attach_shared_atlas_store({name!r})"],
+                       check=True, cwd=os.path.dirname(os.path.dirname(segmentation.__file__)))
+
+        with multiprocessing.get_context('spawn').Pool(2) as pool:
+            for results in pool.map(_shared_store_worker, [(name, input_path)] * 2):
+                baseline.assert_results_equal(results, expected)
+        baseline.assert_results_equal(parcel_segstats(input_path, parc_stat=[np.mean, np.std]), expected)
+    finally:
+        close_shared_atlas_store(unlink=True)
+        clear_atlas_cache()
+
+    with pytest.raises(FileNotFoundError):
+        attach_shared_atlas_store(name)
+
+@pytest.fixture
+def input_cache():
+    state = {key: atlas_cache._INPUT_CACHE_STATE[key] for key in ('enabled', 'max_bytes')}
+    set_input_cache(enabled=True)
+    clear_input_cache()
+    yield
+    clear_input_cache()
+    set_input_cache(**state)
+
+def test_input_cache_reuses_decoded_inputs(input_cache, tmp_path):
+    input_path = str(tmp_path / 'input.nii.gz')
+    nib.save(baseline.random_image('Melbourne_S1', n_volumes=2, seed=82), input_path)
+
+    for atlas in ('Melbourne_S1', 'Melbourne_S2', 'Melbourne_S3'):
+        results = parcel_segstats(input_path, atlas=atlas, parc_stat=[np.mean, np.max])
+        baseline.assert_results_equal(results, baseline.parcel_segstats(input_path, atlas=atlas, parc_stat=[np.mean, np.max]))
+    stats = input_cache_stats()
+    assert (stats['entries'], stats['hits'], stats['misses']) == (1, 2, 1)
+
+    # A rewritten file is decoded again
+    nib.save(baseline.random_image('Melbourne_S1', n_volumes=2, seed=83), input_path)
+    os.utime(input_path, ns=(0, 0))
+    results = parcel_segstats(input_path, atlas='Melbourne_S1')
+    baseline.assert_results_equal(results, baseline.parcel_segstats(input_path, atlas='Melbourne_S1'))
+    assert input_cache_stats()['misses'] == 2
+
+def test_input_cache_skips_large_inputs(input_cache, tmp_path):
+    set_input_cache(max_bytes=1024)
+    input_path = str(tmp_path / 'input.nii.gz')
+    nib.save(baseline.random_image('Melbourne_S1', seed=84), input_path)
+    results = parcel_segstats(input_path, atlas='Melbourne_S1')
+    baseline.assert_results_equal(results, baseline.parcel_segstats(input_path, atlas='Melbourne_S1'))
+    assert input_cache_stats()['entries'] == 0
+
+def test_array_inputs_match_images(tmp_path):
+    img = baseline.random_image('aseg_subcortex', n_volumes=2, seed=85)
+    expected = baseline.parcel_segstats(img, parc_stat=[np.mean, np.std])
+
+    data = np.asarray(img.dataobj)
+    baseline.assert_results_equal(parcel_segstats(data, affine=img.affine, parc_stat=[np.mean, np.std]), expected)
+
+    mapped = np.lib.format.open_memmap(str(tmp_path / 'input.npy'), mode='w+', dtype=data.dtype, shape=data.shape)
+    mapped[...] = data
+    baseline.assert_results_equal(parcel_segstats(mapped, affine=img.affine, parc_stat=[np.mean, np.std]), expected)
+
+    with pytest.raises(ValueError):
+        parcel_segstats(data)
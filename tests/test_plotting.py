@@ -0,0 +1,250 @@
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import matplotlib.colors as mcolors
+from matplotlib.patches import PathPatch, Rectangle
+from matplotlib.path import Path as MplPath
+from matplotlib.transforms import Affine2D
+import numpy as np
+import pandas as pd
+import pytest
+
+from importlib.resources import files
+
+from subcortex_visualization import plotting
+from subcortex_visualization.plotting import (plot_subcortical_data, warm_geometry_cache, clear_geometry_cache,
+                                              geometry_cache_stats, set_geometry_cache_limit)
+
+import baseline
+
+DATA_DIR = files("subcortex_visualization").joinpath('data')
+ATLASES = sorted(d.name for d in DATA_DIR.iterdir() if d.is_dir())
+REGION_ATLASES = [atlas for atlas in ATLASES if DATA_DIR.joinpath(atlas).joinpath('vectors').is_dir()]
+
+@pytest.fixture(autouse=True)
+def geometry_cache():
+    clear_geometry_cache()
+    yield
+    clear_geometry_cache()
+    plt.close('all')
+
+def _region_files(atlas):
+    """Yield (region, hemisphere, face, SVG file) for every region drawn in the atlas's bilateral plot."""
+    atlas_ordering = pd.read_csv(DATA_DIR.joinpath(f"{atlas}/{atlas}_both_ordering.csv"))
+    hemi_column = 'Hemisphere' if 'Hemisphere' in atlas_ordering.columns else 'hemisphere'
+    svg_dir = DATA_DIR.joinpath(atlas).joinpath('vectors')
+    for region, hemi, face in atlas_ordering[['region', hemi_column, 'face']].drop_duplicates().itertuples(index=False):
+        svg_name = f"{region}_{face}.svg" if hemi in ('BL', 'BR') else f"{region}_{hemi}_{face}.svg"
+        yield region, hemi, face, str(svg_dir.joinpath(svg_name))
+
+def _path_codes(path):
+    """Codes of a path, filling in the implicit ones of a plain polyline."""
+    if path.codes is not None:
+        return path.codes
+    codes = np.full(len(path.vertices), path.LINETO, dtype=np.uint8)
+    codes[:1] = path.MOVETO
+    return codes
+
+def _assert_paths_equal(paths, expected_paths):
+    assert len(paths) == len(expected_paths)
+    for path, expected in zip(paths, expected_paths):
+        np.testing.assert_array_equal(path.vertices, expected.vertices)
+        np.testing.assert_array_equal(_path_codes(path), _path_codes(expected))
+
+def _render(fig):
+    fig.canvas.draw()
+    pixels = np.asarray(fig.canvas.buffer_rgba()).copy()
+    plt.close(fig)
+    return pixels
+
+def _no_svg_parsing(*args, **kwargs):
+    raise AssertionError("an SVG file was parsed")
+
+@pytest.mark.parametrize('atlas', REGION_ATLASES)
+def test_region_geometry_matches_svg_parsing(atlas, monkeypatch):
+    # Parse the SVGs rather than read the geometry bundle
+    monkeypatch.setattr(plotting, '_load_geometry_bundle', lambda atlas: None)
+    svg_dir = DATA_DIR.joinpath(atlas).joinpath('vectors')
+    for region, hemi, face, svg_filename in _region_files(atlas):
+        geometry = plotting._region_geometry(atlas, svg_dir, region, hemi, face)
+        expected = baseline.svg_geometry(svg_filename)
+        _assert_paths_equal(geometry['paths'], expected['paths'])
+        assert geometry['canvas'] == expected['canvas']
+        vertices = np.concatenate([path.vertices for path in expected['paths']])
+        np.testing.assert_array_equal(geometry['extent'], np.concatenate([vertices.min(axis=0), vertices.max(axis=0)]))
+
+def test_geometry_cache_serves_repeated_renders(monkeypatch):
+    first = _render(plot_subcortical_data(atlas='aseg_subcortex', hemisphere='both', show_figure=False))
+    stats = geometry_cache_stats()
+    assert stats['hits'] == 0 and stats['entries'] == stats['misses'] > 0
+
+    monkeypatch.setattr(plotting, '_file_geometry', _no_svg_parsing)
+    second = _render(plot_subcortical_data(atlas='aseg_subcortex', hemisphere='both', show_figure=False))
+    np.testing.assert_array_equal(second, first)
+    assert geometry_cache_stats()['hits'] == stats['misses']
+
+def test_geometry_cache_limit():
+    assert warm_geometry_cache('Melbourne_S1', hemisphere='L') > 4
+    set_geometry_cache_limit(4)
+    try:
+        assert geometry_cache_stats()['entries'] == 4
+        with pytest.raises(ValueError):
+            set_geometry_cache_limit(-1)
+    finally:
+        set_geometry_cache_limit(4096)
+
+@pytest.mark.parametrize('atlas', ATLASES)
+def test_geometry_bundle_matches_svg_parsing(atlas):
+    # The packaged bundle is in step with the SVG files, so it is used
+    assert plotting._load_geometry_bundle(atlas) is not None
+    for svg_file in plotting._atlas_svg_files(atlas):
+        geometry = plotting._file_geometry(atlas, str(svg_file))
+        expected = baseline.svg_geometry(str(svg_file))
+        _assert_paths_equal(geometry['paths'], expected['paths'])
+        assert geometry['titles'] == expected['titles']
+        assert geometry['canvas'] == expected['canvas']
+
+def test_stale_geometry_bundle_is_ignored(tmp_path, monkeypatch):
+    atlas = 'Melbourne_S1'
+    atlas_dir = tmp_path / 'data' / atlas
+    (atlas_dir / 'vectors').mkdir(parents=True)
+    bundle_name = f"{atlas}_geometry.npz"
+    atlas_dir.joinpath(bundle_name).write_bytes(DATA_DIR.joinpath(atlas).joinpath(bundle_name).read_bytes())
+    for svg_file in plotting._atlas_svg_files(atlas):
+        atlas_dir.joinpath('vectors', svg_file.name).write_bytes(svg_file.read_bytes())
+    monkeypatch.setattr(plotting, 'files', lambda package: tmp_path)
+    assert plotting._load_geometry_bundle(atlas) is not None
+
+    # Edit one SVG in place without changing its size: swap the first two digits of a path
+    svg_file = sorted((atlas_dir / 'vectors').iterdir())[0]
+    svg_text = svg_file.read_text()
+    digits = [i for i, c in enumerate(svg_text[svg_text.index(' d="'):], svg_text.index(' d="')) if c.isdigit()]
+    first, second = next((i, j) for i, j in zip(digits, digits[1:]) if svg_text[i] != svg_text[j])
+    edited = list(svg_text)
+    edited[first], edited[second] = svg_text[second], svg_text[first]
+    svg_file.write_text(''.join(edited))
+
+    clear_geometry_cache()
+    with pytest.warns(UserWarning, match="out of date with its SVG files"):
+        assert plotting._load_geometry_bundle(atlas) is None
+    geometry = plotting._file_geometry(atlas, str(svg_file))
+    _assert_paths_equal(geometry['paths'], baseline.svg_geometry(str(svg_file))['paths'])
+
+@pytest.mark.parametrize('contents', [b'not a zip archive', b''])
+def test_unreadable_geometry_bundle_is_ignored(contents, tmp_path, monkeypatch):
+    atlas = 'Melbourne_S1'
+    atlas_dir = tmp_path / 'data' / atlas
+    (atlas_dir / 'vectors').mkdir(parents=True)
+    atlas_dir.joinpath(f"{atlas}_geometry.npz").write_bytes(contents)
+    for svg_file in plotting._atlas_svg_files(atlas):
+        atlas_dir.joinpath('vectors', svg_file.name).write_bytes(svg_file.read_bytes())
+    monkeypatch.setattr(plotting, 'files', lambda package: tmp_path)
+
+    with pytest.warns(UserWarning, match="Could not load geometry bundle"):
+        assert plotting._load_geometry_bundle(atlas) is None
+    svg_file = sorted((atlas_dir / 'vectors').iterdir())[0]
+    geometry = plotting._file_geometry(atlas, str(svg_file))
+    _assert_paths_equal(geometry['paths'], baseline.svg_geometry(str(svg_file))['paths'])
+
+def test_geometry_bundle_errors_are_not_swallowed(monkeypatch):
+    def _broken_load(path):
+        raise RuntimeError("bug while reading the bundle")
+    monkeypatch.setattr(plotting, '_load_npz', _broken_load)
+    with pytest.raises(RuntimeError, match="bug while reading the bundle"):
+        plotting._load_geometry_bundle('Melbourne_S1')
+
+def _significance_data(atlas, seed=0):
+    """Random values and p-values for every region of an atlas, with one region missing its value."""
+    atlas_ordering = pd.read_csv(DATA_DIR.joinpath(f"{atlas}/{atlas}_both_ordering.csv"))
+    data = (atlas_ordering.rename(columns={'Hemisphere': 'hemisphere'})[['region', 'hemisphere']]
+            .drop_duplicates().reset_index(drop=True))
+    rng = np.random.default_rng(seed)
+    data['value'] = rng.standard_normal(len(data))
+    data['p_value'] = rng.uniform(0, 0.1, len(data))
+    data.loc[0, 'value'] = np.nan
+    return data
+
+@pytest.mark.parametrize('atlas', ['aseg_subcortex', 'Melbourne_S4', 'Brainstem_Navigator',
+                                   'SUIT_cerebellar_lobule', 'Thalamus_THOMAS'])
+@pytest.mark.parametrize('fill_by_significance', [False, True])
+def test_region_collection_matches_patches(atlas, fill_by_significance, monkeypatch):
+    kwargs = dict(subcortex_data=_significance_data(atlas), atlas=atlas, hemisphere='both',
+                  views=['medial', 'lateral', 'superior', 'inferior'],
+                  fill_by_significance=fill_by_significance, show_figure=False)
+    pixels = _render(plot_subcortical_data(**kwargs))
+
+    monkeypatch.setattr(plotting, '_add_region_collection', baseline.add_region_patches)
+    np.testing.assert_array_equal(pixels, _render(plot_subcortical_data(**kwargs)))
+
+def test_region_collections_interleave_with_other_artists():
+    # Overlapping squares at z-orders 1, 3 and 4, with another artist at z-order 2 between them
+    paths = [MplPath.unit_rectangle().transformed(Affine2D().translate(x, 0)) for x in (0, 0.5, 1, 1.5, 0.75)]
+    styles = {'facecolors': np.array([mcolors.to_rgba(c) for c in ('red', 'green', 'blue', 'orange', 'cyan')]),
+              'linewidths': np.array([1.0, 2.0, 3.0, 4.0, 5.0]), 'base_color': '#cccccc'}
+    zorders = [3, 1, 3, 1, 4]
+
+    def _draw(add_regions):
+        fig, ax = plt.subplots()
+        ax.set_xlim(-0.5, 3)
+        ax.set_ylim(-0.5, 1.5)
+        ax.add_patch(Rectangle((0.25, 0.25), 2, 0.5, facecolor='purple', zorder=2))
+        collections = add_regions(ax, paths, [0, 1, 2, 3, 4], styles, 'black', zorders,
+                                  backing=[False, True, False, False, False])
+        return fig, collections
+
+    fig, collections = _draw(plotting._add_region_collection)
+    assert [collection.get_zorder() for collection in collections] == [1, 3, 4]
+    assert [len(collection.get_paths()) for collection in collections[:2]] == [2, 2]
+    assert isinstance(collections[2], PathPatch)
+    pixels = _render(fig)
+    np.testing.assert_array_equal(pixels, _render(_draw(baseline.add_region_patches)[0]))
+
+def _styled_ordering(atlas, seed=0):
+    """An atlas's bilateral ordering with random values, p-values (some missing) and line widths."""
+    atlas_ordering = pd.read_csv(DATA_DIR.joinpath(f"{atlas}/{atlas}_both_ordering.csv")).rename(columns={'Hemisphere': 'hemisphere'})
+    rng = np.random.default_rng(seed)
+    n_regions = len(atlas_ordering)
+    atlas_ordering['value'] = np.where(rng.uniform(size=n_regions) < 0.2, np.nan, rng.standard_normal(n_regions))
+    atlas_ordering['p_value'] = np.where(rng.uniform(size=n_regions) < 0.2, np.nan, rng.uniform(0, 0.1, n_regions))
+    atlas_ordering['thickness'] = rng.uniform(0.5, 3, n_regions)
+    return atlas_ordering
+
+@pytest.mark.parametrize('atlas', ['Melbourne_S2', 'SUIT_cerebellar_lobule'])
+@pytest.mark.parametrize('with_data', [False, True])
+@pytest.mark.parametrize('fill_by_significance', [False, True])
+@pytest.mark.parametrize('line_thickness', [1.5, 'thickness', 'missing_column'])
+@pytest.mark.parametrize('fill_alpha', [1.0, 0.7, None])
+def test_region_styles_match_per_row_colours(atlas, with_data, fill_by_significance, line_thickness, fill_alpha):
+    atlas_ordering = _styled_ordering(atlas)
+    is_cerebellum = atlas == 'SUIT_cerebellar_lobule'
+    color_lookup = {region: plt.get_cmap('tab20')(i % 20) for i, region in enumerate(atlas_ordering['region'].unique())}
+    cmap = plt.get_cmap('viridis')
+    for norm in [matplotlib.colors.Normalize(vmin=-2, vmax=2), matplotlib.colors.TwoSlopeNorm(vcenter=0, vmin=-3, vmax=1)]:
+        kwargs = dict(color_lookup=color_lookup, cmap=cmap, subcortex_data=atlas_ordering if with_data else None,
+                      norm=norm, fill_by_significance=fill_by_significance, nonsig_fill_alpha=0.3,
+                      fill_alpha=fill_alpha, is_cerebellum=is_cerebellum, line_thickness=line_thickness)
+        styles = plotting._region_styles(atlas_ordering, **kwargs)
+        expected = [baseline.region_color(row=row, **kwargs) for _, row in atlas_ordering.iterrows()]
+        np.testing.assert_array_equal(styles['facecolors'], np.array([color for color, _, _ in expected]))
+        np.testing.assert_array_equal(styles['linewidths'], np.array([width for _, _, width in expected], dtype=float))
+        assert all(styles['base_color'] == base_color for _, base_color, _ in expected)
+
+COMPOSITE_ATLASES = [atlas for atlas in ATLASES if atlas not in REGION_ATLASES]
+
+@pytest.mark.parametrize('atlas', COMPOSITE_ATLASES)
+def test_composite_title_index_matches_title_scan(atlas):
+    for svg_file in plotting._atlas_svg_files(atlas):
+        geometry = plotting._composite_geometry(atlas, str(svg_file))
+        expected = baseline.svg_paths_by_title(str(svg_file))
+        assert set(geometry['title_index']) == set(expected)
+        for title, expected_paths in expected.items():
+            _assert_paths_equal([geometry['paths'][i] for i in geometry['title_index'][title]], expected_paths)
+
+def test_cerebellum_plot_reuses_composite_geometry(monkeypatch):
+    # The flatmap is read from its geometry bundle, then from the composite cache
+    monkeypatch.setattr(plotting, '_parse_svg_file', _no_svg_parsing)
+    first = _render(plot_subcortical_data(atlas='SUIT_cerebellar_lobule', hemisphere='both', show_figure=False))
+
+    monkeypatch.setattr(plotting, '_file_geometry', _no_svg_parsing)
+    second = _render(plot_subcortical_data(atlas='SUIT_cerebellar_lobule', hemisphere='both', show_figure=False))
+    np.testing.assert_array_equal(second, first)
@@ -0,0 +1,88 @@
+import numpy as np
+import nibabel as nib
+import pytest
+
+from subcortex_visualization import segment_stats
+from subcortex_visualization.segment_stats import register_segment_stat, percentile_stat
+from subcortex_visualization.segmentation import parcel_segstats
+
+import baseline
+
+ATLAS_SPACE = 'MNI152NLin6Asym'
+NAN_STATS = [np.nanmean, np.nanstd, np.nanvar, np.nansum, np.nanmin, np.nanmax, np.nanmedian]
+
+def _image_with_nans(atlas, n_volumes=None, seed=0):
+    img = baseline.random_image(atlas, ATLAS_SPACE, n_volumes=n_volumes, seed=seed)
+    data = np.asarray(img.dataobj).copy()
+    data[np.random.default_rng(seed).random(data.shape) < 0.2] = np.nan
+    return nib.Nifti1Image(data, img.affine)
+
+def _value_range(x, axis=0):
+    return np.max(x, axis=axis) - np.min(x, axis=axis)
+
+@pytest.fixture
+def stat_registry(monkeypatch):
+    # Registrations made by a test do not leak into the others
+    monkeypatch.setattr(segment_stats, '_SEGMENT_STATS', dict(segment_stats._SEGMENT_STATS))
+    monkeypatch.setattr(segment_stats, '_SEGMENT_KERNELS', dict(segment_stats._SEGMENT_KERNELS))
+
+@pytest.mark.parametrize('n_volumes', [None, 3])
+def test_nan_statistics_match_per_parcel_loop(n_volumes):
+    img = _image_with_nans('Melbourne_S3', n_volumes=n_volumes, seed=50)
+    results = parcel_segstats(img, atlas_space=ATLAS_SPACE, atlas='Melbourne_S3', parc_stat=NAN_STATS)
+    expected = baseline.parcel_segstats(img, atlas_space=ATLAS_SPACE, atlas='Melbourne_S3', parc_stat=NAN_STATS)
+    baseline.assert_results_equal(results, expected)
+
+def test_unregistered_statistic_falls_back_to_per_parcel_calls():
+    img = baseline.random_image('aseg_subcortex', ATLAS_SPACE, n_volumes=2, seed=51)
+    results = parcel_segstats(img, atlas_space=ATLAS_SPACE, parc_stat=[np.mean, _value_range])
+    expected = baseline.parcel_segstats(img, atlas_space=ATLAS_SPACE, parc_stat=[np.mean, _value_range])
+    baseline.assert_results_equal(results, expected)
+
+def test_registered_statistic_uses_its_kernel(stat_registry):
+    kernel_calls = []
+
+    def _range_kernel(voxels, offsets):
+        kernel_calls.append(len(offsets) - 1)
+        starts = offsets[:-1]
+        return np.maximum.reduceat(voxels, starts, axis=0) - np.minimum.reduceat(voxels, starts, axis=0)
+
+    def value_range(x, axis=0):
+        raise AssertionError("a registered statistic should not be called per parcel")
+
+    assert register_segment_stat(value_range, _range_kernel) is value_range
+
+    img = baseline.random_image('Melbourne_S2', ATLAS_SPACE, n_volumes=3, seed=52)
+    results = parcel_segstats(img, atlas_space=ATLAS_SPACE, atlas='Melbourne_S2', parc_stat=[value_range, np.std])
+    expected = baseline.parcel_segstats(img, atlas_space=ATLAS_SPACE, atlas='Melbourne_S2', parc_stat=[_value_range, np.std])
+    expected['stat'] = expected['stat'].replace('_value_range', 'value_range')
+    baseline.assert_results_equal(results, expected)
+    assert kernel_calls == [32]
+
+def test_builtin_statistics_cannot_be_replaced(stat_registry):
+    with pytest.raises(ValueError):
+        register_segment_stat(np.mean, lambda voxels, offsets: None, name='mean')
+
+@pytest.mark.parametrize('n_volumes', [None, 3])
+def test_percentiles_match_per_parcel_loop(n_volumes):
+    stats = [np.median, percentile_stat(5), percentile_stat(37.5), percentile_stat(95), percentile_stat(100)]
+    img = baseline.random_image('Melbourne_S4', ATLAS_SPACE, n_volumes=n_volumes, seed=53)
+    results = parcel_segstats(img, atlas_space=ATLAS_SPACE, atlas='Melbourne_S4', parc_stat=stats)
+    expected = baseline.parcel_segstats(img, atlas_space=ATLAS_SPACE, atlas='Melbourne_S4', parc_stat=stats)
+    baseline.assert_results_equal(results, expected)
+    assert list(results['stat'].cat.categories) == ['median', 'percentile_5', 'percentile_37.5', 'percentile_95',
+                                                    'percentile_100']
+
+@pytest.mark.parametrize('n_volumes', [None, 3])
+def test_nan_percentiles_match_per_parcel_loop(n_volumes):
+    stats = [np.nanmedian, percentile_stat(10, nan=True), percentile_stat(90, nan=True)]
+    img = _image_with_nans('Brainstem_Navigator', n_volumes=n_volumes, seed=54)
+    results = parcel_segstats(img, atlas_space=ATLAS_SPACE, atlas='Brainstem_Navigator', parc_stat=stats)
+    expected = baseline.parcel_segstats(img, atlas_space=ATLAS_SPACE, atlas='Brainstem_Navigator', parc_stat=stats)
+    baseline.assert_results_equal(results, expected)
+
+def test_percentile_stat_is_reused_and_validated():
+    assert percentile_stat(95) is percentile_stat(95.0)
+    assert percentile_stat(95) is not percentile_stat(95, nan=True)
+    with pytest.raises(ValueError):
+        percentile_stat(101)
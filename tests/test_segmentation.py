@@ -0,0 +1,639 @@
+import multiprocessing
+import time
+
+import numpy as np
+import nibabel as nib
+import pandas as pd
+import pytest
+
+from importlib.resources import files
+
+from subcortex_visualization import segmentation
+from subcortex_visualization.atlas_cache import clear_atlas_cache
+from subcortex_visualization.segmentation import (parcel_segstats, iter_parcel_segstats, parcel_timeseries, parcel_segstats_batch,
+                                                  parcel_segstats_stacked, melbourne_nesting_maps,
+                                                  build_brainstem_navigator_index,
+                                                  _read_block)
+
+import baseline
+
+ATLAS_SPACE = 'MNI152NLin6Asym'
+ATLASES = sorted(d.name for d in files("subcortex_visualization.atlases").joinpath(ATLAS_SPACE).iterdir()
+                 if d.is_dir() and not d.name.startswith('__'))
+STATS = [np.mean, np.std, np.median, np.min, np.max, np.sum, np.var, np.size]
+
+@pytest.mark.parametrize('atlas', ATLASES)
+def test_parcel_segstats_matches_per_parcel_loop_3d(atlas):
+    img = baseline.random_image(atlas, ATLAS_SPACE, seed=1)
+    results = parcel_segstats(img, atlas_space=ATLAS_SPACE, atlas=atlas, parc_stat=STATS)
+    expected = baseline.parcel_segstats(img, atlas_space=ATLAS_SPACE, atlas=atlas, parc_stat=STATS)
+    baseline.assert_results_equal(results, expected)
+
+@pytest.mark.parametrize('atlas', ATLASES)
+def test_parcel_segstats_matches_per_parcel_loop_4d(atlas):
+    img = baseline.random_image(atlas, ATLAS_SPACE, n_volumes=3, seed=2)
+    results = parcel_segstats(img, atlas_space=ATLAS_SPACE, atlas=atlas, parc_stat=STATS)
+    expected = baseline.parcel_segstats(img, atlas_space=ATLAS_SPACE, atlas=atlas, parc_stat=STATS)
+    baseline.assert_results_equal(results, expected)
+
+def _best_time(func, repeats=3):
+    """Shortest wall-clock time of ``repeats`` calls to ``func``."""
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize('atlas', ATLASES)
+def test_parcel_segstats_speedup_over_per_parcel_loop(atlas, benchmark_report):
+    img = baseline.random_image(atlas, ATLAS_SPACE, seed=3)
+    # Warm the atlas cache so that only extraction is timed
+    parcel_segstats(img, atlas_space=ATLAS_SPACE, atlas=atlas)
+
+    elapsed = _best_time(lambda: parcel_segstats(img, atlas_space=ATLAS_SPACE, atlas=atlas, parc_stat=STATS))
+    elapsed_loop = _best_time(lambda: baseline.parcel_segstats(img, atlas_space=ATLAS_SPACE, atlas=atlas, parc_stat=STATS))
+    benchmark_report(f"parcel_segstats {atlas}: {elapsed_loop * 1e3:.1f} ms -> {elapsed * 1e3:.1f} ms "
+                     f"({elapsed_loop / elapsed:.1f}x)")
+
+@pytest.mark.parametrize('atlas_space', ['MNI152NLin6Asym', 'MNI152NLin2009cAsym'])
+def test_brainstem_navigator_index_matches_roi_files(atlas_space, tmp_path):
+    atlas_dir = files("subcortex_visualization.atlases").joinpath(f"{atlas_space}/Brainstem_Navigator")
+    nifti_files = sorted(f for f in atlas_dir.iterdir() if f.name.endswith('.nii.gz'))
+
+    output_path = build_brainstem_navigator_index(atlas_space, output_path=str(tmp_path / 'index.npz'))
+    stored = np.load(output_path)
+    offsets = stored['offsets']
+    assert [str(name) for name in stored['roi_names']] == [f.name.replace('.nii.gz', '') for f in nifti_files]
+    for roi_idx, nifti_path in enumerate(nifti_files):
+        roi_data = np.asanyarray(nib.load(nifti_path).dataobj)
+        roi_index = np.flatnonzero(roi_data)
+        np.testing.assert_array_equal(stored['index'][offsets[roi_idx]:offsets[roi_idx + 1]], roi_index)
+        np.testing.assert_array_equal(stored['values'][offsets[roi_idx]:offsets[roi_idx + 1]],
+                                      roi_data.ravel()[roi_index].astype(np.float32))
+
+    # The packaged index is built from the current ROI files, and so is used instead of decoding them
+    packaged = np.load(atlas_dir.joinpath('Brainstem_Navigator_index.npz'))
+    assert str(packaged['fingerprint']) == str(stored['fingerprint'])
+    for name in ('index', 'offsets', 'values'):
+        np.testing.assert_array_equal(packaged[name], stored[name])
+
+def test_stale_brainstem_navigator_index_is_ignored(monkeypatch):
+    img = baseline.random_image('Brainstem_Navigator', ATLAS_SPACE, seed=14)
+    expected = baseline.parcel_segstats(img, atlas_space=ATLAS_SPACE, atlas='Brainstem_Navigator', parc_stat=[np.mean, np.size])
+
+    # ROI files that no longer match the packaged index are decoded instead, with a warning
+    monkeypatch.setattr(segmentation, '_source_fingerprint', lambda paths: 'stale')
+    clear_atlas_cache()
+    try:
+        with pytest.warns(UserWarning, match="ROI index .* is out of date"):
+            results = parcel_segstats(img, atlas_space=ATLAS_SPACE, atlas='Brainstem_Navigator', parc_stat=[np.mean, np.size])
+    finally:
+        clear_atlas_cache()
+    baseline.assert_results_equal(results, expected)
+
+def test_resampled_brainstem_rois_match_resampled_roi_files():
+    # A 2.5 mm grid, off the standard grids, so that every ROI is linearly resampled
+    affine = np.diag([-2.5, 2.5, 2.5, 1.0])
+    affine[:3, 3] = [30, -60, -60]
+    img = nib.Nifti1Image(np.random.default_rng(13).standard_normal((25, 30, 30)), affine)
+    results = parcel_segstats(img, atlas_space=ATLAS_SPACE, atlas='Brainstem_Navigator', parc_stat=[np.mean, np.sum, np.size], interpolation='linear')
+    expected = baseline.parcel_segstats(img, atlas_space=ATLAS_SPACE, atlas='Brainstem_Navigator', parc_stat=[np.mean, np.sum, np.size], interpolation='linear')
+    baseline.assert_results_equal(results, expected)
+
+def test_mismatched_affines_warn_before_resampling():
+    # A grid rotated about the z axis cannot be mapped onto the atlas by index arithmetic
+    angle = np.deg2rad(10)
+    affine, shape = baseline.atlas_grid('aseg_subcortex', ATLAS_SPACE)
+    rotation = np.eye(4)
+    rotation[:2, :2] = [[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]]
+    img = nib.Nifti1Image(np.random.default_rng(15).standard_normal(shape), rotation @ affine)
+    with pytest.warns(UserWarning, match="Affines of input data and atlas do not match"):
+        results = parcel_segstats(img, atlas_space=ATLAS_SPACE, atlas='aseg_subcortex', parc_stat=[np.mean, np.size],
+                                  interpolation='nearest')
+    expected = baseline.parcel_segstats(img, atlas_space=ATLAS_SPACE, atlas='aseg_subcortex', parc_stat=[np.mean, np.size],
+                                        interpolation='nearest')
+    baseline.assert_results_equal(results, expected)
+
+class _RecordingProxy:
+    """Array proxy that records every slice read from it, and fails on a whole-image read."""
+    is_proxy = True
+
+    def __init__(self, data):
+        self.data = data
+        self.shape = data.shape
+        self.dtype = data.dtype
+        self.ndim = data.ndim
+        self.reads = []
+
+    def __getitem__(self, slices):
+        self.reads.append(slices)
+        return self.data[slices]
+
+    def __array__(self, dtype=None, copy=None):
+        raise AssertionError("the whole image was read")
+
+def test_read_block_matches_full_volume():
+    img = baseline.random_image('aseg_subcortex', ATLAS_SPACE, n_volumes=4, seed=4)
+    full_data = img.get_fdata()
+    lo, hi = np.array([10, 20, 30]), np.array([40, 45, 50])
+    np.testing.assert_array_equal(_read_block(img, lo, hi), full_data[10:40, 20:45, 30:50])
+    np.testing.assert_array_equal(_read_block(img, lo, hi, volumes=slice(1, 3)), full_data[10:40, 20:45, 30:50, 1:3])
+    assert _read_block(img, lo, hi, dtype=np.float32).dtype == np.float32
+
+@pytest.mark.parametrize('atlas', ['aseg_subcortex', 'Brainstem_Navigator'])
+def test_parcel_segstats_reads_only_the_atlas_bounding_box(atlas):
+    img = baseline.random_image(atlas, ATLAS_SPACE, seed=5)
+    proxy = _RecordingProxy(np.asarray(img.dataobj))
+    proxy_img = nib.Nifti1Image(proxy, img.affine)
+
+    results = parcel_segstats(proxy_img, atlas_space=ATLAS_SPACE, atlas=atlas, parc_stat=STATS)
+    expected = baseline.parcel_segstats(img, atlas_space=ATLAS_SPACE, atlas=atlas, parc_stat=STATS)
+    baseline.assert_results_equal(results, expected)
+
+    # Single-voxel reads (e.g. by nibabel to probe the dtype) aside, one block is read
+    block_reads = [slices for slices in proxy.reads if isinstance(slices[0], slice)]
+    assert len(block_reads) == 1
+    block_shape = tuple(s.stop - s.start for s in block_reads[0])
+    assert np.prod(block_shape) < np.prod(img.shape)
+
+@pytest.mark.parametrize('suffix', ['.nii', '.nii.gz'])
+def test_parcel_segstats_from_file_matches_per_parcel_loop(suffix, tmp_path):
+    img = baseline.random_image('Melbourne_S2', ATLAS_SPACE, n_volumes=2, seed=6)
+    input_path = str(tmp_path / f'input{suffix}')
+    nib.save(img, input_path)
+
+    results = parcel_segstats(input_path, atlas_space=ATLAS_SPACE, atlas='Melbourne_S2', parc_stat=STATS)
+    expected = baseline.parcel_segstats(input_path, atlas_space=ATLAS_SPACE, atlas='Melbourne_S2', parc_stat=STATS)
+    baseline.assert_results_equal(results, expected)
+
+@pytest.mark.parametrize('atlas', ['aseg_subcortex', 'Brainstem_Navigator', 'Melbourne_S4'])
+def test_chunked_parcel_segstats_matches_per_parcel_loop(atlas):
+    img = baseline.random_image(atlas, ATLAS_SPACE, n_volumes=7, seed=7)
+    results = parcel_segstats(img, atlas_space=ATLAS_SPACE, atlas=atlas, parc_stat=STATS, chunk_size=3)
+    expected = baseline.parcel_segstats(img, atlas_space=ATLAS_SPACE, atlas=atlas, parc_stat=STATS)
+    baseline.assert_results_equal(results, expected)
+
+def test_iter_parcel_segstats_chunks_match_per_parcel_loop():
+    atlas = ['Melbourne_S1', 'Melbourne_S2']
+    img = baseline.random_image('Melbourne_S1', ATLAS_SPACE, n_volumes=7, seed=8)
+
+    chunks = list(iter_parcel_segstats(img, atlas_space=ATLAS_SPACE, atlas=atlas, parc_stat=STATS, chunk_size=3))
+    assert [volumes for volumes, _ in chunks] == [slice(0, 3), slice(3, 6), slice(6, 7)]
+    for volumes, results in chunks:
+        expected = baseline.parcel_segstats(img.slicer[..., volumes], atlas_space=ATLAS_SPACE, atlas=atlas,
+                                            parc_stat=STATS)
+        baseline.assert_results_equal(results, expected)
+
+def test_chunk_size_must_be_positive():
+    img = baseline.random_image('aseg_subcortex', ATLAS_SPACE, n_volumes=2, seed=9)
+    with pytest.raises(ValueError):
+        parcel_segstats(img, atlas_space=ATLAS_SPACE, chunk_size=0)
+
+def _loop_timeseries(img, atlas, interpolation=None):
+    """Per-parcel mean time series from the per-parcel loop, one row per parcel."""
+    expected = baseline.parcel_segstats(img, atlas_space=ATLAS_SPACE, atlas=atlas, parc_stat=np.mean,
+                                        interpolation=interpolation)
+    return np.vstack(expected['value'].to_list()), expected
+
+@pytest.mark.parametrize('atlas', ['aseg_subcortex', 'Brainstem_Navigator', ['Melbourne_S1', 'Melbourne_S2']])
+def test_parcel_timeseries_matches_per_parcel_loop(atlas):
+    img = baseline.random_image(atlas if isinstance(atlas, str) else atlas[0], ATLAS_SPACE, n_volumes=5, seed=10)
+    expected, expected_df = _loop_timeseries(img, atlas)
+    np.testing.assert_allclose(parcel_timeseries(img, atlas_space=ATLAS_SPACE, atlas=atlas), expected, rtol=1e-9, atol=1e-12)
+
+    # Array input, read a few volumes at a time, with the long-format results
+    timeseries, results = parcel_timeseries(np.asarray(img.dataobj), affine=img.affine, atlas_space=ATLAS_SPACE,
+                                            atlas=atlas, chunk_size=2, return_df=True)
+    np.testing.assert_allclose(timeseries, expected, rtol=1e-9, atol=1e-12)
+    baseline.assert_results_equal(results, expected_df)
+
+def test_parcel_timeseries_requires_4d_input():
+    with pytest.raises(ValueError):
+        parcel_timeseries(baseline.random_image('aseg_subcortex', ATLAS_SPACE, seed=11), atlas_space=ATLAS_SPACE)
+
+def test_weighted_brainstem_timeseries_match_per_roi_weighted_means():
+    # A 2.5 mm grid, off the standard grids, onto which linear resampling gives fractional ROI weights
+    affine = np.diag([-2.5, 2.5, 2.5, 1.0])
+    affine[:3, 3] = [30, -60, -60]
+    rng = np.random.default_rng(12)
+    img = nib.Nifti1Image(rng.standard_normal((25, 30, 30, 4)), affine)
+
+    timeseries = parcel_timeseries(img, atlas_space=ATLAS_SPACE, atlas='Brainstem_Navigator',
+                                   interpolation='linear', weighted=True)
+    expected = baseline.weighted_roi_means(img, atlas_space=ATLAS_SPACE, interpolation='linear')
+    np.testing.assert_allclose(timeseries, expected, rtol=1e-9, atol=1e-12)
+
+    # Unweighted, every voxel an ROI reaches counts equally
+    unweighted = parcel_timeseries(img, atlas_space=ATLAS_SPACE, atlas='Brainstem_Navigator', interpolation='linear')
+    np.testing.assert_allclose(unweighted, _loop_timeseries(img, 'Brainstem_Navigator', 'linear')[0], rtol=1e-9, atol=1e-12)
+    assert not np.allclose(unweighted, timeseries)
+
+@pytest.mark.parametrize('n_jobs', [1, 2])
+def test_parcel_segstats_batch_matches_per_parcel_loop(n_jobs, tmp_path):
+    atlas = 'aseg_subcortex'
+    input_paths = []
+    for seed in range(3):
+        input_path = str(tmp_path / f'sub-{seed}.nii.gz')
+        nib.save(baseline.random_image(atlas, ATLAS_SPACE, seed=10 + seed), input_path)
+        input_paths.append(input_path)
+    missing_path = str(tmp_path / 'missing.nii.gz')
+
+    results, errors = parcel_segstats_batch(input_paths[:2] + [missing_path] + input_paths[2:],
+                                            atlas_space=ATLAS_SPACE, atlas=atlas, parc_stat=[np.mean, np.std],
+                                            n_jobs=n_jobs)
+
+    assert list(errors['Input']) == [missing_path]
+    assert list(pd.unique(results['Input'])) == input_paths
+    for input_path in input_paths:
+        input_results = results[results['Input'] == input_path].drop(columns='Input').reset_index(drop=True)
+        expected = baseline.parcel_segstats(input_path, atlas_space=ATLAS_SPACE, atlas=atlas, parc_stat=[np.mean, np.std])
+        baseline.assert_results_equal(input_results, expected)
+
+    with pytest.raises(RuntimeError):
+        parcel_segstats_batch([missing_path], atlas_space=ATLAS_SPACE, atlas=atlas, on_error='raise')
+
+def test_parcel_segstats_batch_uses_the_given_context(tmp_path):
+    atlas = 'aseg_subcortex'
+    input_paths = []
+    for seed in range(2):
+        input_path = str(tmp_path / f'sub-{seed}.nii.gz')
+        nib.save(baseline.random_image(atlas, ATLAS_SPACE, seed=16 + seed), input_path)
+        input_paths.append(input_path)
+
+    # Spawned workers inherit nothing from this process, so they load the atlases themselves
+    results, errors = parcel_segstats_batch(input_paths, atlas_space=ATLAS_SPACE, atlas=atlas, n_jobs=2,
+                                            mp_context=multiprocessing.get_context('spawn'))
+    assert errors.empty
+    for input_path in input_paths:
+        input_results = results[results['Input'] == input_path].drop(columns='Input').reset_index(drop=True)
+        baseline.assert_results_equal(input_results, baseline.parcel_segstats(input_path, atlas_space=ATLAS_SPACE, atlas=atlas))
+
+@pytest.mark.skipif('fork' not in multiprocessing.get_all_start_methods(), reason="fork start method unavailable")
+def test_parcel_segstats_batch_captures_unreadable_first_input(tmp_path):
+    # The first input warms the atlas cache before workers are forked; a corrupt one must not abort the batch
+    corrupt_path = str(tmp_path / 'corrupt.nii.gz')
+    with open(corrupt_path, 'wb') as f:
+        f.write(b'not a NIfTI file')
+    input_path = str(tmp_path / 'sub-0.nii.gz')
+    nib.save(baseline.random_image('aseg_subcortex', ATLAS_SPACE, seed=18), input_path)
+
+    fork = multiprocessing.get_context('fork')
+    results, errors = parcel_segstats_batch([corrupt_path, input_path], atlas_space=ATLAS_SPACE, n_jobs=2, mp_context=fork)
+    assert list(errors['Input']) == [corrupt_path]
+    baseline.assert_results_equal(results.drop(columns='Input'), baseline.parcel_segstats(input_path, atlas_space=ATLAS_SPACE))
+
+    with pytest.raises(RuntimeError, match="corrupt.nii.gz"):
+        parcel_segstats_batch([corrupt_path, input_path], atlas_space=ATLAS_SPACE, n_jobs=2, mp_context=fork, on_error='raise')
+
+def test_parcel_segstats_batch_wide_output():
+    atlas = 'Melbourne_S1'
+    imgs = [baseline.random_image(atlas, ATLAS_SPACE, seed=20 + seed) for seed in range(2)]
+    results, _ = parcel_segstats_batch(imgs, atlas_space=ATLAS_SPACE, atlas=atlas, output='wide')
+
+    assert list(results.index) == [0, 1]
+    for position, img in enumerate(imgs):
+        expected = baseline.parcel_segstats(img, atlas_space=ATLAS_SPACE, atlas=atlas)
+        np.testing.assert_allclose(results.loc[position].values.astype(float), expected['value'].values.astype(float))
+        assert list(results.columns.get_level_values('region')) == list(expected['region'])
+
+@pytest.mark.parametrize('chunk_size', [None, 3])
+def test_parcel_segstats_stacked_matches_per_parcel_loop(chunk_size):
+    atlas = ['Melbourne_S1', 'Melbourne_S3']
+    affine, shape = baseline.atlas_grid('Melbourne_S1', ATLAS_SPACE)
+    maps = np.random.default_rng(30).standard_normal((4,) + shape)
+
+    values, regions = parcel_segstats_stacked(maps, affine, atlas_space=ATLAS_SPACE, atlas=atlas, parc_stat=STATS,
+                                              chunk_size=chunk_size)
+
+    assert values.shape[0] == len(maps)
+    for k, map_data in enumerate(maps):
+        expected = baseline.parcel_segstats(nib.Nifti1Image(map_data, affine), atlas_space=ATLAS_SPACE, atlas=atlas,
+                                            parc_stat=STATS)
+        np.testing.assert_allclose(values[k].ravel(), expected['value'].values.astype(float), rtol=1e-9, atol=1e-9)
+        expected_regions = expected[expected['stat'] == 'mean'].reset_index(drop=True)
+        for column in ('Atlas', 'region', 'Hemisphere', 'Region_Index'):
+            np.testing.assert_array_equal(regions[column].astype(str).values, expected_regions[column].astype(str).values)
+
+def _value_range(x, axis=0):
+    return np.max(x, axis=axis) - np.min(x, axis=axis)
+
+def test_parcel_segstats_stacked_with_unregistered_statistics():
+    atlas = 'aseg_subcortex'
+    affine, shape = baseline.atlas_grid(atlas, ATLAS_SPACE)
+    maps = np.random.default_rng(31).standard_normal((3,) + shape)
+    parc_stat = [_value_range, np.size, np.mean]
+
+    values, _ = parcel_segstats_stacked(maps, affine, atlas_space=ATLAS_SPACE, atlas=atlas, parc_stat=parc_stat)
+    for k, map_data in enumerate(maps):
+        expected = baseline.parcel_segstats(nib.Nifti1Image(map_data, affine), atlas_space=ATLAS_SPACE, atlas=atlas,
+                                            parc_stat=parc_stat)
+        np.testing.assert_allclose(values[k].ravel(), expected['value'].values.astype(float), rtol=1e-9, atol=1e-9)
+
+def test_parcel_segstats_stacked_requires_a_stack():
+    affine, shape = baseline.atlas_grid('aseg_subcortex', ATLAS_SPACE)
+    with pytest.raises(ValueError):
+        parcel_segstats_stacked(np.zeros(shape), affine, atlas_space=ATLAS_SPACE)
+
+def test_parcel_segstats_columns_match_per_parcel_loop():
+    atlas = ['Melbourne_S1', 'Melbourne_S2']
+    img = baseline.random_image('Melbourne_S1', ATLAS_SPACE, seed=40)
+    results = parcel_segstats(img, atlas_space=ATLAS_SPACE, atlas=atlas, parc_stat=[np.mean, np.max])
+    expected = baseline.parcel_segstats(img, atlas_space=ATLAS_SPACE, atlas=atlas, parc_stat=[np.mean, np.max])
+    baseline.assert_results_equal(results, expected)
+
+    for column in ('stat', 'Atlas', 'region', 'Hemisphere'):
+        assert isinstance(results[column].dtype, pd.CategoricalDtype)
+        # Categories keep the order of first appearance
+        assert list(results[column].cat.categories) == list(pd.unique(expected[column]))
+    assert results['value'].dtype == np.float64
+
+def test_parcel_segstats_wide_output_pivots_long_output():
+    atlas = ['Melbourne_S1', 'Melbourne_S2']
+    img = baseline.random_image('Melbourne_S1', ATLAS_SPACE, seed=41)
+    long_results = parcel_segstats(img, atlas_space=ATLAS_SPACE, atlas=atlas, parc_stat=[np.mean, np.max])
+    wide_results = parcel_segstats(img, atlas_space=ATLAS_SPACE, atlas=atlas, parc_stat=[np.mean, np.max], output='wide')
+
+    assert list(wide_results.columns) == ['mean', 'max']
+    assert len(wide_results) == len(long_results) // 2
+    for stat in wide_results.columns:
+        np.testing.assert_array_equal(wide_results[stat].values,
+                                      long_results.loc[long_results['stat'] == stat, 'value'].values)
+
+    with pytest.raises(ValueError):
+        parcel_segstats(img, atlas_space=ATLAS_SPACE, atlas=atlas, output='tall')
+
+MELBOURNE_SCALES = ['Melbourne_S1', 'Melbourne_S2', 'Melbourne_S3', 'Melbourne_S4']
+HIERARCHY_STATS = [np.size, np.sum, np.mean, np.var, np.std, np.min, np.max]
+
+@pytest.mark.parametrize('n_volumes', [None, 3])
+def test_hierarchical_parcel_segstats_matches_per_parcel_loop(n_volumes):
+    img = baseline.random_image('Melbourne_S1', ATLAS_SPACE, n_volumes=n_volumes, seed=60)
+    results = parcel_segstats(img, atlas_space=ATLAS_SPACE, atlas=MELBOURNE_SCALES, parc_stat=HIERARCHY_STATS,
+                              hierarchical=True)
+    expected = baseline.parcel_segstats(img, atlas_space=ATLAS_SPACE, atlas=MELBOURNE_SCALES, parc_stat=HIERARCHY_STATS)
+    baseline.assert_results_equal(results, expected)
+
+def test_hierarchical_parcel_segstats_rejects_unsupported_statistics():
+    img = baseline.random_image('Melbourne_S1', ATLAS_SPACE, seed=61)
+    with pytest.raises(ValueError):
+        parcel_segstats(img, atlas_space=ATLAS_SPACE, atlas=MELBOURNE_SCALES, parc_stat=np.median, hierarchical=True)
+
+@pytest.mark.parametrize('atlas_space', ['MNI152NLin6Asym', 'MNI152NLin2009cAsym'])
+def test_melbourne_nesting_maps_match_atlas_volumes(atlas_space):
+    nesting = melbourne_nesting_maps(atlas_space)
+    atlas_dir = files("subcortex_visualization.atlases").joinpath(atlas_space)
+    labels = {scale: np.rint(nib.load(atlas_dir.joinpath(f'{scale}/{scale}.nii.gz')).get_fdata()).astype(int)
+              for scale in MELBOURNE_SCALES}
+
+    finest_labels = labels['Melbourne_S4']
+    np.testing.assert_array_equal(nesting['Melbourne_S4'], np.unique(finest_labels[finest_labels > 0]))
+    for finest_label, row in zip(nesting['Melbourne_S4'], nesting.itertuples(index=False)):
+        in_parcel = finest_labels == finest_label
+        for scale in MELBOURNE_SCALES[:-1]:
+            assert np.unique(labels[scale][in_parcel]).tolist() == [getattr(row, scale)]
+
+def _no_resampling(*args, **kwargs):
+    raise AssertionError("the atlas was resampled")
+
+@pytest.mark.parametrize('atlas', ['aseg_subcortex', 'Melbourne_S4', 'Brainstem_Navigator'])
+@pytest.mark.parametrize('grid', ['2mm', '3mm'])
+def test_packaged_pyramid_matches_nearest_resampling(atlas, grid, monkeypatch):
+    grid_affine, grid_shape = segmentation._STANDARD_GRIDS[ATLAS_SPACE][grid]
+    img = nib.Nifti1Image(np.random.default_rng(70).standard_normal(grid_shape), grid_affine)
+    expected = baseline.parcel_segstats(img, atlas_space=ATLAS_SPACE, atlas=atlas, parc_stat=[np.mean, np.size],
+                                        interpolation='nearest')
+
+    # The packaged grid is up to date with the atlas files, so nothing is resampled
+    clear_atlas_cache()
+    monkeypatch.setattr(segmentation, 'resample_img', _no_resampling)
+    results = parcel_segstats(img, atlas_space=ATLAS_SPACE, atlas=atlas, parc_stat=[np.mean, np.size])
+    baseline.assert_results_equal(results, expected)
+
+def test_pyramid_missing_a_label_keeps_region_names():
+    # Crus_I-vermis (label 9) has no voxel on the 3mm grid of the 2009cAsym SUIT atlas
+    atlas_space, atlas = 'MNI152NLin2009cAsym', 'SUIT_cerebellar_lobule'
+    grid_affine, grid_shape = segmentation._STANDARD_GRIDS[atlas_space]['3mm']
+    img = nib.Nifti1Image(np.random.default_rng(80).standard_normal(grid_shape), grid_affine)
+    results = parcel_segstats(img, atlas_space=atlas_space, atlas=atlas)
+    assert 9 not in results['Region_Index'].tolist()
+
+    lut = pd.read_csv(files("subcortex_visualization.atlases").joinpath(f"{atlas_space}/{atlas}/{atlas}_lookup.csv"),
+                      header=None, names=['Index', 'Region'], encoding='utf-8-sig')
+    expected = [segmentation._parse_hemisphere(name) for name in lut.set_index('Index').loc[results['Region_Index'], 'Region']]
+    assert list(zip(results['region'], results['Hemisphere'])) == expected
+    assert results.loc[results['Region_Index'] == 10, ['region', 'Hemisphere']].values.tolist() == [['Crus_I', 'R']]
+
+def test_stale_packaged_pyramid_is_rebuilt(monkeypatch):
+    grid_affine, grid_shape = segmentation._STANDARD_GRIDS[ATLAS_SPACE]['2mm']
+    img = nib.Nifti1Image(np.random.default_rng(74).standard_normal(grid_shape), grid_affine)
+    expected = baseline.parcel_segstats(img, atlas_space=ATLAS_SPACE, atlas='aseg_subcortex', parc_stat=[np.mean, np.size],
+                                        interpolation='nearest')
+
+    # Atlas files that no longer match the packaged grid are resampled again, with a warning
+    monkeypatch.setattr(segmentation, '_source_fingerprint', lambda paths: 'stale')
+    clear_atlas_cache()
+    try:
+        with pytest.warns(UserWarning, match="2mm grid of atlas 'aseg_subcortex' is out of date"):
+            results = parcel_segstats(img, atlas_space=ATLAS_SPACE, atlas='aseg_subcortex', parc_stat=[np.mean, np.size])
+    finally:
+        clear_atlas_cache()
+    baseline.assert_results_equal(results, expected)
+
+def test_source_fingerprint_tracks_contents(tmp_path):
+    source_path = tmp_path / 'atlas.nii.gz'
+    source_path.write_bytes(b'labels-1')
+    fingerprint = segmentation._source_fingerprint([source_path])
+
+    # An in-place edit that keeps the file size must still invalidate derived files
+    source_path.write_bytes(b'labels-2')
+    assert segmentation._source_fingerprint([source_path]) != fingerprint
+
+def _fine_image(atlas, shift, seed=0):
+    """
+    A random image on a 0.5mm grid covering the parcels of an atlas. With ``shift=0`` every other
+    input voxel is centred halfway between two atlas voxels along each axis.
+    """
+    affine, _ = baseline.atlas_grid(atlas, ATLAS_SPACE)
+    labels = np.asanyarray(nib.load(files("subcortex_visualization.atlases").joinpath(f"{ATLAS_SPACE}/{atlas}/{atlas}.nii.gz")).dataobj)
+    coords = np.nonzero(labels)
+    lo = np.array([c.min() for c in coords]) - 1
+    hi = np.array([c.max() for c in coords]) + 2
+    fine_affine = affine.copy()
+    fine_affine[:3, :3] *= 0.5
+    fine_affine[:3, 3] = affine[:3, :3] @ (lo + shift) + affine[:3, 3]
+    return nib.Nifti1Image(np.random.default_rng(seed).standard_normal(tuple(2 * (hi - lo))), fine_affine)
+
+def test_tied_fine_grid_matches_nearest_resampling():
+    img = _fine_image('Melbourne_S2', shift=0, seed=71)
+    results = parcel_segstats(img, atlas_space=ATLAS_SPACE, atlas='Melbourne_S2', parc_stat=[np.mean, np.size],
+                              interpolation='nearest')
+    expected = baseline.parcel_segstats(img, atlas_space=ATLAS_SPACE, atlas='Melbourne_S2', parc_stat=[np.mean, np.size],
+                                        interpolation='nearest')
+    baseline.assert_results_equal(results, expected)
+
+    # No nearest atlas voxel for half of the input voxels, so no label is guessed without interpolation
+    with pytest.raises(ValueError):
+        parcel_segstats(img, atlas_space=ATLAS_SPACE, atlas='Melbourne_S2')
+
+def test_untied_fine_grid_matches_nearest_resampling(monkeypatch):
+    img = _fine_image('Melbourne_S2', shift=0.25, seed=72)
+    expected = baseline.parcel_segstats(img, atlas_space=ATLAS_SPACE, atlas='Melbourne_S2', parc_stat=[np.mean, np.size],
+                                        interpolation='nearest')
+
+    monkeypatch.setattr(segmentation, 'resample_img', _no_resampling)
+    results = parcel_segstats(img, atlas_space=ATLAS_SPACE, atlas='Melbourne_S2', parc_stat=[np.mean, np.size],
+                              interpolation='nearest')
+    baseline.assert_results_equal(results, expected)
+
+def test_default_interpolation_matches_nearest_resampling_on_shifted_grids(monkeypatch):
+    # The standard 2mm grid uses the packaged pyramid; shifting it by one atlas voxel uses index arithmetic
+    grid_affine, grid_shape = segmentation._STANDARD_GRIDS[ATLAS_SPACE]['2mm']
+    shifted_affine = grid_affine.copy()
+    shifted_affine[:3, 3] += grid_affine[:3, 0] / 2
+    images = [nib.Nifti1Image(np.random.default_rng(seed).standard_normal(grid_shape), affine)
+              for seed, affine in ((75, grid_affine), (76, shifted_affine))]
+    expected = [baseline.parcel_segstats(img, atlas_space=ATLAS_SPACE, atlas='Melbourne_S2', parc_stat=[np.mean, np.size],
+                                         interpolation='nearest') for img in images]
+
+    monkeypatch.setattr(segmentation, 'resample_img', _no_resampling)
+    for img, img_expected in zip(images, expected):
+        results = parcel_segstats(img, atlas_space=ATLAS_SPACE, atlas='Melbourne_S2', parc_stat=[np.mean, np.size])
+        baseline.assert_results_equal(results, img_expected)
+
+def _overlap_fractions(labels, transform, input_shape):
+    """
+    Fraction of each input voxel covered by each label, from the overlaps of voxel intervals along each axis.
+    Input voxels reaching outside ``labels`` count the outside as background (label 0).
+    """
+    scale, offset = transform
+    axis_weights = []
+    for axis in range(3):
+        centre = scale[axis] * np.arange(input_shape[axis]) + offset[axis]
+        half = abs(scale[axis]) / 2
+        atlas_voxel = np.arange(labels.shape[axis])
+        overlap = np.minimum(centre[:, None] + half, atlas_voxel + 0.5) - np.maximum(centre[:, None] - half, atlas_voxel - 0.5)
+        axis_weights.append(np.clip(overlap, 0, None) / abs(scale[axis]))
+    fractions = {int(label): np.einsum('ai,bj,ck,ijk->abc', *axis_weights, (labels == label).astype(float), optimize=True)
+                 for label in np.unique(labels)}
+    fractions[0] = fractions.get(0, 0) + 1 - sum(fractions.values())
+    return fractions
+
+COARSER_TRANSFORMS = [
+    ([2, 2, 2], [0, 0, 0]),
+    ([2, 2, 2], [0.5, 1.5, -0.5]),
+    ([3, 3, 3], [1, 0, 2]),
+    ([-2, 3, 2], [11.5, -1, 0.25]),
+]
+
+@pytest.mark.parametrize('scale, offset', COARSER_TRANSFORMS)
+def test_majority_labels_cover_most_of_each_input_voxel(scale, offset):
+    labels = np.random.default_rng(77).integers(0, 4, (12, 10, 9)).astype(np.uint8)
+    transform = (np.array(scale, dtype=float), np.array(offset, dtype=float))
+    input_shape = (8, 6, 7)
+    mapped = segmentation._labels_by_index(labels, transform, input_shape, mode='majority')
+
+    # Ties may go to any of the labels covering the most volume
+    fractions = _overlap_fractions(labels, transform, input_shape)
+    chosen = sum(np.where(mapped == label, fraction, 0) for label, fraction in fractions.items())
+    np.testing.assert_allclose(chosen, np.max(list(fractions.values()), axis=0))
+
+@pytest.mark.parametrize('scale, offset', COARSER_TRANSFORMS)
+def test_weighted_index_layout_matches_voxel_overlaps(scale, offset):
+    labels = np.random.default_rng(78).integers(0, 4, (12, 10, 9)).astype(np.uint8)
+    transform = (np.array(scale, dtype=float), np.array(offset, dtype=float))
+    input_shape = (8, 6, 7)
+    label_ids, index, offsets, weights = segmentation._weighted_index_layout(labels, transform, input_shape)
+
+    fractions = _overlap_fractions(labels, transform, input_shape)
+    assert label_ids.tolist() == [label for label in sorted(fractions) if label != 0 and np.any(fractions[label] > 1e-9)]
+    for parcel, label in enumerate(label_ids):
+        parcel_slice = slice(offsets[parcel], offsets[parcel + 1])
+        expected_index = np.flatnonzero(fractions[label].ravel() > 1e-9)
+        np.testing.assert_array_equal(index[parcel_slice], expected_index)
+        np.testing.assert_allclose(weights[parcel_slice], fractions[label].ravel()[expected_index])
+
+def test_weighted_timeseries_on_standard_grid_use_partial_volumes():
+    atlas = 'Melbourne_S1'
+    atlas_vol = nib.load(files("subcortex_visualization.atlases").joinpath(f"{ATLAS_SPACE}/{atlas}/{atlas}.nii.gz"))
+    labels = np.asanyarray(atlas_vol.dataobj)
+    grid_affine, grid_shape = segmentation._STANDARD_GRIDS[ATLAS_SPACE]['2mm']
+    img = nib.Nifti1Image(np.random.default_rng(79).standard_normal(grid_shape + (3,)), grid_affine)
+
+    # Crop the atlas to its parcels to keep the explicit overlaps cheap
+    voxel_map = np.linalg.solve(atlas_vol.affine, grid_affine)
+    lo = np.array([c.min() for c in np.nonzero(labels)]) - 2
+    hi = np.array([c.max() for c in np.nonzero(labels)]) + 3
+    fractions = _overlap_fractions(labels[tuple(slice(l, h) for l, h in zip(lo, hi))],
+                                   (np.diag(voxel_map)[:3], voxel_map[:3, 3] - lo), grid_shape)
+
+    data = img.get_fdata().reshape(-1, 3)
+    expected = [fractions[label].ravel() @ data / fractions[label].sum() for label in sorted(fractions) if label != 0]
+    timeseries = parcel_timeseries(img, atlas_space=ATLAS_SPACE, atlas=atlas, weighted=True)
+    np.testing.assert_allclose(timeseries, expected)
+
+@pytest.mark.parametrize('atlas_space', ['MNI152NLin6Asym', 'MNI152NLin2009cAsym'])
+def test_packaged_atlases_are_compact_integers(atlas_space):
+    space_dir = files("subcortex_visualization.atlases").joinpath(atlas_space)
+    for atlas_dir in sorted(space_dir.iterdir(), key=lambda d: d.name):
+        if not atlas_dir.is_dir() or atlas_dir.name.startswith('__'):
+            continue
+        for volume_path in sorted(atlas_dir.iterdir(), key=lambda f: f.name):
+            if not volume_path.name.endswith('.nii.gz') or '_res-' in volume_path.name:
+                continue
+            vol = nib.load(volume_path)
+            labels = segmentation._decode_labels(vol)
+            np.testing.assert_array_equal(labels, np.round(vol.get_fdata()))
+            assert labels.dtype == (np.uint8 if labels.max() <= 255 else np.uint16)
+            assert vol.get_data_dtype() == labels.dtype
+
+def test_compact_labels_rounds_to_the_smallest_dtype():
+    labels = segmentation._compact_labels(np.array([0.0, 1.9999, 300.0001]))
+    np.testing.assert_array_equal(labels, [0, 2, 300])
+    assert labels.dtype == np.uint16
+    assert np.issubdtype(segmentation._compact_labels(np.array([-1.0, 2.0])).dtype, np.signedinteger)
+
+def test_reencode_atlas_volumes_keeps_labels(tmp_path, monkeypatch):
+    # A float atlas in a space without standard grids, so no pyramid is built
+    atlas_dir = tmp_path / 'TestSpace' / 'toy'
+    atlas_dir.mkdir(parents=True)
+    labels = np.random.default_rng(73).integers(0, 20, (12, 10, 8))
+    float_vol = nib.Nifti1Image(labels.astype(np.float32), np.eye(4))
+    nib.save(float_vol, str(atlas_dir / 'toy.nii.gz'))
+    monkeypatch.setattr(segmentation, 'files', lambda package: tmp_path)
+
+    assert segmentation.reencode_atlas_volumes('TestSpace', 'toy') == [str(atlas_dir / 'toy.nii.gz')]
+    compact_vol = nib.load(atlas_dir / 'toy.nii.gz')
+    assert compact_vol.get_data_dtype() == np.uint8
+    np.testing.assert_array_equal(np.asanyarray(compact_vol.dataobj), labels)
+    np.testing.assert_array_equal(compact_vol.affine, np.eye(4))
+
+    # Already compact volumes are left alone
+    assert segmentation.reencode_atlas_volumes('TestSpace', 'toy') == []
+
+def test_reencode_atlas_volumes_keeps_smaller_files(tmp_path, monkeypatch):
+    atlas_dir = tmp_path / 'TestSpace' / 'toy'
+    atlas_dir.mkdir(parents=True)
+    labels = np.random.default_rng(81).integers(0, 20, (12, 10, 8))
+    nib.save(nib.Nifti1Image(labels.astype(np.float32), np.eye(4)), str(atlas_dir / 'toy.nii.gz'))
+    original = (atlas_dir / 'toy.nii.gz').read_bytes()
+    monkeypatch.setattr(segmentation, 'files', lambda package: tmp_path)
+
+    # A compact file that would be larger than the current one is not written
+    monkeypatch.setattr(segmentation, '_compressed_nifti_bytes', lambda img: b'0' * (len(original) + 1))
+    assert segmentation.reencode_atlas_volumes('TestSpace', 'toy') == []
+    assert (atlas_dir / 'toy.nii.gz').read_bytes() == original
+
+@pytest.mark.parametrize('n_threads', [1, 4])
+def test_concurrent_atlases_match_per_parcel_loop(n_threads):
+    atlas = MELBOURNE_SCALES + ['Brainstem_Navigator', 'Melbourne_S2']
+    img = baseline.random_image('Melbourne_S1', ATLAS_SPACE, n_volumes=3, seed=90)
+    results = parcel_segstats(img, atlas_space=ATLAS_SPACE, atlas=atlas, parc_stat=STATS, chunk_size=2,
+                              n_threads=n_threads)
+    expected = baseline.parcel_segstats(img, atlas_space=ATLAS_SPACE, atlas=atlas, parc_stat=STATS)
+    baseline.assert_results_equal(results, expected)
+
+def test_map_atlases_keeps_item_order():
+    items = list(range(20))
+    assert segmentation._map_atlases(lambda item: item * item, items, n_threads=4) == [item * item for item in items]